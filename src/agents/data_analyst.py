@@ -1,15 +1,20 @@
 import os, sys
 project_root = os.path.abspath(os.path.join(__file__, "../../.."))
 sys.path.insert(0, project_root)  # add repo entrypoint to python path
-from typing import Dict, TypedDict, Literal, Annotated, Optional, Sequence, Type, Union, List, Any
+from typing import Dict, TypedDict, Literal, Annotated, Optional, Sequence, Tuple, Type, Union, List, Any
 
 import langsmith as ls
 from langsmith import traceable
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
 from langgraph.checkpoint.memory import BaseCheckpointSaver, InMemorySaver
 from langgraph.types import Command
 from langgraph.graph import MessagesState, StateGraph, START, END
-from src.tools.local_python_executor import local_python_executor, BASE_BUILTIN_MODULES
+from src.tools.local_python_executor import (
+    local_python_executor, alocal_python_executor, BASE_BUILTIN_MODULES, ExecutionBudget, ExecutionBudgetError
+)
+from src.tools.state_snapshot import prune_state_snapshots
 from src.utils.prompts import SYSTEM_PROMPT_DATA_ANALYST, POSTGRES_PROMPT, SQLITE_PROMPT
 from src.utils.agent_utils import create_agent, get_llm, chatbot
 import src.configs.config as cfg
@@ -27,32 +32,102 @@ with ls.tracing_context(enabled=True):
 CUSTOM_MODULES = ['sqlalchemy', 'sqlite3', "matplotlib", 'dotenv', 'os', 'sys', 'pandas']
 AUTHORIZED_IMPORTS = list(set(BASE_BUILTIN_MODULES) | set(CUSTOM_MODULES))
 
+# Limits of every python tool call
+EXECUTION_BUDGET = ExecutionBudget(
+    max_seconds=cfg.PYTHON_EXECUTOR_MAX_SECONDS,
+    max_memory_bytes=cfg.PYTHON_EXECUTOR_MAX_MEMORY_MB * 1024**2,
+    max_output_chars=cfg.PYTHON_EXECUTOR_MAX_OUTPUT_CHARS,
+)
+
+# Drop the snapshots of conversation threads that have not resumed for a long time
+if cfg.PYTHON_SNAPSHOT_DIR:
+    prune_state_snapshots(cfg.PYTHON_SNAPSHOT_DIR)
+
 # @tool("python_tool", description="Execute Python code. Inputs: code (str).")
 @traceable(run_type="tool", name="Local Python executor")
-def python_tool(code: str):
+def python_tool(code: str, config: RunnableConfig = None):
     """Execute Python code safely with restricted imports.
 
+    Variables, imports and functions defined by previous calls of the same conversation thread are kept.
+
+    Args:
+        code (str): The code to execute.
+        config (RunnableConfig): Run configuration injected by LangGraph, used to find the thread id.
+
+    Returns:
+        The result of the execution, and the metrics of the call (engine, operations, time, memory...) as artifact.
+    """
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    try:
+        return local_python_executor(
+            code, AUTHORIZED_IMPORTS, session_id=thread_id, with_metrics=True, **executor_options()
+        )
+    except Exception as e:
+        return tool_error(e)
+
+@traceable(run_type="tool", name="Local Python executor")
+async def apython_tool(code: str, config: RunnableConfig = None):
+    """Async version of python_tool, used by async graph runs: the code runs in a bounded thread pool and is stopped
+    if the run is cancelled.
+
     Args:
         code (str): The code to execute.
+        config (RunnableConfig): Run configuration injected by LangGraph, used to find the thread id.
 
     Returns:
-        The result of the execution.
+        The result of the execution, and the metrics of the call as artifact.
     """
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
     try:
-        return local_python_executor(code, AUTHORIZED_IMPORTS)
+        return await alocal_python_executor(
+            code,
+            AUTHORIZED_IMPORTS,
+            session_id=thread_id,
+            with_metrics=True,
+            max_concurrency=cfg.PYTHON_EXECUTOR_MAX_CONCURRENCY,
+            **executor_options(),
+        )
     except Exception as e:
+        return tool_error(e)
+
+def executor_options() -> Dict[str, Any]:
+    """Options of the python executor from the config."""
+    return dict(
+        backend=cfg.PYTHON_EXECUTOR_BACKEND,
+        engine=cfg.PYTHON_EXECUTOR_ENGINE,
+        profile=cfg.PYTHON_EXECUTOR_PROFILE,
+        memoize_statements=cfg.PYTHON_EXECUTOR_MEMOIZE,
+        artifact_dir=cfg.PYTHON_ARTIFACT_DIR,
+        budget=EXECUTION_BUDGET,
+        snapshot_dir=cfg.PYTHON_SNAPSHOT_DIR,
+    )
+
+def tool_error(e: Exception) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """Result of python_tool for a failed execution, with the metrics of the call as artifact if they were collected."""
+    metrics = getattr(e, "metrics", None)
+    if isinstance(e, ExecutionBudgetError):
         return {
             "error": str(e),
+            "budget_exceeded": e.details,
             "recovery_plan": (
-                "Inspect error → Verify assumptions → Take countermeasures → Retry"
+                "Reduce the work of the code (see hint) → Retry"
                 )
-            }
-# Build tool
-# python_tool = StructuredTool.from_function(
-#     func=python_tool,
-#     name="python_tool",
-#     description="Execute Python code. Inputs: code (str)."
-#     )
+            }, metrics
+    return {
+        "error": str(e),
+        "recovery_plan": (
+            "Inspect error → Verify assumptions → Take countermeasures → Retry"
+            )
+        }, metrics
+
+# Build tool: sync graph runs call python_tool, async ones await apython_tool instead of blocking a thread
+python_tool = StructuredTool.from_function(
+    func=python_tool,
+    coroutine=apython_tool,
+    name="python_tool",
+    # The metrics of the call go to the ToolMessage artifact (traces, logs), not to the LLM
+    response_format="content_and_artifact",
+    )
 
 # Initialize in-memory checkpointing
 checkpointer = InMemorySaver()  
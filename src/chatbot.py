@@ -10,6 +10,7 @@ from langchain_chroma import Chroma # local
 from src.utils.data_ingest_sqlite import ingest_file_sqlite
 from src.utils.data_ingest_vectordb import ingest_pdf_vectordb
 from src.agents.supervisor import supervisor_agent as chatbot 
+from src.tools.local_python_executor import EXECUTOR_SESSIONS
 from src.configs import config as cfg
 
 # =====Environment variables=====
@@ -41,6 +42,9 @@ def reset(clear_all: bool = True):
             except Exception as e:
                 print(f"Warning: Failed to delete temp entry {name}: {e}")
 
+    # Drop the python executor session of the old thread
+    EXECUTOR_SESSIONS.close(st.session_state["thread_id"])
+
     # reset thread + messages
     st.session_state["thread_id"] = generate_thread_id()
     st.session_state["message_history"] = []
@@ -74,7 +78,7 @@ st.sidebar.subheader("📂 Dataset Source")
 # Upload files and handle it
 uploaded_file = st.sidebar.file_uploader(
     "Upload a file",
-    type=["csv", "txt", "json", "xls", "xlsx", "pdf"],     
+    type=["csv", "txt", "json", "jsonl", "ndjson", "xls", "xlsx", "pdf"],     
     accept_multiple_files=False,
     key=st.session_state["file_uploader_key"]
 )
@@ -109,11 +113,13 @@ if uploaded_file:
                 )
 
             # Ingest into Sqlite DB
-            elif file_type in ("csv", "txt", "json", "xls", "xlsx"):
+            elif file_type in ("csv", "txt", "json", "jsonl", "ndjson", "xls", "xlsx"):
                 ingest_file_sqlite(
                     file_path=file_path,
                     db_path=os.path.join(TEMP_PATH,"ingested.db"),
-                    table_name=filename.split(".")[0]
+                    table_name=filename.split(".")[0],
+                    chunksize=cfg.INGEST_CHUNK_ROWS,
+                    if_exists=cfg.INGEST_IF_EXISTS
                     )
             else:
                 status_box.update(label="❌ Ingestion failed", state="error", expanded=False)
@@ -27,6 +27,42 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres")
 # SQlite DB
 DB_PATH = os.getenv("DB_PATH", "data/temp/ingested.db")
 
+# Rows of an uploaded file read, cleaned and written to the SQLite DB at a time, 0 to load the whole file at once
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "100000"))
+
+# Ingesting a file into an existing table: "replace" the table, "append" the rows or "upsert" them on its key column.
+# A file already ingested into the table (same content hash) is always skipped.
+INGEST_IF_EXISTS = os.getenv("INGEST_IF_EXISTS", "replace")
+
+# Python executor backend: "local" (in-process) or "process" (pool of worker processes)
+PYTHON_EXECUTOR_BACKEND = os.getenv("PYTHON_EXECUTOR_BACKEND", "local")
+
+# Python executor engine: "compiled" (sandbox interpreter) or "native" (CPython bytecode for statically verified code)
+PYTHON_EXECUTOR_ENGINE = os.getenv("PYTHON_EXECUTOR_ENGINE", "compiled")
+
+# Log a per-node-type, per-line and native callee time report for every python tool call
+PYTHON_EXECUTOR_PROFILE = os.getenv("PYTHON_EXECUTOR_PROFILE", "false").lower() == "true"
+
+# Skip the leading statements of a script resubmitted after a failure that already succeeded on the unchanged session
+# variables. Off by default: in-place changes of the variables that keep their size are not detected
+PYTHON_EXECUTOR_MEMOIZE = os.getenv("PYTHON_EXECUTOR_MEMOIZE", "false").lower() == "true"
+
+# Directory of the full DataFrames / arrays returned by the python tool, which only sends a preview to the LLM
+PYTHON_ARTIFACT_DIR = os.getenv("PYTHON_ARTIFACT_DIR", "data/temp/artifacts")
+
+# Budgets of a single python tool call: wall-clock seconds, growth of the resident memory (MB) and printed characters.
+# The memory budget is only enforced by the "process" backend, the app process being shared by concurrent calls
+PYTHON_EXECUTOR_MAX_SECONDS = float(os.getenv("PYTHON_EXECUTOR_MAX_SECONDS", "120"))
+PYTHON_EXECUTOR_MAX_MEMORY_MB = int(os.getenv("PYTHON_EXECUTOR_MAX_MEMORY_MB", "2048"))
+PYTHON_EXECUTOR_MAX_OUTPUT_CHARS = int(os.getenv("PYTHON_EXECUTOR_MAX_OUTPUT_CHARS", "1000000"))
+
+# Python tool calls running at once in async graph runs, the others wait for a free thread
+PYTHON_EXECUTOR_MAX_CONCURRENCY = int(os.getenv("PYTHON_EXECUTOR_MAX_CONCURRENCY", "8"))
+
+# Directory of the snapshots of the python tool variables of every conversation thread, restored after a restart,
+# e.g. "data/temp/snapshots". Disabled if empty (default).
+PYTHON_SNAPSHOT_DIR = os.getenv("PYTHON_SNAPSHOT_DIR", "") or None
+
 # Langsmith
 LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING")
 LANGSMITH_ENDPOINT = os.getenv("LANGSMITH_ENDPOINT")
@@ -0,0 +1,118 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+import tempfile
+import time
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import src.utils.data_cleaning as dc
+from src.utils.data_ingest_sqlite import ingest_file_sqlite, sniff_csv
+
+# Readers of a CSV file, "python" is the engine used before the format was sniffed
+READERS: Dict[str, Callable[[Path], pd.DataFrame]] = {
+    "python": lambda path: pd.read_csv(path, sep=None, engine="python"),
+    "c": lambda path: pd.read_csv(path, engine="c", **sniff_csv(path)),
+    "pyarrow": lambda path: pd.read_csv(path, engine="pyarrow", **sniff_csv(path)),
+}
+GENERATE_BLOCK_ROWS = 500_000
+
+
+def generate_csv(path: Path, rows: int, sep: str = ",", seed: int = 0) -> Path:
+    """Write a CSV file like a financial export: ids, low-cardinality text and integers, floats, free text and dates."""
+    rng = np.random.default_rng(seed)
+    companies = np.array([f"Company {i}" for i in range(500)])
+    with open(path, "w", encoding="utf-8") as f:
+        for start in range(0, rows, GENERATE_BLOCK_ROWS):
+            n = min(GENERATE_BLOCK_ROWS, rows - start)
+            block = pd.DataFrame(
+                {
+                    "Order ID": np.arange(start, start + n),
+                    "Company": companies[rng.integers(0, len(companies), n)],
+                    "Fiscal Year": rng.integers(2000, 2025, n),
+                    "Revenue": rng.normal(1e6, 2.5e5, n).round(2),
+                    "Margin": rng.random(n),
+                    "Note": np.where(rng.random(n) < 0.1, "n/a", "ok"),
+                    "Date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1800, n), unit="D"),
+                }
+            )
+            block.to_csv(f, sep=sep, index=False, header=start == 0)
+    return path
+
+
+def time_reader(name: str, path: Path, repeat: int) -> Dict[str, float]:
+    """Time a reader and the cleaning of what it read, best of `repeat` runs."""
+    read_timings, clean_timings = [], []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = READERS[name](path)
+        read_timings.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        rows = len(dc.standardize_dataframe(df))
+        clean_timings.append(time.perf_counter() - start)
+        del df
+    read, clean = min(read_timings), min(clean_timings)
+    return {"read": read, "clean": clean, "total": read + clean, "rows_per_second": rows / (read + clean)}
+
+
+def time_ingestion(path: Path, chunksize: Optional[int]) -> Dict[str, float]:
+    """Time `ingest_file_sqlite` of the file into a new database."""
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        ingest_file_sqlite(str(path), os.path.join(directory, "benchmark.db"), "benchmark", chunksize)
+        seconds = time.perf_counter() - start
+    return {"total": seconds}
+
+
+def format_results(results: Dict[str, Dict[str, float]], reference: str = "python") -> str:
+    """Table of the results, with the speedup of the total time against the reference reader."""
+    header = f"{'reader':<28} {'read':>9} {'clean':>9} {'total':>9} {'rows/s':>12} {'speedup':>8}"
+    lines = [header, "-" * len(header)]
+    for key, result in results.items():
+        read = f"{result['read']:.2f}s" if "read" in result else "-"
+        clean = f"{result['clean']:.2f}s" if "clean" in result else "-"
+        rows_per_second = f"{result['rows_per_second']:,.0f}" if "rows_per_second" in result else "-"
+        speedup = f"{results[reference]['total'] / result['total']:.1f}x" if reference in results else "-"
+        lines.append(f"{key:<28} {read:>9} {clean:>9} {result['total']:>8.2f}s {rows_per_second:>12} {speedup:>8}")
+    return "\n".join(lines)
+
+
+def run_benchmarks(path: Path, readers: List[str], repeat: int, ingest: bool, chunksize: int) -> Dict[str, Dict[str, float]]:
+    """Time the readers on the file, then the whole ingestion if `ingest`, returns the results keyed by name."""
+    results = {}
+    for name in readers:
+        if name == "pyarrow" and find_spec("pyarrow") is None:
+            print("[SKIP] pyarrow: requires pyarrow")
+            continue
+        results[name] = time_reader(name, path, repeat)
+    if ingest:
+        results["ingest (whole file)"] = time_ingestion(path, None)
+        results[f"ingest (chunks of {chunksize:,})"] = time_ingestion(path, chunksize)
+    return results
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the CSV readers of the SQLite ingestion on a generated file")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Rows of the generated CSV file")
+    parser.add_argument("--file_path", type=str, default=None, help="CSV file to read instead of a generated one")
+    parser.add_argument("--readers", nargs="+", default=list(READERS), choices=list(READERS), help="Readers to benchmark")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of timed runs per reader, the best is kept")
+    parser.add_argument("--ingest", action="store_true", help="Also time the whole ingestion into SQLite")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Rows per chunk of the chunked ingestion")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.file_path is None:
+            path = generate_csv(Path(directory) / "benchmark.csv", args.rows)
+            print(f"[OK] Generated {args.rows:,} rows ({path.stat().st_size / 1024**2:,.0f} MiB)")
+        else:
+            path = Path(args.file_path)
+        results = run_benchmarks(path, args.readers, args.repeat, args.ingest, args.chunksize)
+    print(format_results(results))
@@ -0,0 +1,346 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from src.tools.local_python_executor import BASE_PYTHON_TOOLS, LocalPythonExecutor, evaluate_python_code
+
+BASELINE_PATH = Path(__file__).with_name("benchmark_python_executor_baseline.json")
+ENGINES = ["ast", "compiled", "native"]
+REGRESSION_TOLERANCE = 0.2  # slower than the baseline by more than 20% is a regression
+REGRESSION_MIN_SECONDS = 0.005  # ... and by more than 5ms, shorter changes are noise
+REGRESSION_RETIMES = 2  # times a regressed benchmark is timed again before it is reported, see `retime`
+CALIBRATION_LOOPS = 2_000_000
+
+
+def calibrate(repeat: int) -> float:
+    """Time a plain python loop, median of `repeat` runs. Timings are divided by it to compare them across machines."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = 0
+        for i in range(CALIBRATION_LOOPS):
+            total += i % 7
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+class Benchmark:
+    """A piece of code to time, either with `evaluate_python_code` or in a `LocalPythonExecutor` session.
+
+    Args:
+        name (str): Name of the benchmark, used as key in the baseline
+        code (str): Timed code
+        setup (str): Code run once in the same state before timing, e.g. to build a dataframe
+        requires (Sequence[str]): Modules that must be installed, the benchmark is skipped otherwise
+        executor (bool): Run in a `LocalPythonExecutor` (no tools, like the data analyst) instead of
+            `evaluate_python_code` with the base python tools
+    """
+
+    def __init__(
+        self,
+        name: str,
+        code: str,
+        setup: str = "",
+        requires: Sequence[str] = (),
+        executor: bool = False,
+    ):
+        self.name = name
+        self.code = code
+        self.setup = setup
+        self.requires = list(requires)
+        self.executor = executor
+
+    def is_available(self) -> bool:
+        return all(find_spec(module) is not None for module in self.requires)
+
+    def prepare(self, engine: str) -> Callable[[], int]:
+        """Run the setup in a fresh state, returns a function running the timed code and returning its operations."""
+        if self.executor:
+            executor = LocalPythonExecutor(self.requires, engine=engine)
+            if self.setup:
+                executor(self.setup)
+
+            def run_in_executor():
+                executor(self.code)
+                return executor.state["_operations_count"]["counter"]
+
+            return run_in_executor
+
+        state = {}
+        if self.setup:
+            evaluate_python_code(self.setup, static_tools=BASE_PYTHON_TOOLS, state=state, engine=engine)
+
+        def run_evaluate():
+            evaluate_python_code(
+                self.code, static_tools=BASE_PYTHON_TOOLS, state=state, authorized_imports=self.requires, engine=engine
+            )
+            return state["_operations_count"]["counter"]
+
+        return run_evaluate
+
+
+BENCHMARKS = [
+    Benchmark(
+        "tight_loop",
+        "total = 0\nfor i in range(100000):\n    if i % 3 == 0:\n        total += i * 2\n    else:\n        total -= 1",
+    ),
+    Benchmark(
+        "while_loop",
+        "i = 0\nacc = 0\nwhile i < 50000:\n    acc += i\n    i += 1",
+    ),
+    Benchmark(
+        "comprehensions",
+        "squares = [x * x for x in range(50000) if x % 2]\n"
+        "lookup = {x: str(x) for x in range(20000)}\n"
+        "unique = {x % 97 for x in range(20000)}\n"
+        "total = sum(x for x in range(50000))",
+    ),
+    Benchmark(
+        "recursion",
+        "def fib(n):\n    if n < 2:\n        return n\n    return fib(n - 1) + fib(n - 2)\nfib(18)",
+    ),
+    Benchmark(
+        "classes",
+        "class Point:\n"
+        "    def __init__(self, x, y):\n"
+        "        self.x = x\n"
+        "        self.y = y\n"
+        "    def norm2(self):\n"
+        "        return self.x * self.x + self.y * self.y\n"
+        "points = [Point(i, i + 1) for i in range(5000)]\n"
+        "total = 0\n"
+        "for p in points:\n"
+        "    total += p.norm2()",
+    ),
+    Benchmark(
+        "long_print",
+        "for i in range(20000):\n    print('row', i, 'x' * 40)",
+    ),
+    Benchmark(
+        "pandas_attributes",
+        "i = 0\n"
+        "while i < 100:\n"
+        "    by_key = df.groupby('k')['v'].sum()\n"
+        "    mean = df['v'].mean()\n"
+        "    top = df.assign(w=df['v'] * 2).query('w > 10').sort_values('w', ascending=False).head(10)\n"
+        "    records = top.to_dict('records')\n"
+        "    i += 1",
+        setup="import numpy as np\nimport pandas as pd\n"
+        "df = pd.DataFrame({'k': np.arange(100000) % 10, 'v': np.arange(100000)})",
+        requires=["numpy", "pandas"],
+        executor=True,
+    ),
+    Benchmark(
+        "import_pandas_warm",
+        "import pandas as pd\nimport numpy as np",
+        requires=["numpy", "pandas"],
+        executor=True,
+    ),
+]
+
+# Cold import of pandas in a new interpreter, timed by the child process itself
+COLD_IMPORT_SCRIPT = f"""
+import sys, time
+sys.path.insert(0, {project_root!r})
+from src.tools.local_python_executor import LocalPythonExecutor
+start = time.perf_counter()
+LocalPythonExecutor(["pandas"], engine=sys.argv[1])("import pandas as pd")
+print(time.perf_counter() - start)
+"""
+
+
+def time_benchmark(benchmark: Benchmark, engine: str, repeat: int) -> Dict[str, float]:
+    """Time a benchmark: best and median of `repeat` runs, then one run under tracemalloc for the peak memory."""
+    timings = []
+    operations = 0
+    for _ in range(repeat):
+        run = benchmark.prepare(engine)
+        start = time.perf_counter()
+        operations = run()
+        timings.append(time.perf_counter() - start)
+    run = benchmark.prepare(engine)
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds = min(timings)
+    return {
+        "seconds": seconds,
+        "median_seconds": statistics.median(timings),
+        "runs_per_second": 1 / seconds,
+        # The native engine only counts loop iterations: no count for code without loops
+        "ops_per_second": operations / seconds if operations else None,
+        "peak_kib": peak / 1024,
+    }
+
+
+def time_cold_import(engine: str, repeat: int) -> Optional[Dict[str, float]]:
+    if find_spec("pandas") is None:
+        return None
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_IMPORT_SCRIPT, engine], capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    seconds = min(timings)
+    return {
+        "seconds": seconds,
+        "median_seconds": statistics.median(timings),
+        "runs_per_second": 1 / seconds,
+        "ops_per_second": None,
+        "peak_kib": None,
+    }
+
+
+def run_benchmarks(engines: List[str], repeat: int, names: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    """Run the benchmark suite, returns the results keyed by "<benchmark>[<engine>]"."""
+    results = {}
+    for engine in engines:
+        for benchmark in BENCHMARKS:
+            if names and benchmark.name not in names:
+                continue
+            if not benchmark.is_available():
+                print(f"[SKIP] {benchmark.name}[{engine}]: requires {', '.join(benchmark.requires)}")
+                continue
+            results[f"{benchmark.name}[{engine}]"] = time_benchmark(benchmark, engine, repeat)
+        if not names or "import_pandas_cold" in names:
+            cold_import = time_cold_import(engine, repeat)
+            if cold_import is None:
+                print(f"[SKIP] import_pandas_cold[{engine}]: requires pandas")
+            else:
+                results[f"import_pandas_cold[{engine}]"] = cold_import
+    return results
+
+
+def retime(results: Dict[str, Dict[str, float]], keys: List[str], repeat: int) -> None:
+    """Time the benchmarks of some results again, keeping the faster run. A busy machine slows down whole runs, so a
+    regression is only reported if it shows every time."""
+    for key in keys:
+        name, engine = key[:-1].split("[")
+        for retimed_key, result in run_benchmarks([engine], repeat, [name]).items():
+            if result["seconds"] < results[retimed_key]["seconds"]:
+                results[retimed_key] = result
+
+
+def compared_seconds(result: Dict[str, float], baseline_result: Dict[str, float]) -> Tuple[float, float]:
+    """Best time of a result and median time of its baseline (the best one for baselines recorded without medians):
+    a regression is when even the best run is slower than a typical run of the baseline."""
+    return result["seconds"], baseline_result.get("median_seconds", baseline_result["seconds"])
+
+
+def relative_change(seconds: float, baseline_seconds: float, scale: float) -> float:
+    """Change of a time against its baseline, the baseline being first multiplied by `scale`."""
+    return seconds / (baseline_seconds * scale) - 1
+
+
+def is_regression(seconds: float, baseline_seconds: float, scale: float) -> bool:
+    return (
+        relative_change(seconds, baseline_seconds, scale) > REGRESSION_TOLERANCE
+        and seconds - baseline_seconds * scale > REGRESSION_MIN_SECONDS
+    )
+
+
+def format_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Optional[Dict[str, Dict[str, float]]] = None,
+    scale: float = 1.0,
+) -> str:
+    """Table of the results, with the change of time against the baseline when given (see `compared_seconds`),
+    scaled by `scale`.
+
+    ops/s counts the operations of the interpreter: nodes for "ast", statements and loop elements for "compiled" and
+    loop iterations for "native". Compare it between runs of the same engine only. It is "-" where nothing is counted.
+    """
+    header = f"{'benchmark':<32} {'time':>10} {'ops/s':>12} {'peak':>12}"
+    if baseline is not None:
+        header += f" {'vs baseline':>12}"
+    lines = [header, "-" * len(header)]
+    for key, result in results.items():
+        ops_per_second = f"{result['ops_per_second']:,.0f}" if result["ops_per_second"] else "-"
+        peak = f"{result['peak_kib']:,.0f}KiB" if result["peak_kib"] is not None else "-"
+        line = f"{key:<32} {result['seconds'] * 1000:>8.1f}ms {ops_per_second:>12} {peak:>12}"
+        if baseline is not None:
+            if key in baseline:
+                seconds, baseline_seconds = compared_seconds(result, baseline[key])
+                change = relative_change(seconds, baseline_seconds, scale)
+                flag = "  REGRESSION" if is_regression(seconds, baseline_seconds, scale) else ""
+                line += f" {change:>+11.0%}{flag}"
+            else:
+                line += f" {'new':>12}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def find_regressions(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], scale: float = 1.0
+) -> List[str]:
+    return [
+        key
+        for key, result in results.items()
+        if key in baseline and is_regression(*compared_seconds(result, baseline[key]), scale)
+    ]
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark the sandboxed python executor of the data analyst")
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES, help="Engines to benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per benchmark")
+    parser.add_argument("--only", nargs="+", default=None, help="Names of the benchmarks to run")
+    parser.add_argument("--baseline", type=str, default=str(BASELINE_PATH), help="Baseline file to compare against")
+    parser.add_argument("--save_baseline", action="store_true", help="Overwrite the baseline with these results")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if a benchmark regressed")
+    args = parser.parse_args()
+
+    calibration = calibrate(args.repeat)
+    results = run_benchmarks(args.engines, args.repeat, args.only)
+    baseline_path = Path(args.baseline)
+    baseline_file = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    baseline, scale = None, 1.0
+    if baseline_file is not None:
+        baseline = baseline_file["results"]
+        # Baseline timings recorded on another machine are scaled to the speed of this one, as measured by the
+        # calibration loop. On the same machine the loop is as noisy as the benchmarks, the timings are compared as is.
+        if baseline_file.get("calibration_seconds") and baseline_file.get("machine") != platform.node():
+            scale = calibration / baseline_file["calibration_seconds"]
+        print(f"[OK] Calibration: {calibration * 1000:.1f}ms, baseline scaled by {scale:.2f}")
+        if not args.save_baseline:
+            for _ in range(REGRESSION_RETIMES):
+                retime(results, find_regressions(results, baseline, scale), args.repeat)
+    print(format_results(results, baseline, scale))
+
+    if args.save_baseline:
+        baseline_path.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "machine": platform.node(),
+                    "calibration_seconds": calibration,
+                    "results": results,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+        print(f"[OK] Baseline saved to {baseline_path}")
+    elif baseline is not None:
+        regressions = find_regressions(results, baseline, scale)
+        if regressions:
+            status = "[FAIL]" if args.check else "[WARN]"
+            print(f"{status} {len(regressions)} regression(s): {', '.join(regressions)}")
+            if args.check:
+                sys.exit(1)
@@ -0,0 +1,25 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+
+import pytest
+
+from src.tools.local_python_executor import BASE_PYTHON_TOOLS, evaluate_python_code
+
+ENGINES = ["ast", "compiled", "native"]
+
+# Code and its result, as given by python
+LAMBDAS = {
+    "loop_default": ("[f() for f in [lambda i=i: i for i in range(3)]]", [0, 1, 2]),
+    "missing_argument": ("g = lambda a, b=10: a + b\n(g(1), g(1, 2), g(1, b=3))", (11, 3, 4)),
+    "keyword_only": ("h = lambda a, *, k=5: a * k\n(h(2), h(2, k=3))", (10, 6)),
+    "evaluated_once": ("n = 1\nf = lambda x=n: x\nn = 2\nf()", 1),
+}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", list(LAMBDAS))
+def test_lambda_defaults(engine, name):
+    code, expected = LAMBDAS[name]
+    result, _ = evaluate_python_code(code, static_tools=BASE_PYTHON_TOOLS, state={}, engine=engine)
+    assert result == expected
@@ -0,0 +1,56 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+
+import pytest
+
+from src.tools.local_python_executor import BASE_PYTHON_TOOLS, InterpreterError, evaluate_python_code
+
+ENGINES = ["ast", "compiled", "native"]
+
+# Code reaching a module that was not imported through a value the sandbox never checked
+ESCAPES = {
+    "loop_target": (
+        "import sys\n"
+        "r = None\n"
+        "for m in sys.modules.values():\n"
+        "    try:\n"
+        "        r = m.getoutput('echo PWNED')\n"
+        "    except AttributeError:\n"
+        "        pass\n"
+        "r"
+    ),
+    "getattr": (
+        "import sys\n"
+        "r = None\n"
+        "for m in sys.modules.values():\n"
+        "    try:\n"
+        "        r = getattr(m, 'getoutput')('echo PWNED')\n"
+        "    except AttributeError:\n"
+        "        pass\n"
+        "r"
+    ),
+    "unpacking": (
+        "import sys\n"
+        "modules = list(sys.modules.values())\n"
+        "r = None\n"
+        "for i in range(len(modules)):\n"
+        "    m, = modules[i:i + 1]\n"
+        "    try:\n"
+        "        r = m.getoutput('echo PWNED')\n"
+        "    except AttributeError:\n"
+        "        pass\n"
+        "r"
+    ),
+    "argument": "import sys\ndef first(*modules):\n    return modules[-1]\nfirst(*sys.modules.values())",
+    "comprehension": "import sys\n[m for m in sys.modules.values()]",
+}
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", list(ESCAPES))
+def test_unchecked_module_access_fails(engine, name):
+    with pytest.raises(InterpreterError):
+        evaluate_python_code(
+            ESCAPES[name], static_tools=BASE_PYTHON_TOOLS, state={}, authorized_imports=["sys"], engine=engine
+        )
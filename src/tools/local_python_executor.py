@@ -15,17 +15,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import ast
+import asyncio
 import builtins
+import copy
+import ctypes
 import difflib
+import hashlib
 import inspect
 import logging
 import math
+import operator
+import os
 import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
 from collections.abc import Mapping
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
 from importlib import import_module
+from queue import SimpleQueue
 from types import BuiltinFunctionType, FunctionType, ModuleType
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, Generator, Iterable, Iterator, List, Optional, Set, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -205,21 +219,112 @@ DANGEROUS_FUNCTIONS = [
     "os.system",
     "posix.system",
 ]
+# (module, name) pairs of DANGEROUS_FUNCTIONS, as looked up by `check_safe_result`
+_DANGEROUS_FUNCTION_KEYS = frozenset(tuple(name.rsplit(".", 1)) for name in DANGEROUS_FUNCTIONS)
 
 
 class PrintContainer:
-    def __init__(self):
-        self.value = ""
+    """
+    Print outputs of an evaluation, written in linear time and bounded in memory.
+
+    Text is kept as a list of chunks. With a `max_length`, only the first `max_length // 2` characters and the last
+    ones are kept while writing, and the string representation is the one of `truncate_content` over everything that
+    was printed. Consumers can follow the output as it is printed with `stream`.
+    """
+
+    def __init__(self, max_length: Optional[int] = None):
+        self.max_length = max_length
+        self._head: List[str] = []
+        self._head_length = 0
+        self._tail: deque = deque()
+        self._tail_length = 0
+        self._length = 0
+        self._subscribers: List[Callable[[Optional[str]], None]] = []
 
     def append(self, text):
-        self.value += text
+        self._write(text)
         return self
 
     def __iadd__(self, other):
         """Implements the += operator"""
-        self.value += str(other)
+        self._write(str(other))
         return self
 
+    def _write(self, text: str):
+        if not text:
+            return
+        self._length += len(text)
+        for subscriber in list(self._subscribers):
+            subscriber(text)
+        head_room = self.max_length // 2 - self._head_length if self.max_length is not None else len(text)
+        if head_room > 0:
+            self._head.append(text[:head_room])
+            self._head_length += len(self._head[-1])
+            text = text[head_room:]
+            if not text:
+                return
+        self._tail.append(text)
+        self._tail_length += len(text)
+        # The tail keeps the last characters, enough to return everything as long as nothing was truncated. It stays
+        # empty with a `max_length` of 0, which only keeps the truncation notice.
+        tail_size = self.max_length - self.max_length // 2
+        while self._tail and self._tail_length - len(self._tail[0]) >= tail_size:
+            self._tail_length -= len(self._tail.popleft())
+
+    @property
+    def truncated(self) -> bool:
+        return self.max_length is not None and self._length > self.max_length
+
+    @property
+    def value(self) -> str:
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        if not self.truncated:
+            return head + tail
+        return (
+            head
+            + f"\n..._This content has been truncated to stay below {self.max_length} characters_...\n"
+            + tail[-self.max_length // 2 :]
+        )
+
+    def text_since(self, position: int) -> str:
+        """Text printed since `position` characters had been printed, truncated like the whole output if need be."""
+        if position <= 0:
+            return self.value
+        if not self.truncated:
+            return self.value[position:]
+        tail = "".join(self._tail)[-self.max_length // 2 :]
+        tail_start = self._length - len(tail)
+        if position >= tail_start:
+            return tail[position - tail_start :]
+        head = "".join(self._head)[position:]
+        return (
+            head
+            + f"\n..._This content has been truncated to stay below {self.max_length} characters_...\n"
+            + tail
+        )
+
+    def stream(self, timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Iterate over the text printed from now on, as it is printed, until `close` is called. Meant to be consumed
+        from another thread than the one running the code, e.g. to display the outputs live.
+        """
+        chunks = SimpleQueue()
+        self._subscribers.append(chunks.put)
+        try:
+            while True:
+                chunk = chunks.get(timeout=timeout)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self._subscribers.remove(chunks.put)
+
+    def close(self):
+        """End the streams of `stream`."""
+        for subscriber in list(self._subscribers):
+            subscriber(None)
+
     def __str__(self):
         """String representation"""
         return self.value
@@ -229,8 +334,8 @@ class PrintContainer:
         return f"PrintContainer({self.value})"
 
     def __len__(self):
-        """Implements len() function support"""
-        return len(self.value)
+        """Number of characters printed, truncated ones included"""
+        return self._length
 
 
 class BreakException(Exception):
@@ -246,6 +351,40 @@ class ReturnException(Exception):
         self.value = value
 
 
+class Scope(dict):
+    """
+    Local variables of a function call or a comprehension.
+
+    Names are assigned in the scope itself and looked up in the enclosing state when missing, like a ChainMap, which
+    gives the same name resolution as a copy of the enclosing state without paying for the copy.
+    """
+
+    __slots__ = ("parent",)
+
+    def __init__(self, parent: Dict[str, Any]):
+        self.parent = parent
+        # Keep the operations counter at hand, it is looked up for every statement
+        if "_operations_count" in parent:
+            self["_operations_count"] = parent["_operations_count"]
+
+    def __missing__(self, key):
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.parent
+
+    def __delitem__(self, key):
+        # A name of the enclosing state is not a local variable of the scope, as in Python it cannot be deleted
+        if not dict.__contains__(self, key):
+            raise InterpreterError(f"Cannot delete name '{key}': name is not defined in the local scope")
+        dict.__delitem__(self, key)
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        return self.parent.get(key, default)
+
+
 def get_iterable(obj):
     if isinstance(obj, list):
         return obj
@@ -303,27 +442,37 @@ def safer_eval(func: Callable):
         authorized_imports=BASE_BUILTIN_MODULES,
     ):
         result = func(expression, state, static_tools, custom_tools, authorized_imports=authorized_imports)
-        if "*" not in authorized_imports:
-            if isinstance(result, ModuleType):
-                if result.__name__ not in authorized_imports:
-                    raise InterpreterError(f"Forbidden access to module: {result.__name__}")
-            elif isinstance(result, dict) and result.get("__spec__"):
-                if result["__name__"] not in authorized_imports:
-                    raise InterpreterError(f"Forbidden access to module: {result['__name__']}")
-            elif isinstance(result, (FunctionType, BuiltinFunctionType)):
-                for qualified_function_name in DANGEROUS_FUNCTIONS:
-                    module_name, function_name = qualified_function_name.rsplit(".", 1)
-                    if (
-                        function_name not in static_tools
-                        and result.__name__ == function_name
-                        and result.__module__ == module_name
-                    ):
-                        raise InterpreterError(f"Forbidden access to function: {function_name}")
-        return result
+        return check_safe_result(result, static_tools, authorized_imports)
 
     return _check_return
 
 
+def check_safe_result(result: Any, static_tools: Dict[str, Callable], authorized_imports: List[str]) -> Any:
+    """
+    Check that an evaluated value does not give access to an unauthorized module or a dangerous function.
+
+    Args:
+        result: Value produced by the evaluation of a node.
+        static_tools: Tools available to the code, which are allowed even if listed as dangerous.
+        authorized_imports: Modules that can be accessed by the code.
+
+    Returns:
+        Any: The value itself, if it is safe.
+    """
+    # Cheap type test first: this runs for every name, attribute and call result of the compiled engine
+    if not isinstance(result, (ModuleType, FunctionType, BuiltinFunctionType, dict)) or "*" in authorized_imports:
+        return result
+    if isinstance(result, ModuleType):
+        if result.__name__ not in authorized_imports:
+            raise InterpreterError(f"Forbidden access to module: {result.__name__}")
+    elif isinstance(result, dict):
+        if result.get("__spec__") and result["__name__"] not in authorized_imports:
+            raise InterpreterError(f"Forbidden access to module: {result['__name__']}")
+    elif (result.__module__, result.__name__) in _DANGEROUS_FUNCTION_KEYS and result.__name__ not in static_tools:
+        raise InterpreterError(f"Forbidden access to function: {result.__name__}")
+    return result
+
+
 def evaluate_attribute(
     expression: ast.Attribute,
     state: Dict[str, Any],
@@ -357,6 +506,17 @@ def evaluate_unaryop(
         raise InterpreterError(f"Unary operation {expression.op.__class__.__name__} is not supported.")
 
 
+def lambda_defaults(arguments: ast.arguments, default_values: List[Any], kw_default_values: List[Any]) -> Dict[str, Any]:
+    """Default values of the parameters of a lambda, keyed by parameter, from the values of `arguments.defaults` and
+    `arguments.kw_defaults` (None where a keyword-only parameter has no default)."""
+    names = [arg.arg for arg in arguments.args]
+    defaults = dict(zip(names[len(names) - len(default_values) :], default_values))
+    for arg, node, value in zip(arguments.kwonlyargs, arguments.kw_defaults, kw_default_values):
+        if node is not None:
+            defaults[arg.arg] = value
+    return defaults
+
+
 def evaluate_lambda(
     lambda_expression: ast.Lambda,
     state: Dict[str, Any],
@@ -365,11 +525,22 @@ def evaluate_lambda(
     authorized_imports: List[str],
 ) -> Callable:
     args = [arg.arg for arg in lambda_expression.args.args]
+    # Defaults are evaluated once, when the lambda is created
+    defaults = lambda_defaults(
+        lambda_expression.args,
+        [evaluate_ast(d, state, static_tools, custom_tools, authorized_imports) for d in lambda_expression.args.defaults],
+        [
+            evaluate_ast(d, state, static_tools, custom_tools, authorized_imports) if d is not None else None
+            for d in lambda_expression.args.kw_defaults
+        ],
+    )
 
-    def lambda_func(*values: Any) -> Any:
-        new_state = state.copy()
-        for arg, value in zip(args, values):
-            new_state[arg] = value
+    def lambda_func(*values: Any, **kwargs: Any) -> Any:
+        new_state = Scope(state)
+        new_state.update(defaults)
+        new_state.update(zip(args, values))
+        if kwargs:
+            new_state.update(kwargs)
         return evaluate_ast(
             lambda_expression.body,
             new_state,
@@ -409,51 +580,48 @@ def create_function(
     static_tools: Dict[str, Callable],
     custom_tools: Dict[str, Callable],
     authorized_imports: List[str],
+    compiled_body: Optional[List[Callable]] = None,
 ) -> Callable:
     source_code = ast.unparse(func_def)
+    arg_names = [arg.arg for arg in func_def.args.args]
+    vararg_name = func_def.args.vararg.arg if func_def.args.vararg else None
+    kwarg_name = func_def.args.kwarg.arg if func_def.args.kwarg else None
+    is_method = bool(arg_names) and arg_names[0] == "self"
 
     def new_func(*args: Any, **kwargs: Any) -> Any:
-        func_state = state.copy()
-        arg_names = [arg.arg for arg in func_def.args.args]
-        default_values = [
-            evaluate_ast(d, state, static_tools, custom_tools, authorized_imports) for d in func_def.args.defaults
-        ]
-
-        # Apply default values
-        defaults = dict(zip(arg_names[-len(default_values) :], default_values))
+        func_state = Scope(state)
 
-        # Set positional arguments
-        for name, value in zip(arg_names, args):
-            func_state[name] = value
+        # Apply default values, overridden below by the arguments provided
+        if func_def.args.defaults:
+            default_values = [
+                evaluate_ast(d, state, static_tools, custom_tools, authorized_imports) for d in func_def.args.defaults
+            ]
+            func_state.update(zip(arg_names[-len(default_values) :], default_values))
 
-        # Set keyword arguments
-        for name, value in kwargs.items():
-            func_state[name] = value
+        # Set positional and keyword arguments
+        func_state.update(zip(arg_names, args))
+        if kwargs:
+            func_state.update(kwargs)
 
         # Handle variable arguments
-        if func_def.args.vararg:
-            vararg_name = func_def.args.vararg.arg
-            func_state[vararg_name] = args
-
-        if func_def.args.kwarg:
-            kwarg_name = func_def.args.kwarg.arg
+        if vararg_name is not None:
+            func_state[vararg_name] = args[len(arg_names) :]
+        if kwarg_name is not None:
             func_state[kwarg_name] = kwargs
 
-        # Set default values for arguments that were not provided
-        for name, value in defaults.items():
-            if name not in func_state:
-                func_state[name] = value
-
         # Update function state with self and __class__
-        if func_def.args.args and func_def.args.args[0].arg == "self":
-            if args:
-                func_state["self"] = args[0]
-                func_state["__class__"] = args[0].__class__
+        if is_method and args:
+            func_state["self"] = args[0]
+            func_state["__class__"] = args[0].__class__
 
         result = None
         try:
-            for stmt in func_def.body:
-                result = evaluate_ast(stmt, func_state, static_tools, custom_tools, authorized_imports)
+            if compiled_body is not None:
+                for stmt in compiled_body:
+                    result = stmt(func_state, static_tools, custom_tools, authorized_imports)
+            else:
+                for stmt in func_def.body:
+                    result = evaluate_ast(stmt, func_state, static_tools, custom_tools, authorized_imports)
         except ReturnException as e:
             result = e.value
 
@@ -599,17 +767,20 @@ def evaluate_boolop(
     static_tools: Dict[str, Callable],
     custom_tools: Dict[str, Callable],
     authorized_imports: List[str],
-) -> bool:
+) -> Any:
+    # Like Python, return the value that decided the result rather than a bool
     if isinstance(node.op, ast.And):
         for value in node.values:
-            if not evaluate_ast(value, state, static_tools, custom_tools, authorized_imports):
-                return False
-        return True
+            result = evaluate_ast(value, state, static_tools, custom_tools, authorized_imports)
+            if not result:
+                return result
+        return result
     elif isinstance(node.op, ast.Or):
         for value in node.values:
-            if evaluate_ast(value, state, static_tools, custom_tools, authorized_imports):
-                return True
-        return False
+            result = evaluate_ast(value, state, static_tools, custom_tools, authorized_imports)
+            if result:
+                return result
+        return result
 
 
 def evaluate_binop(
@@ -785,6 +956,9 @@ def evaluate_call(
             raise InterpreterError(
                 f"Invoking a builtin function that has not been explicitly added as a tool is not allowed ({func_name})."
             )
+        profiler = _ACTIVE_PROFILER.get()
+        if profiler is not None and getattr(func, "__module__", None) != __name__:
+            return profiler.call_native(func, *args, **kwargs)
         return func(*args, **kwargs)
 
 
@@ -800,12 +974,58 @@ def evaluate_subscript(
     try:
         return value[index]
     except (KeyError, IndexError, TypeError) as e:
-        error_message = f"Could not index {value} with '{index}': {type(e).__name__}: {e}"
-        if isinstance(index, str) and isinstance(value, Mapping):
-            close_matches = difflib.get_close_matches(index, list(value.keys()))
-            if len(close_matches) > 0:
-                error_message += f". Maybe you meant one of these indexes instead: {str(close_matches)}"
-        raise InterpreterError(error_message) from e
+        raise_subscript_error(value, index, e)
+
+
+def raise_subscript_error(value: Any, index: Any, error: Exception) -> None:
+    """Raise an InterpreterError explaining why `value[index]` failed, with close matches for mapping keys."""
+    error_message = f"Could not index {value} with '{index}': {type(error).__name__}: {error}"
+    if isinstance(index, str) and isinstance(value, Mapping):
+        close_matches = difflib.get_close_matches(index, list(value.keys()))
+        if len(close_matches) > 0:
+            error_message += f". Maybe you meant one of these indexes instead: {str(close_matches)}"
+    raise InterpreterError(error_message) from error
+
+
+# Whether the error of an undefined name suggests the closest defined name
+SUGGEST_CLOSE_NAMES = True
+
+
+def suggest_name(name: str, namespaces: Iterable[Mapping]) -> Optional[str]:
+    """Closest public name of the namespaces, the parents of a `Scope` included, or None."""
+    candidates = set()
+    for namespace in namespaces:
+        while namespace is not None:
+            candidates.update(key for key in namespace.keys() if not key.startswith("_"))
+            namespace = namespace.parent if isinstance(namespace, Scope) else None
+    close_matches = difflib.get_close_matches(name, candidates, n=1)
+    return close_matches[0] if close_matches else None
+
+
+class UndefinedNameError(InterpreterError, NameError):
+    """
+    Error of a name read by the code that is defined nowhere. It is also a NameError, so that `except NameError`
+    catches it in the code like in Python. The "did you mean" suggestion is only computed when the message is
+    rendered: code probing names in a loop does not pay for it.
+    """
+
+    def __init__(self, name: str, namespaces: Tuple[Mapping, ...] = ()):
+        super().__init__(name)
+        self.name = name
+        self._namespaces = namespaces
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            self._message = f"The variable `{self.name}` is not defined."
+            suggestion = suggest_name(self.name, self._namespaces) if SUGGEST_CLOSE_NAMES else None
+            if suggestion is not None:
+                self._message += f" Did you mean `{suggestion}`?"
+            self._namespaces = ()
+        return self._message
+
+    def __reduce__(self):
+        return InterpreterError, (str(self),)
 
 
 def evaluate_name(
@@ -823,10 +1043,7 @@ def evaluate_name(
         return custom_tools[name.id]
     elif name.id in ERRORS:
         return ERRORS[name.id]
-    close_matches = difflib.get_close_matches(name.id, list(state.keys()))
-    if len(close_matches) > 0:
-        return state[close_matches[0]]
-    raise InterpreterError(f"The variable `{name.id}` is not defined.")
+    raise UndefinedNameError(name.id, (state, static_tools, custom_tools))
 
 
 def evaluate_condition(
@@ -917,12 +1134,9 @@ def evaluate_for(
                 if line_result is not None:
                     result = line_result
             except BreakException:
-                break
+                return result
             except ContinueException:
-                continue
-        else:
-            continue
-        break
+                break
     return result
 
 
@@ -933,6 +1147,9 @@ def evaluate_listcomp(
     custom_tools: Dict[str, Callable],
     authorized_imports: List[str],
 ) -> List[Any]:
+    # A single scope for the whole comprehension, its targets are rebound for every element
+    comprehension_state = Scope(state)
+
     def inner_evaluate(generators: List[ast.comprehension], index: int, current_state: Dict[str, Any]) -> List[Any]:
         if index >= len(generators):
             return [
@@ -954,20 +1171,53 @@ def evaluate_listcomp(
         )
         result = []
         for value in iter_value:
-            new_state = current_state.copy()
             if isinstance(generator.target, ast.Tuple):
                 for idx, elem in enumerate(generator.target.elts):
-                    new_state[elem.id] = value[idx]
+                    current_state[elem.id] = value[idx]
             else:
-                new_state[generator.target.id] = value
+                current_state[generator.target.id] = value
             if all(
-                evaluate_ast(if_clause, new_state, static_tools, custom_tools, authorized_imports)
+                evaluate_ast(if_clause, current_state, static_tools, custom_tools, authorized_imports)
                 for if_clause in generator.ifs
             ):
-                result.extend(inner_evaluate(generators, index + 1, new_state))
+                result.extend(inner_evaluate(generators, index + 1, current_state))
         return result
 
-    return inner_evaluate(listcomp.generators, 0, state)
+    return inner_evaluate(listcomp.generators, 0, comprehension_state)
+
+
+def evaluate_generatorexp(
+    genexp: ast.GeneratorExp,
+    state: Dict[str, Any],
+    static_tools: Dict[str, Callable],
+    custom_tools: Dict[str, Callable],
+    authorized_imports: List[str],
+) -> Generator[Any, None, None]:
+    # Like in Python, the outermost iterable is evaluated right away and the rest lazily,
+    # so that `sum`, `any`, `all` or `next` consume the elements one at a time.
+    outer_iterable = iter(
+        evaluate_ast(genexp.generators[0].iter, state, static_tools, custom_tools, authorized_imports)
+    )
+    generator_state = Scope(state)
+
+    def inner_generate(index: int) -> Generator[Any, None, None]:
+        if index >= len(genexp.generators):
+            yield evaluate_ast(genexp.elt, generator_state, static_tools, custom_tools, authorized_imports)
+            return
+        generator = genexp.generators[index]
+        if index == 0:
+            iter_value = outer_iterable
+        else:
+            iter_value = evaluate_ast(generator.iter, generator_state, static_tools, custom_tools, authorized_imports)
+        for value in iter_value:
+            set_value(generator.target, value, generator_state, static_tools, custom_tools, authorized_imports)
+            if all(
+                evaluate_ast(if_clause, generator_state, static_tools, custom_tools, authorized_imports)
+                for if_clause in generator.ifs
+            ):
+                yield from inner_generate(index + 1)
+
+    return inner_generate(0)
 
 
 def evaluate_setcomp(
@@ -978,10 +1228,10 @@ def evaluate_setcomp(
     authorized_imports: List[str],
 ) -> Set[Any]:
     result = set()
+    new_state = Scope(state)
     for gen in setcomp.generators:
         iter_value = evaluate_ast(gen.iter, state, static_tools, custom_tools, authorized_imports)
         for value in iter_value:
-            new_state = state.copy()
             set_value(
                 gen.target,
                 value,
@@ -1111,41 +1361,67 @@ def evaluate_with(
             context.__exit__(None, None, None)
 
 
-def get_safe_module(raw_module, authorized_imports, visited=None):
-    """Creates a safe copy of a module or returns the original if it's a function"""
-    # If it's a function or non-module object, return it directly
-    if not isinstance(raw_module, ModuleType):
-        return raw_module
-
-    # Handle circular references: Initialize visited set for the first call
-    if visited is None:
-        visited = set()
-
-    module_id = id(raw_module)
-    if module_id in visited:
-        return raw_module  # Return original for circular refs
+class SafeModule(ModuleType):
+    """
+    Read-only view of a module for the sandbox.
 
-    visited.add(module_id)
+    Attributes are resolved from the wrapped module on first access and then kept on the view, submodules being
+    wrapped in turn. Views are shared by every execution of the process (see `get_safe_module`), hence assignments
+    to their attributes are refused.
+    """
 
-    # Create new module for actual modules
-    safe_module = ModuleType(raw_module.__name__)
+    def __init__(self, raw_module: ModuleType, authorized_imports: List[str]):
+        super().__init__(raw_module.__name__, raw_module.__doc__)
+        # Dunder names cannot be reached from the sandboxed code
+        self.__dict__["__wrapped_module__"] = raw_module
+        self.__dict__["__authorized_imports__"] = authorized_imports
 
-    # Copy all attributes by reference, recursively checking modules
-    for attr_name in dir(raw_module):
+    def __getattr__(self, attr_name: str) -> Any:
+        raw_module = self.__dict__["__wrapped_module__"]
         try:
             attr_value = getattr(raw_module, attr_name)
-        except (ImportError, AttributeError) as e:
-            # lazy / dynamic loading module -> INFO log and skip
-            logger.info(
-                f"Skipping import error while copying {raw_module.__name__}.{attr_name}: {type(e).__name__} - {e}"
-            )
-            continue
-        # Recursively process nested modules, passing visited set
+        except ImportError as e:
+            # lazy / dynamic loading module -> INFO log and report a missing attribute
+            logger.info(f"Skipping import error while accessing {raw_module.__name__}.{attr_name}: {type(e).__name__} - {e}")
+            raise AttributeError(f"module '{raw_module.__name__}' has no attribute '{attr_name}'") from e
         if isinstance(attr_value, ModuleType):
-            attr_value = get_safe_module(attr_value, authorized_imports, visited=visited)
+            attr_value = get_safe_module(attr_value, self.__dict__["__authorized_imports__"])
+        self.__dict__[attr_name] = attr_value
+        return attr_value
+
+    def __dir__(self) -> List[str]:
+        return sorted(set(dir(self.__dict__["__wrapped_module__"])))
+
+    def __setattr__(self, attr_name: str, value: Any) -> None:
+        raise InterpreterError(f"Cannot set attribute {attr_name} of module {self.__name__}: modules are read-only.")
+
+    def __delattr__(self, attr_name: str) -> None:
+        raise InterpreterError(f"Cannot delete attribute {attr_name} of module {self.__name__}: modules are read-only.")
+
 
-        setattr(safe_module, attr_name, attr_value)
+_SAFE_MODULES: Dict[Tuple[int, frozenset], SafeModule] = {}
+_SAFE_MODULES_LOCK = threading.Lock()
 
+
+def get_safe_module(raw_module, authorized_imports):
+    """
+    Returns the process-wide safe view of a module, or the original object if it's not a module.
+
+    Views are cached per (module, authorized imports), so importing a module in the sandbox only costs a dictionary
+    lookup after the first time.
+    """
+    # If it's a function or non-module object, return it directly
+    if not isinstance(raw_module, ModuleType) or isinstance(raw_module, SafeModule):
+        return raw_module
+
+    key = (id(raw_module), frozenset(authorized_imports))
+    safe_module = _SAFE_MODULES.get(key)
+    if safe_module is None:
+        with _SAFE_MODULES_LOCK:
+            safe_module = _SAFE_MODULES.get(key)
+            if safe_module is None:
+                # The view references the module, so its id cannot be reused while the entry exists
+                safe_module = _SAFE_MODULES[key] = SafeModule(raw_module, list(authorized_imports))
     return safe_module
 
 
@@ -1203,10 +1479,10 @@ def evaluate_dictcomp(
     authorized_imports: List[str],
 ) -> Dict[Any, Any]:
     result = {}
+    new_state = Scope(state)
     for gen in dictcomp.generators:
         iter_value = evaluate_ast(gen.iter, state, static_tools, custom_tools, authorized_imports)
         for value in iter_value:
-            new_state = state.copy()
             set_value(
                 gen.target,
                 value,
@@ -1273,6 +1549,94 @@ def evaluate_delete(
             raise InterpreterError(f"Deletion of {type(target).__name__} targets is not supported")
 
 
+class ExecutionProfiler:
+    """
+    Collects where the time of an evaluation goes: self time and count per node type and per source line, and time
+    spent inside native callees (functions that were not defined by the evaluated code, like pandas methods).
+
+    Pass it to `evaluate_python_code`, which then runs the code with the "ast" engine so that every node is timed.
+    Self times exclude the time of child nodes, so they add up to the total time.
+    """
+
+    def __init__(self):
+        self.node_types: Dict[str, List[float]] = {}  # name -> [count, self time]
+        self.lines: Dict[int, List[float]] = {}  # line number -> [count, self time]
+        self.native_callees: Dict[str, List[float]] = {}  # qualified name -> [count, time]
+        self.source_lines: List[str] = []
+        self.total_time = 0.0
+        self.pending = None
+        self._child_times: List[float] = []
+
+    def start(self, code: str):
+        self.source_lines = code.splitlines()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        self.total_time += time.perf_counter() - self._start
+
+    def profile_node(self, expression: ast.AST, evaluate: Callable, *params) -> Any:
+        """Evaluate a node with `evaluate(expression, *params)` and record its self time."""
+        self.pending = expression
+        self._child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            return evaluate(expression, *params)
+        finally:
+            elapsed = time.perf_counter() - start
+            self_time = elapsed - self._child_times.pop()
+            if self._child_times:
+                self._child_times[-1] += elapsed
+            for stats, key in (
+                (self.node_types, type(expression).__name__),
+                (self.lines, getattr(expression, "lineno", 0)),
+            ):
+                entry = stats.setdefault(key, [0, 0.0])
+                entry[0] += 1
+                entry[1] += self_time
+
+    def call_native(self, func: Callable, *args, **kwargs) -> Any:
+        """Call a native function and record the time spent in it."""
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            name = getattr(func, "__qualname__", None) or type(func).__qualname__
+            module = getattr(func, "__module__", None)
+            entry = self.native_callees.setdefault(f"{module}.{name}" if module else name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+
+    def report(self, top: int = 10) -> str:
+        """Compact text report of the hottest node types, lines and native callees."""
+        native_time = sum(entry[1] for entry in self.native_callees.values())
+        share = 100 * native_time / self.total_time if self.total_time else 0.0
+        lines = [
+            f"Profile: {sum(int(entry[0]) for entry in self.node_types.values())} nodes in {self.total_time:.3f}s, "
+            f"{native_time:.3f}s ({share:.0f}%) in native callees, {self.total_time - native_time:.3f}s in the "
+            f"interpreter"
+        ]
+
+        def hottest(stats):
+            return sorted(stats.items(), key=lambda item: item[1][1], reverse=True)[:top]
+
+        lines.append("Node types (self time):")
+        lines.extend(f"  {name:<16} {int(count):>9} {seconds:.3f}s" for name, (count, seconds) in hottest(self.node_types))
+        lines.append("Hot lines (self time):")
+        for lineno, (count, seconds) in hottest(self.lines):
+            source = self.source_lines[lineno - 1].strip() if 0 < lineno <= len(self.source_lines) else ""
+            lines.append(f"  L{lineno:<4} {int(count):>9} {seconds:.3f}s  {truncate_content(source, 60)}")
+        if self.native_callees:
+            lines.append("Native callees:")
+            lines.extend(
+                f"  {name:<40} {int(count):>9} {seconds:.3f}s" for name, (count, seconds) in hottest(self.native_callees)
+            )
+        return "\n".join(lines)
+
+
+# Profiler of the evaluation running in the current thread, set by `evaluate_python_code`
+_ACTIVE_PROFILER: ContextVar[Optional[ExecutionProfiler]] = ContextVar("active_profiler", default=None)
+
+
 @safer_eval
 def evaluate_ast(
     expression: ast.AST,
@@ -1301,11 +1665,18 @@ def evaluate_ast(
             The list of modules that can be imported by the code. By default, only a few safe modules are allowed.
             If it contains "*", it will authorize any import. Use this at your own risk!
     """
-    if state.setdefault("_operations_count", {"counter": 0})["counter"] >= MAX_OPERATIONS:
+    operations_count = state.setdefault("_operations_count", {"counter": 0})
+    profiler = _ACTIVE_PROFILER.get()
+    if profiler is not None:
+        if profiler.pending is not expression:
+            # Evaluate the node again from the profiler, which then lets it through
+            return profiler.profile_node(expression, evaluate_ast, state, static_tools, custom_tools, authorized_imports)
+        profiler.pending = None
+    if operations_count["counter"] >= MAX_OPERATIONS:
         raise InterpreterError(
             f"Reached the max number of operations of {MAX_OPERATIONS}. Maybe there is an infinite loop somewhere in the code, or you're just asking too many calculations."
         )
-    state["_operations_count"]["counter"] += 1
+    operations_count["counter"] += 1
     common_params = (state, static_tools, custom_tools, authorized_imports)
     if isinstance(expression, ast.Assign):
         # Assignment -> we evaluate the assignment which should update the state
@@ -1321,7 +1692,9 @@ def evaluate_ast(
         return expression.value
     elif isinstance(expression, ast.Tuple):
         return tuple((evaluate_ast(elt, *common_params) for elt in expression.elts))
-    elif isinstance(expression, (ast.ListComp, ast.GeneratorExp)):
+    elif isinstance(expression, ast.GeneratorExp):
+        return evaluate_generatorexp(expression, *common_params)
+    elif isinstance(expression, ast.ListComp):
         return evaluate_listcomp(expression, *common_params)
     elif isinstance(expression, ast.DictComp):
         return evaluate_dictcomp(expression, *common_params)
@@ -1425,154 +1798,2442 @@ def evaluate_ast(
         raise InterpreterError(f"{expression.__class__.__name__} is not supported.")
 
 
-class FinalAnswerException(Exception):
-    def __init__(self, value):
-        self.value = value
+# Compilation of the AST into closures.
+# `evaluate_ast` dispatches on the node type every time a node is visited, which dominates the cost of loops.
+# `compile_ast` walks the tree once and returns a closure per node, with its children and operators pre-bound.
+# Closures take the same `(state, static_tools, custom_tools, authorized_imports)` parameters as the `evaluate_*`
+# functions. Nodes without a dedicated compiler fall back to `evaluate_ast`, so both engines support the same syntax.
+# Operations are counted per executed statement and per comprehension element rather than per node.
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.FloorDiv: operator.floordiv,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+}
 
+AUGMENTED_OPERATORS = {
+    ast.Add: operator.iadd,
+    ast.Sub: operator.isub,
+    ast.Mult: operator.imul,
+    ast.Div: operator.itruediv,
+    ast.Mod: operator.imod,
+    ast.Pow: operator.ipow,
+    ast.FloorDiv: operator.ifloordiv,
+    ast.BitAnd: operator.iand,
+    ast.BitOr: operator.ior,
+    ast.BitXor: operator.ixor,
+    ast.LShift: operator.ilshift,
+    ast.RShift: operator.irshift,
+}
 
-def evaluate_python_code(
-    code: str,
-    static_tools: Optional[Dict[str, Callable]] = None,
-    custom_tools: Optional[Dict[str, Callable]] = None,
-    state: Optional[Dict[str, Any]] = None,
-    authorized_imports: List[str] = BASE_BUILTIN_MODULES,
-    max_print_outputs_length: int = DEFAULT_MAX_LEN_OUTPUT,
-):
+UNARY_OPERATORS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+
+COMPARISON_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+
+_MISSING = object()
+
+
+def count_operation(state: Dict[str, Any]) -> None:
+    """Increment the operations counter of the state, raising once MAX_OPERATIONS is reached."""
+    counter = state["_operations_count"]
+    if counter["counter"] >= MAX_OPERATIONS:
+        raise InterpreterError(
+            f"Reached the max number of operations of {MAX_OPERATIONS}. Maybe there is an infinite loop somewhere in the code, or you're just asking too many calculations."
+        )
+    counter["counter"] += 1
+
+
+def compile_ast(expression: ast.AST) -> Callable:
     """
-    Evaluate a python expression using the content of the variables stored in a state and only evaluating a given set
-    of functions.
+    Compile an abstract syntax tree into a closure that evaluates it.
 
-    This function will recurse through the nodes of the tree provided.
+    The returned closure is called as `closure(state, static_tools, custom_tools, authorized_imports)` and behaves
+    like `evaluate_ast(expression, state, static_tools, custom_tools, authorized_imports)`, with the same safety
+    checks, but without walking the tree again on every call.
 
     Args:
-        code (`str`):
-            The code to evaluate.
-        static_tools (`Dict[str, Callable]`):
-            The functions that may be called during the evaluation. These can also be agents in a multiagent setting.
-            These tools cannot be overwritten in the code: any assignment to their name will raise an error.
-        custom_tools (`Dict[str, Callable]`):
-            The functions that may be called during the evaluation.
-            These tools can be overwritten in the code: any assignment to their name will overwrite them.
-        state (`Dict[str, Any]`):
-            A dictionary mapping variable names to values. The `state` should contain the initial inputs but will be
-            updated by this function to contain all variables as they are evaluated.
-            The print outputs will be stored in the state under the key "_print_outputs".
-        authorized_imports (`List[str]`):
-            The list of modules that can be imported by the code. By default, only a few safe modules are allowed.
-            If it contains "*", it will authorize any import. Use this at your own risk!
+        expression (`ast.AST`):
+            The code to compile, as an abstract syntax tree.
+
+    Returns:
+        Callable: The compiled closure.
     """
-    try:
-        expression = ast.parse(code)
-    except SyntaxError as e:
-        raise InterpreterError(
-            f"Code parsing failed on line {e.lineno} due to: {type(e).__name__}\n"
-            f"{e.text}"
-            f"{' ' * (e.offset or 0)}^\n"
-            f"Error: {str(e)}"
-        )
+    compiler = NODE_COMPILERS.get(type(expression))
+    if compiler is None:
+        return _compile_fallback(expression)
+    return compiler(expression)
 
-    if state is None:
-        state = {}
-    static_tools = static_tools.copy() if static_tools is not None else {}
-    custom_tools = custom_tools if custom_tools is not None else {}
-    result = None
-    state["_print_outputs"] = PrintContainer()
-    state["_operations_count"] = {"counter": 0}
 
-    if "final_answer" in static_tools:
-        previous_final_answer = static_tools["final_answer"]
+def compile_statement(statement: ast.stmt) -> Callable:
+    """Compile a statement into a closure that also counts the statement towards MAX_OPERATIONS."""
+    run_statement = compile_ast(statement)
 
-        def final_answer(answer):  # Using 'answer' as the argument like in the original function
-            raise FinalAnswerException(previous_final_answer(answer))
+    def run(state, static_tools, custom_tools, authorized_imports):
+        counter = state["_operations_count"]
+        if counter["counter"] >= MAX_OPERATIONS:
+            count_operation(state)  # raises the InterpreterError
+        counter["counter"] += 1
+        return run_statement(state, static_tools, custom_tools, authorized_imports)
 
-        static_tools["final_answer"] = final_answer
+    return run
 
-    try:
-        for node in expression.body:
-            result = evaluate_ast(node, state, static_tools, custom_tools, authorized_imports)
-        state["_print_outputs"].value = truncate_content(
-            str(state["_print_outputs"]), max_length=max_print_outputs_length
-        )
-        is_final_answer = False
-        return result, is_final_answer
-    except FinalAnswerException as e:
-        state["_print_outputs"].value = truncate_content(
-            str(state["_print_outputs"]), max_length=max_print_outputs_length
-        )
-        is_final_answer = True
-        return e.value, is_final_answer
-    except Exception as e:
-        state["_print_outputs"].value = truncate_content(
-            str(state["_print_outputs"]), max_length=max_print_outputs_length
-        )
-        raise InterpreterError(
-            f"Code execution failed at line '{ast.get_source_segment(code, node)}' due to: {type(e).__name__}: {e}"
-        )
 
+def compile_body(statements: List[ast.stmt]) -> List[Callable]:
+    return [compile_statement(statement) for statement in statements]
 
-class PythonExecutor:
-    pass
 
+def _compile_fallback(node):
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return evaluate_ast(node, state, static_tools, custom_tools, authorized_imports)
 
-class LocalPythonExecutor(PythonExecutor):
-    def __init__(
-        self,
-        additional_authorized_imports: List[str],
-        max_print_outputs_length: Optional[int] = None,
-    ):
-        self.custom_tools = {}
-        self.state = {}
-        self.max_print_outputs_length = max_print_outputs_length
-        if max_print_outputs_length is None:
-            self.max_print_outputs_length = DEFAULT_MAX_LEN_OUTPUT
-        self.additional_authorized_imports = additional_authorized_imports
-        self.authorized_imports = list(set(BASE_BUILTIN_MODULES) | set(self.additional_authorized_imports))
-        # TODO: assert self.authorized imports are all installed locally
-        self.static_tools = None
+    return run
+
+
+def _compile_constant(node):
+    value = node.value
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return value
+
+    return run
+
+
+def _compile_name(node):
+    name = node.id
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        try:
+            # Fast for local variables of a Scope, unlike `in` or `get`
+            value = state[name]
+        except KeyError:
+            value = evaluate_name(node, state, static_tools, custom_tools, authorized_imports)
+        return check_safe_result(value, static_tools, authorized_imports)
+
+    return run
+
+
+def _compile_attribute(node):
+    attr = node.attr
+    if attr.startswith("__") and attr.endswith("__"):
+        # Raises the forbidden access error when executed
+        return _compile_fallback(node)
+    get_value = compile_ast(node.value)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        value = get_value(state, static_tools, custom_tools, authorized_imports)
+        return check_safe_result(getattr(value, attr), static_tools, authorized_imports)
+
+    return run
+
+
+def _compile_unaryop(node):
+    op = UNARY_OPERATORS.get(type(node.op))
+    if op is None:
+        return _compile_fallback(node)
+    get_operand = compile_ast(node.operand)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return op(get_operand(state, static_tools, custom_tools, authorized_imports))
 
-    def __call__(self, code_action: str) -> Tuple[Any, str, bool]:
-        output, is_final_answer = evaluate_python_code(
-            code_action,
-            static_tools=self.static_tools,
-            custom_tools=self.custom_tools,
-            state=self.state,
-            authorized_imports=self.authorized_imports,
-            max_print_outputs_length=self.max_print_outputs_length,
+    return run
+
+
+def _compile_binop(node):
+    op = BINARY_OPERATORS.get(type(node.op))
+    if op is None:
+        return _compile_fallback(node)
+    get_left = compile_ast(node.left)
+    get_right = compile_ast(node.right)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return op(
+            get_left(state, static_tools, custom_tools, authorized_imports),
+            get_right(state, static_tools, custom_tools, authorized_imports),
         )
-        logs = str(self.state["_print_outputs"])
-        return output, logs, is_final_answer
 
-    def send_variables(self, variables: dict):
-        self.state.update(variables)
+    return run
 
-    # PISEK COMMENTED IT OUT
-    # def send_tools(self, tools: Dict[str, Tool]):
-    #     self.static_tools = {**tools, **BASE_PYTHON_TOOLS.copy()}
 
+def _compile_boolop(node):
+    get_values = [compile_ast(value) for value in node.values]
+    stop_on_true = isinstance(node.op, ast.Or)
 
-def local_python_executor(code: str, authorized_imports: List[str]):
-    """
-    Executes Python code in a sandboxed environment with restricted imports for security.
-    
-    This function provides a simplified interface to the LocalPythonExecutor class, allowing
-    for safe execution of Python code with controlled access to imports. It evaluates the 
-    provided code string and returns the result of the execution.
-    
-    Args:
-        code (str): 
-            The Python code to execute as a string. This can be any valid Python code,
-            including multiple statements, function definitions, class definitions, etc.
-        authorized_imports (List[str]): 
-            A list of module names that are allowed to be imported by the code.
-            These are in addition to the base built-in modules defined in BASE_BUILTIN_MODULES.
-            For unrestricted imports (use with caution), include "*" in the list.
-    
-    Returns:
-        Any: The result of the last statement in the executed code. If the code raises
-             an exception, an InterpreterError will be raised with details about the error.
-    
-    Raises:
-        InterpreterError: When the code execution fails due to syntax errors, unauthorized
+    def run(state, static_tools, custom_tools, authorized_imports):
+        for get_value in get_values:
+            result = get_value(state, static_tools, custom_tools, authorized_imports)
+            if bool(result) is stop_on_true:
+                return result
+        return result
+
+    return run
+
+
+def _compile_compare(node):
+    ops = [COMPARISON_OPERATORS.get(type(op)) for op in node.ops]
+    if None in ops:
+        return _compile_fallback(node)
+    get_left = compile_ast(node.left)
+    get_comparators = [compile_ast(comparator) for comparator in node.comparators]
+
+    if len(ops) == 1:
+        op, get_right = ops[0], get_comparators[0]
+
+        def run(state, static_tools, custom_tools, authorized_imports):
+            return op(
+                get_left(state, static_tools, custom_tools, authorized_imports),
+                get_right(state, static_tools, custom_tools, authorized_imports),
+            )
+
+        return run
+
+    comparisons = list(zip(ops, get_comparators))
+
+    def run_chain(state, static_tools, custom_tools, authorized_imports):
+        # Same semantics as evaluate_condition for chained comparisons
+        result = True
+        left = get_left(state, static_tools, custom_tools, authorized_imports)
+        for i, (op, get_right) in enumerate(comparisons):
+            right = get_right(state, static_tools, custom_tools, authorized_imports)
+            current_result = op(left, right)
+            if current_result is False:
+                return False
+            result = current_result if i == 0 else (result and current_result)
+            left = right
+        return result
+
+    return run_chain
+
+
+def _compile_ifexp(node):
+    get_test = compile_ast(node.test)
+    get_body = compile_ast(node.body)
+    get_orelse = compile_ast(node.orelse)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        if get_test(state, static_tools, custom_tools, authorized_imports):
+            return get_body(state, static_tools, custom_tools, authorized_imports)
+        return get_orelse(state, static_tools, custom_tools, authorized_imports)
+
+    return run
+
+
+def _compile_collection(factory):
+    def compile_collection(node):
+        get_elts = [compile_ast(elt) for elt in node.elts]
+
+        def run(state, static_tools, custom_tools, authorized_imports):
+            return factory([get_elt(state, static_tools, custom_tools, authorized_imports) for get_elt in get_elts])
+
+        return run
+
+    return compile_collection
+
+
+def _compile_dict(node):
+    if any(key is None for key in node.keys):
+        # `{**other}` is not supported by the tree-walker either
+        return _compile_fallback(node)
+    items = [(compile_ast(key), compile_ast(value)) for key, value in zip(node.keys, node.values)]
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return {
+            get_key(state, static_tools, custom_tools, authorized_imports): get_value(
+                state, static_tools, custom_tools, authorized_imports
+            )
+            for get_key, get_value in items
+        }
+
+    return run
+
+
+def _compile_subscript(node):
+    get_index = compile_ast(node.slice)
+    get_value = compile_ast(node.value)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        index = get_index(state, static_tools, custom_tools, authorized_imports)
+        value = get_value(state, static_tools, custom_tools, authorized_imports)
+        try:
+            result = value[index]
+        except (KeyError, IndexError, TypeError) as e:
+            raise_subscript_error(value, index, e)
+        return check_safe_result(result, static_tools, authorized_imports)
+
+    return run
+
+
+def _compile_slice(node):
+    bounds = [compile_ast(bound) if bound is not None else None for bound in (node.lower, node.upper, node.step)]
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return slice(
+            *(
+                get_bound(state, static_tools, custom_tools, authorized_imports) if get_bound is not None else None
+                for get_bound in bounds
+            )
+        )
+
+    return run
+
+
+def _compile_joinedstr(node):
+    get_values = [compile_ast(value) for value in node.values]
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return "".join([str(get_value(state, static_tools, custom_tools, authorized_imports)) for get_value in get_values])
+
+    return run
+
+
+def _compile_formattedvalue(node):
+    get_value = compile_ast(node.value)
+    if not node.format_spec:
+        return get_value
+    get_format_spec = compile_ast(node.format_spec)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        value = get_value(state, static_tools, custom_tools, authorized_imports)
+        return format(value, get_format_spec(state, static_tools, custom_tools, authorized_imports))
+
+    return run
+
+
+def _compile_expr(node):
+    # Also used for ast.Starred and ast.Index, which evaluate to their value
+    return compile_ast(node.value)
+
+
+def _compile_pass(node):
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return None
+
+    return run
+
+
+def _compile_break(node):
+    def run(state, static_tools, custom_tools, authorized_imports):
+        raise BreakException()
+
+    return run
+
+
+def _compile_continue(node):
+    def run(state, static_tools, custom_tools, authorized_imports):
+        raise ContinueException()
+
+    return run
+
+
+def _compile_return(node):
+    get_value = compile_ast(node.value) if node.value else None
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        raise ReturnException(
+            get_value(state, static_tools, custom_tools, authorized_imports) if get_value is not None else None
+        )
+
+    return run
+
+
+def _compile_call(call):
+    func = call.func
+    if not isinstance(func, (ast.Call, ast.Lambda, ast.Attribute, ast.Name, ast.Subscript)):
+        return _compile_fallback(call)
+    if isinstance(func, ast.Name):
+        func_name = func.id
+    elif isinstance(func, ast.Attribute):
+        func_name = func.attr
+    else:
+        func_name = None
+    if func_name == "super":
+        return _compile_fallback(call)
+
+    if isinstance(func, ast.Name):
+
+        def get_func(state, static_tools, custom_tools, authorized_imports):
+            for namespace in (state, static_tools, custom_tools, ERRORS):
+                function = namespace.get(func_name, _MISSING)
+                if function is not _MISSING:
+                    return function
+            raise InterpreterError(
+                f"It is not permitted to evaluate other functions than the provided tools or functions defined/imported in previous code (tried to execute {func_name})."
+            )
+
+    elif isinstance(func, ast.Attribute):
+        get_obj = compile_ast(func.value)
+
+        def get_func(state, static_tools, custom_tools, authorized_imports):
+            obj = get_obj(state, static_tools, custom_tools, authorized_imports)
+            function = getattr(obj, func_name, _MISSING)
+            if function is _MISSING:
+                raise InterpreterError(f"Object {obj} has no attribute {func_name}")
+            return function
+
+    elif isinstance(func, ast.Subscript):
+        get_subscript = compile_ast(func)
+
+        def get_func(state, static_tools, custom_tools, authorized_imports):
+            function = get_subscript(state, static_tools, custom_tools, authorized_imports)
+            if not callable(function):
+                raise InterpreterError(f"This is not a correct function: {func}).")
+            return function
+
+    else:
+        get_func = compile_ast(func)
+
+    get_args = [(isinstance(arg, ast.Starred), compile_ast(arg)) for arg in call.args]
+    has_starred = any(is_starred for is_starred, _ in get_args)
+    get_kwargs = [(keyword.arg, compile_ast(keyword.value)) for keyword in call.keywords]
+
+    def evaluate_args(state, static_tools, custom_tools, authorized_imports):
+        if not has_starred:
+            return [get_arg(state, static_tools, custom_tools, authorized_imports) for _, get_arg in get_args]
+        args = []
+        for is_starred, get_arg in get_args:
+            if is_starred:
+                args.extend(get_arg(state, static_tools, custom_tools, authorized_imports))
+            else:
+                args.append(get_arg(state, static_tools, custom_tools, authorized_imports))
+        return args
+
+    if func_name == "print":
+
+        def run_print(state, static_tools, custom_tools, authorized_imports):
+            get_func(state, static_tools, custom_tools, authorized_imports)
+            args = evaluate_args(state, static_tools, custom_tools, authorized_imports)
+            state["_print_outputs"] += " ".join(map(str, args)) + "\n"
+            return None
+
+        return run_print
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        function = get_func(state, static_tools, custom_tools, authorized_imports)
+        args = evaluate_args(state, static_tools, custom_tools, authorized_imports)
+        kwargs = {name: get_value(state, static_tools, custom_tools, authorized_imports) for name, get_value in get_kwargs}
+        if (
+            isinstance(function, BuiltinFunctionType)
+            and inspect.getmodule(function) == builtins
+            and function not in static_tools.values()
+        ):
+            raise InterpreterError(
+                f"Invoking a builtin function that has not been explicitly added as a tool is not allowed ({func_name})."
+            )
+        return check_safe_result(function(*args, **kwargs), static_tools, authorized_imports)
+
+    return run
+
+
+def _compile_target(target):
+    """Compile an assignment target into a setter called as `setter(value, state, static_tools, ...)`."""
+    if isinstance(target, ast.Name):
+        name = target.id
+
+        def set_name(value, state, static_tools, custom_tools, authorized_imports):
+            if name in static_tools:
+                raise InterpreterError(f"Cannot assign to name '{name}': doing this would erase the existing tool!")
+            state[name] = value
+
+        return set_name
+    elif isinstance(target, ast.Tuple):
+        setters = [_compile_target(elt) for elt in target.elts]
+
+        def set_tuple(value, state, static_tools, custom_tools, authorized_imports):
+            if not isinstance(value, tuple):
+                if hasattr(value, "__iter__") and not isinstance(value, (str, bytes)):
+                    value = tuple(value)
+                else:
+                    raise InterpreterError("Cannot unpack non-tuple value")
+            if len(setters) != len(value):
+                raise InterpreterError("Cannot unpack tuple of wrong size")
+            for setter, item in zip(setters, value):
+                setter(item, state, static_tools, custom_tools, authorized_imports)
+
+        return set_tuple
+    elif isinstance(target, ast.Subscript):
+        get_obj = compile_ast(target.value)
+        get_key = compile_ast(target.slice)
+
+        def set_item(value, state, static_tools, custom_tools, authorized_imports):
+            obj = get_obj(state, static_tools, custom_tools, authorized_imports)
+            obj[get_key(state, static_tools, custom_tools, authorized_imports)] = value
+
+        return set_item
+    elif isinstance(target, ast.Attribute):
+        get_obj = compile_ast(target.value)
+        attr = target.attr
+
+        def set_attribute(value, state, static_tools, custom_tools, authorized_imports):
+            setattr(get_obj(state, static_tools, custom_tools, authorized_imports), attr, value)
+
+        return set_attribute
+
+    def set_other(value, state, static_tools, custom_tools, authorized_imports):
+        set_value(target, value, state, static_tools, custom_tools, authorized_imports)
+
+    return set_other
+
+
+def _compile_assign(node):
+    if len(node.targets) != 1:
+        return _compile_fallback(node)
+    get_value = compile_ast(node.value)
+    set_target = _compile_target(node.targets[0])
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        result = get_value(state, static_tools, custom_tools, authorized_imports)
+        set_target(result, state, static_tools, custom_tools, authorized_imports)
+        return result
+
+    return run
+
+
+def _compile_augassign(node):
+    target = node.target
+    op = AUGMENTED_OPERATORS.get(type(node.op))
+    if op is None or not isinstance(target, (ast.Name, ast.Subscript, ast.Attribute)):
+        return _compile_fallback(node)
+    get_value = compile_ast(node.value)
+    is_add = isinstance(node.op, ast.Add)
+
+    def apply(current_value, value_to_add):
+        if is_add and isinstance(current_value, list) and not isinstance(value_to_add, list):
+            raise InterpreterError(f"Cannot add non-list value {value_to_add} to a list.")
+        return op(current_value, value_to_add)
+
+    if isinstance(target, ast.Name):
+        name = target.id
+
+        def run_name(state, static_tools, custom_tools, authorized_imports):
+            current_value = state.get(name, 0)
+            value_to_add = get_value(state, static_tools, custom_tools, authorized_imports)
+            if name in static_tools:
+                raise InterpreterError(f"Cannot assign to name '{name}': doing this would erase the existing tool!")
+            state[name] = current_value = apply(current_value, value_to_add)
+            return current_value
+
+        return run_name
+    elif isinstance(target, ast.Subscript):
+        get_obj = compile_ast(target.value)
+        get_key = compile_ast(target.slice)
+
+        def run_subscript(state, static_tools, custom_tools, authorized_imports):
+            obj = get_obj(state, static_tools, custom_tools, authorized_imports)
+            key = get_key(state, static_tools, custom_tools, authorized_imports)
+            value_to_add = get_value(state, static_tools, custom_tools, authorized_imports)
+            obj[key] = current_value = apply(obj[key], value_to_add)
+            return current_value
+
+        return run_subscript
+    else:
+        get_obj = compile_ast(target.value)
+        attr = target.attr
+
+        def run_attribute(state, static_tools, custom_tools, authorized_imports):
+            obj = get_obj(state, static_tools, custom_tools, authorized_imports)
+            value_to_add = get_value(state, static_tools, custom_tools, authorized_imports)
+            current_value = apply(getattr(obj, attr), value_to_add)
+            setattr(obj, attr, current_value)
+            return current_value
+
+        return run_attribute
+
+
+def _compile_if(node):
+    get_test = compile_ast(node.test)
+    body = compile_body(node.body)
+    orelse = compile_body(node.orelse)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        result = None
+        branch = body if get_test(state, static_tools, custom_tools, authorized_imports) else orelse
+        for statement in branch:
+            line_result = statement(state, static_tools, custom_tools, authorized_imports)
+            if line_result is not None:
+                result = line_result
+        return result
+
+    return run
+
+
+def _compile_for(node):
+    get_iterator = compile_ast(node.iter)
+    set_target = _compile_target(node.target)
+    body = compile_body(node.body)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        result = None
+        for item in get_iterator(state, static_tools, custom_tools, authorized_imports):
+            set_target(item, state, static_tools, custom_tools, authorized_imports)
+            try:
+                for statement in body:
+                    line_result = statement(state, static_tools, custom_tools, authorized_imports)
+                    if line_result is not None:
+                        result = line_result
+            except BreakException:
+                break
+            except ContinueException:
+                continue
+        return result
+
+    return run
+
+
+def _compile_while(node):
+    get_test = compile_ast(node.test)
+    body = compile_body(node.body)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        iterations = 0
+        while get_test(state, static_tools, custom_tools, authorized_imports):
+            try:
+                for statement in body:
+                    statement(state, static_tools, custom_tools, authorized_imports)
+            except BreakException:
+                return None
+            except ContinueException:
+                pass
+            iterations += 1
+            if iterations > MAX_WHILE_ITERATIONS:
+                raise InterpreterError(f"Maximum number of {MAX_WHILE_ITERATIONS} iterations in While loop exceeded")
+        return None
+
+    return run
+
+
+def _compile_function_def(node):
+    body = compile_body(node.body)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        custom_tools[node.name] = create_function(
+            node, state, static_tools, custom_tools, authorized_imports, compiled_body=body
+        )
+        return custom_tools[node.name]
+
+    return run
+
+
+def _compile_lambda(node):
+    args = [arg.arg for arg in node.args.args]
+    get_defaults = [compile_ast(d) for d in node.args.defaults]
+    get_kw_defaults = [compile_ast(d) if d is not None else None for d in node.args.kw_defaults]
+    get_body = compile_ast(node.body)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        # Defaults are evaluated once, when the lambda is created
+        defaults = lambda_defaults(
+            node.args,
+            [get_default(state, static_tools, custom_tools, authorized_imports) for get_default in get_defaults],
+            [
+                get_default(state, static_tools, custom_tools, authorized_imports) if get_default is not None else None
+                for get_default in get_kw_defaults
+            ],
+        )
+
+        def lambda_func(*values: Any, **kwargs: Any) -> Any:
+            new_state = Scope(state)
+            new_state.update(defaults)
+            new_state.update(zip(args, values))
+            if kwargs:
+                new_state.update(kwargs)
+            return get_body(new_state, static_tools, custom_tools, authorized_imports)
+
+        return lambda_func
+
+    return run
+
+
+def _compile_comprehension_target(target):
+    """Compile the target of a comprehension into `bind(state, value)`, as done by evaluate_listcomp."""
+    if isinstance(target, ast.Name):
+        name = target.id
+
+        def bind_name(state, value):
+            state[name] = value
+
+        return bind_name
+    elif isinstance(target, ast.Tuple) and all(isinstance(elt, ast.Name) for elt in target.elts):
+        names = [elt.id for elt in target.elts]
+
+        def bind_tuple(state, value):
+            for idx, name in enumerate(names):
+                state[name] = value[idx]
+
+        return bind_tuple
+    return None
+
+
+def _compile_listcomp(node):
+    generators = []
+    for generator in node.generators:
+        bind = _compile_comprehension_target(generator.target)
+        if bind is None:
+            return _compile_fallback(node)
+        generators.append((compile_ast(generator.iter), bind, [compile_ast(if_clause) for if_clause in generator.ifs]))
+    get_element = compile_ast(node.elt)
+
+    def inner_evaluate(index, scope, static_tools, custom_tools, authorized_imports):
+        get_iterator, bind, conditions = generators[index]
+        is_last = index == len(generators) - 1
+        result = []
+        for value in get_iterator(scope, static_tools, custom_tools, authorized_imports):
+            count_operation(scope)
+            bind(scope, value)
+            for condition in conditions:
+                if not condition(scope, static_tools, custom_tools, authorized_imports):
+                    break
+            else:
+                if is_last:
+                    result.append(get_element(scope, static_tools, custom_tools, authorized_imports))
+                else:
+                    result.extend(inner_evaluate(index + 1, scope, static_tools, custom_tools, authorized_imports))
+        return result
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        # A single scope for the whole comprehension, its targets are rebound for every element
+        return inner_evaluate(0, Scope(state), static_tools, custom_tools, authorized_imports)
+
+    return run
+
+
+def _compile_generatorexp(node):
+    generators = []
+    for generator in node.generators:
+        generators.append(
+            (compile_ast(generator.iter), _compile_target(generator.target), [compile_ast(c) for c in generator.ifs])
+        )
+    get_element = compile_ast(node.elt)
+
+    def inner_generate(index, iterable, scope, static_tools, custom_tools, authorized_imports):
+        get_iterator, set_target, conditions = generators[index]
+        if iterable is None:
+            iterable = get_iterator(scope, static_tools, custom_tools, authorized_imports)
+        is_last = index == len(generators) - 1
+        for value in iterable:
+            count_operation(scope)
+            set_target(value, scope, static_tools, custom_tools, authorized_imports)
+            for condition in conditions:
+                if not condition(scope, static_tools, custom_tools, authorized_imports):
+                    break
+            else:
+                if is_last:
+                    yield get_element(scope, static_tools, custom_tools, authorized_imports)
+                else:
+                    yield from inner_generate(index + 1, None, scope, static_tools, custom_tools, authorized_imports)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        # The outermost iterable is evaluated right away, the elements are produced on demand
+        get_iterator = generators[0][0]
+        iterable = iter(get_iterator(state, static_tools, custom_tools, authorized_imports))
+        return inner_generate(0, iterable, Scope(state), static_tools, custom_tools, authorized_imports)
+
+    return run
+
+
+def _compile_single_generator_comprehension(node, get_item):
+    """Compile a set or dict comprehension, adding the values returned by `get_item` to the result."""
+    generator = node.generators[0]
+    get_iterator = compile_ast(generator.iter)
+    set_target = _compile_target(generator.target)
+    conditions = [compile_ast(if_clause) for if_clause in generator.ifs]
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        items = []
+        scope = Scope(state)
+        for value in get_iterator(state, static_tools, custom_tools, authorized_imports):
+            count_operation(state)
+            set_target(value, scope, static_tools, custom_tools, authorized_imports)
+            for condition in conditions:
+                if not condition(scope, static_tools, custom_tools, authorized_imports):
+                    break
+            else:
+                items.append(get_item(scope, static_tools, custom_tools, authorized_imports))
+        return items
+
+    return run
+
+
+def _compile_setcomp(node):
+    if len(node.generators) != 1:
+        return _compile_fallback(node)
+    get_items = _compile_single_generator_comprehension(node, compile_ast(node.elt))
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return set(get_items(state, static_tools, custom_tools, authorized_imports))
+
+    return run
+
+
+def _compile_dictcomp(node):
+    if len(node.generators) != 1:
+        return _compile_fallback(node)
+    get_key = compile_ast(node.key)
+    get_value = compile_ast(node.value)
+
+    def get_item(state, static_tools, custom_tools, authorized_imports):
+        return (
+            get_key(state, static_tools, custom_tools, authorized_imports),
+            get_value(state, static_tools, custom_tools, authorized_imports),
+        )
+
+    get_items = _compile_single_generator_comprehension(node, get_item)
+
+    def run(state, static_tools, custom_tools, authorized_imports):
+        return dict(get_items(state, static_tools, custom_tools, authorized_imports))
+
+    return run
+
+
+NODE_COMPILERS = {
+    ast.Constant: _compile_constant,
+    ast.Name: _compile_name,
+    ast.Attribute: _compile_attribute,
+    ast.UnaryOp: _compile_unaryop,
+    ast.BinOp: _compile_binop,
+    ast.BoolOp: _compile_boolop,
+    ast.Compare: _compile_compare,
+    ast.IfExp: _compile_ifexp,
+    ast.Tuple: _compile_collection(tuple),
+    ast.List: _compile_collection(list),
+    ast.Set: _compile_collection(set),
+    ast.Dict: _compile_dict,
+    ast.Subscript: _compile_subscript,
+    ast.Slice: _compile_slice,
+    ast.JoinedStr: _compile_joinedstr,
+    ast.FormattedValue: _compile_formattedvalue,
+    ast.Starred: _compile_expr,
+    ast.Expr: _compile_expr,
+    ast.Pass: _compile_pass,
+    ast.Break: _compile_break,
+    ast.Continue: _compile_continue,
+    ast.Return: _compile_return,
+    ast.Call: _compile_call,
+    ast.Assign: _compile_assign,
+    ast.AugAssign: _compile_augassign,
+    ast.If: _compile_if,
+    ast.For: _compile_for,
+    ast.While: _compile_while,
+    ast.FunctionDef: _compile_function_def,
+    ast.Lambda: _compile_lambda,
+    ast.ListComp: _compile_listcomp,
+    ast.GeneratorExp: _compile_generatorexp,
+    ast.SetComp: _compile_setcomp,
+    ast.DictComp: _compile_dictcomp,
+}
+
+
+# Statements and expressions that can run natively: the ones supported by `evaluate_ast`, except class definitions
+NATIVE_NODE_TYPES = (
+    ast.Assign,
+    ast.AugAssign,
+    ast.Call,
+    ast.Constant,
+    ast.Tuple,
+    ast.GeneratorExp,
+    ast.ListComp,
+    ast.DictComp,
+    ast.SetComp,
+    ast.UnaryOp,
+    ast.Starred,
+    ast.BoolOp,
+    ast.Break,
+    ast.Continue,
+    ast.BinOp,
+    ast.Compare,
+    ast.Lambda,
+    ast.FunctionDef,
+    ast.Dict,
+    ast.Expr,
+    ast.For,
+    ast.FormattedValue,
+    ast.If,
+    ast.JoinedStr,
+    ast.List,
+    ast.Name,
+    ast.Subscript,
+    ast.IfExp,
+    ast.Attribute,
+    ast.Slice,
+    ast.While,
+    ast.Import,
+    ast.ImportFrom,
+    ast.Try,
+    ast.Raise,
+    ast.Assert,
+    ast.With,
+    ast.Set,
+    ast.Return,
+    ast.Pass,
+    ast.Delete,
+)
+
+# Introspection attributes reaching frames, which the interpreter hides by not running the code in Python frames
+NATIVE_FORBIDDEN_ATTRIBUTES = {
+    "gi_frame",
+    "gi_code",
+    "cr_frame",
+    "cr_code",
+    "ag_frame",
+    "ag_code",
+    "f_back",
+    "f_builtins",
+    "f_globals",
+    "f_locals",
+    "tb_frame",
+    "tb_next",
+}
+
+
+def _is_forbidden_attribute(attr_name: str) -> bool:
+    return (attr_name.startswith("__") and attr_name.endswith("__")) or attr_name in NATIVE_FORBIDDEN_ATTRIBUTES
+
+
+def find_native_violation(tree: ast.Module, authorized_imports: List[str]) -> Optional[str]:
+    """
+    Statically check code against the sandbox policy, before running it natively.
+
+    The check is conservative: it rejects dunder names and attributes, frame introspection, dynamic attribute names
+    in `getattr` and the like, constructs that the interpreter does not support and imports of unauthorized
+    modules. Names are checked against the state by `CompiledProgram.find_native_violation`.
+
+    Args:
+        tree (`ast.Module`):
+            The parsed code.
+        authorized_imports (`List[str]`):
+            The list of modules that can be imported by the code.
+
+    Returns:
+        Optional[str]: The reason why the code cannot run natively, or None if it can.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.stmt, ast.expr)) and not isinstance(node, NATIVE_NODE_TYPES):
+            return f"unsupported construct {type(node).__name__}"
+        if isinstance(node, ast.Attribute) and _is_forbidden_attribute(node.attr):
+            return f"forbidden attribute {node.attr}"
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id in ("getattr", "setattr", "hasattr", "delattr")
+        ):
+            attr_name = node.args[1] if len(node.args) > 1 else None
+            if not (isinstance(attr_name, ast.Constant) and isinstance(attr_name.value, str)):
+                return f"dynamic attribute name in {node.func.id}"
+            if _is_forbidden_attribute(attr_name.value):
+                return f"forbidden attribute {attr_name.value}"
+        names = []
+        if isinstance(node, ast.Name):
+            names = [node.id]
+        elif isinstance(node, (ast.FunctionDef, ast.alias)):
+            names = [node.name, getattr(node, "asname", None)]
+        elif isinstance(node, (ast.arg, ast.keyword)):
+            names = [node.arg]
+        elif isinstance(node, ast.ExceptHandler):
+            names = [node.name]
+        for name in names:
+            if name is not None and name.startswith("__"):
+                return f"dunder name {name}"
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if not check_module_authorized(alias.name, authorized_imports):
+                    return f"unauthorized import {alias.name}"
+        elif isinstance(node, ast.ImportFrom):
+            if node.module is None or node.level:
+                return "relative import"
+            if any(alias.name == "*" for alias in node.names):
+                return "star import"
+            if not check_module_authorized(node.module, authorized_imports):
+                return f"unauthorized import {node.module}"
+    return None
+
+
+def get_native_names(tree: ast.Module) -> Tuple[Set[str], Set[str]]:
+    """Return the names bound by the code, and the names it reads without binding them anywhere."""
+    bound, loaded, assigned = set(), set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            else:
+                bound.add(node.id)
+                assigned.add(node.id)
+        elif isinstance(node, ast.FunctionDef):
+            bound.add(node.name)
+            assigned.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.alias):
+            bound.add(node.asname or node.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    return assigned, loaded - bound
+
+
+class _NativeGuardTransformer(ast.NodeTransformer):
+    """
+    Instrument code to run natively with the same runtime checks as the interpreter: values read from names,
+    attributes, subscripts and calls, and the elements of loops, go through `__sandbox_check__`, callees through
+    `__sandbox_callee__`, and every loop iteration counts towards MAX_OPERATIONS.
+    """
+
+    @staticmethod
+    def _guard(guard_name, node):
+        return ast.copy_location(ast.Call(ast.Name(guard_name, ast.Load()), [node], []), node)
+
+    def visit_Name(self, node):
+        # A name can hold a value that was never checked, e.g. bound by unpacking or as an argument
+        return self._guard("__sandbox_check__", node) if isinstance(node.ctx, ast.Load) else node
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        return self._guard("__sandbox_check__", node) if isinstance(node.ctx, ast.Load) else node
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        return self._guard("__sandbox_check__", node) if isinstance(node.ctx, ast.Load) else node
+
+    def visit_Call(self, node):
+        func = node.func
+        node.args = [self.visit(arg) for arg in node.args]
+        node.keywords = [self.visit(keyword) for keyword in node.keywords]
+        if isinstance(func, ast.Attribute):
+            # Like `evaluate_call`, method lookups are only subject to the builtin check
+            func.value = self.visit(func.value)
+            func = self._guard("__sandbox_callee__", func)
+        elif isinstance(func, ast.Name):
+            # Tools and builtins are called by name: only checked like any name
+            func = self._guard("__sandbox_check__", func)
+        else:
+            func = self._guard("__sandbox_callee__", self.visit(func))
+        node.func = func
+        return self._guard("__sandbox_check__", node)
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        node.iter = self._guard("__sandbox_iter__", node.iter)
+        return node
+
+    def visit_comprehension(self, node):
+        self.generic_visit(node)
+        node.iter = self._guard("__sandbox_iter__", node.iter)
+        return node
+
+    def visit_While(self, node):
+        self.generic_visit(node)
+        tick = ast.Expr(ast.Call(ast.Name("__sandbox_tick__", ast.Load()), [], []))
+        node.body.insert(0, ast.copy_location(tick, node))
+        return node
+
+
+def compile_native_statement(statement: ast.stmt) -> Callable:
+    """
+    Compile a verified top-level statement to CPython bytecode.
+
+    The returned closure has the same signature as the ones of `compile_statement`. It runs the statement with the
+    state as globals, which must hold the namespace of `make_native_builtins` under "__builtins__", and returns the
+    value of expressions and of the names assigned, like `evaluate_ast`.
+    """
+    statement = _NativeGuardTransformer().visit(copy.deepcopy(statement))
+    if isinstance(statement, ast.Expr):
+        code = compile(ast.fix_missing_locations(ast.Expression(statement.value)), "<sandbox>", "eval")
+
+        def run_expression(state, static_tools, custom_tools, authorized_imports):
+            return check_safe_result(eval(code, state), static_tools, authorized_imports)
+
+        return run_expression
+
+    code = compile(ast.fix_missing_locations(ast.Module([statement], [])), "<sandbox>", "exec")
+    targets = []
+    if isinstance(statement, ast.Assign):
+        targets = statement.targets
+    elif isinstance(statement, ast.AugAssign):
+        targets = [statement.target]
+    result_name = targets[0].id if len(targets) == 1 and isinstance(targets[0], ast.Name) else None
+
+    def run_statement(state, static_tools, custom_tools, authorized_imports):
+        exec(code, state)
+        if result_name is None:
+            return None
+        return check_safe_result(state.get(result_name), static_tools, authorized_imports)
+
+    return run_statement
+
+
+def make_native_builtins(
+    state: Dict[str, Any], static_tools: Dict[str, Callable], custom_tools: Dict[str, Callable], authorized_imports
+) -> Dict[str, Any]:
+    """
+    Build the builtins of natively run code: only the tools, the errors and the guards of `_NativeGuardTransformer`
+    are reachable. Other names fail with a NameError, as the interpreter fails on unknown names.
+    """
+    static_tool_ids = {id(tool) for tool in static_tools.values()}
+    checked_types = (ModuleType, FunctionType, BuiltinFunctionType, dict)
+
+    def sandbox_check(value):
+        # Cheap type test of `check_safe_result` first, this runs for every name of the code
+        if not isinstance(value, checked_types):
+            return value
+        return check_safe_result(value, static_tools, authorized_imports)
+
+    def sandbox_callee(func):
+        if (
+            isinstance(func, BuiltinFunctionType)
+            and getattr(func, "__module__", None) == "builtins"
+            and id(func) not in static_tool_ids
+        ):
+            raise InterpreterError(
+                f"Invoking a builtin function that has not been explicitly added as a tool is not allowed ({func.__name__})."
+            )
+        return func
+
+    def sandbox_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if not check_module_authorized(name, authorized_imports):
+            raise InterpreterError(f"Import of {name} is not allowed. Authorized imports are: {str(authorized_imports)}")
+        return get_safe_module(__import__(name, fromlist=fromlist or ()), authorized_imports)
+
+    def sandbox_tick():
+        count_operation(state)
+
+    def sandbox_iter(iterable):
+        for value in iterable:
+            count_operation(state)
+            yield sandbox_check(value)
+
+    namespace = {**ERRORS, **custom_tools, **static_tools}
+    if "print" in static_tools:
+
+        def sandbox_print(*args, **kwargs):
+            state["_print_outputs"] += " ".join(map(str, args)) + "\n"
+
+        namespace["print"] = sandbox_print
+    namespace.update(
+        __import__=sandbox_import,
+        __sandbox_check__=sandbox_check,
+        __sandbox_callee__=sandbox_callee,
+        __sandbox_tick__=sandbox_tick,
+        __sandbox_iter__=sandbox_iter,
+    )
+    return namespace
+
+
+MAX_CACHED_PROGRAMS = 256
+
+# Types of the constants folded by `ConstantFolder`, and the size of the largest value it creates
+FOLDABLE_CONSTANT_TYPES = (bool, int, float, complex, str, bytes, type(None))
+MAX_FOLDED_SIZE = 4096
+
+FOLDABLE_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+FOLDABLE_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+FOLDABLE_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda left, right: left in right,
+    ast.NotIn: lambda left, right: left not in right,
+}
+
+
+def _is_foldable(node: ast.AST) -> bool:
+    if not isinstance(node, ast.Constant):
+        return False
+    if isinstance(node.value, tuple):
+        return all(isinstance(item, FOLDABLE_CONSTANT_TYPES) for item in node.value)
+    return isinstance(node.value, FOLDABLE_CONSTANT_TYPES)
+
+
+def _is_small(value: Any) -> bool:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value.bit_length() <= MAX_FOLDED_SIZE * 8
+    if isinstance(value, (str, bytes, tuple)):
+        return len(value) <= MAX_FOLDED_SIZE
+    return True
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """
+    Optimization pass run on the parsed code before it is compiled or evaluated. It evaluates once the expressions
+    made of constants (arithmetic, comparisons, boolean operators, tuples), joins the literal parts of f-strings, and
+    removes the branches of `if` and `while` statements whose test is a constant.
+
+    Folded nodes keep the position of the expression they replace, so `ast.get_source_segment` and line numbers
+    still point to the original code. An expression is only folded if evaluating it succeeds and gives a small value:
+    expressions that raise, like `1 / 0`, are left for the interpreter to report as before.
+
+    Results are preserved where the interpreter uses them: a statement list keeps its last statement as it is,
+    since modules and functions without return give the value of their last statement, while the statements of a
+    branch are spliced into the enclosing branch, whose value is the last non-None value of its statements.
+    """
+
+    @staticmethod
+    def _constant(value: Any, node: ast.AST) -> ast.Constant:
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    def _fold(self, node: ast.AST, function: Callable, *operands: ast.Constant) -> ast.AST:
+        try:
+            value = function(*(operand.value for operand in operands))
+        except Exception:
+            return node
+        if not isinstance(value, FOLDABLE_CONSTANT_TYPES + (tuple,)) or not _is_small(value):
+            return node
+        return self._constant(value, node)
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        function = FOLDABLE_BINARY_OPERATORS.get(type(node.op))
+        if function is None or not _is_foldable(node.left) or not _is_foldable(node.right):
+            return node
+        left, right = node.left.value, node.right.value
+        # Do not even compute the values that would be too large to keep
+        if isinstance(right, int) and not isinstance(right, bool):
+            if isinstance(node.op, ast.Pow) and abs(right) > 64 and left not in (0, 1, -1):
+                return node
+            if isinstance(node.op, ast.LShift) and right > MAX_FOLDED_SIZE * 8:
+                return node
+            if isinstance(node.op, ast.Mult) and isinstance(left, (str, bytes, tuple)) and len(left) * right > MAX_FOLDED_SIZE:
+                return node
+        if isinstance(node.op, ast.Mult) and isinstance(right, (str, bytes, tuple)) and isinstance(left, int):
+            if len(right) * left > MAX_FOLDED_SIZE:
+                return node
+        return self._fold(node, function, node.left, node.right)
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        function = FOLDABLE_UNARY_OPERATORS.get(type(node.op))
+        if function is None or not _is_foldable(node.operand):
+            return node
+        return self._fold(node, function, node.operand)
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        operands = [node.left, *node.comparators]
+        if not all(_is_foldable(operand) for operand in operands):
+            return node
+        if not all(type(op) in FOLDABLE_COMPARISONS for op in node.ops):
+            return node
+
+        def compare(*values):
+            return all(
+                FOLDABLE_COMPARISONS[type(op)](left, right) for op, left, right in zip(node.ops, values, values[1:])
+            )
+
+        return self._fold(node, compare, *operands)
+
+    def visit_BoolOp(self, node):
+        self.generic_visit(node)
+        values = list(node.values)
+        # Like evaluate_boolop, the leading constants either decide the result or are skipped
+        decisive = (lambda value: not value) if isinstance(node.op, ast.And) else bool
+        while _is_foldable(values[0]):
+            if decisive(values[0].value) or len(values) == 1:
+                return values[0] if len(values) == 1 else self._constant(values[0].value, node)
+            values.pop(0)
+        if len(values) == 1:
+            return values[0]
+        node.values = values
+        return node
+
+    def visit_IfExp(self, node):
+        self.generic_visit(node)
+        if not _is_foldable(node.test):
+            return node
+        return node.body if node.test.value else node.orelse
+
+    def visit_Tuple(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.ctx, ast.Load) or not all(_is_foldable(element) for element in node.elts):
+            return node
+        return self._fold(node, lambda *values: values, *node.elts)
+
+    def visit_JoinedStr(self, node):
+        self.generic_visit(node)
+        values = []
+        for value in node.values:
+            # Conversions like !r are only applied by the native engine: keep them unfolded to give the same result
+            if (
+                isinstance(value, ast.FormattedValue)
+                and value.conversion == -1
+                and _is_foldable(value.value)
+                and (value.format_spec is None or isinstance(value.format_spec, ast.Constant))
+            ):
+                try:
+                    if value.format_spec is None:
+                        value = self._constant(str(value.value.value), value)
+                    else:
+                        value = self._constant(format(value.value.value, value.format_spec.value), value)
+                except Exception:
+                    pass
+            if values and isinstance(value, ast.Constant) and isinstance(values[-1], ast.Constant):
+                merged = self._constant(values[-1].value + value.value, values[-1])
+                merged.end_lineno, merged.end_col_offset = value.end_lineno, value.end_col_offset
+                values[-1] = merged
+            else:
+                values.append(value)
+        if len(values) == 1 and isinstance(values[0], ast.Constant):
+            return self._constant(values[0].value, node)
+        if not values:
+            return self._constant("", node)
+        node.values = values
+        return node
+
+    def generic_visit(self, node):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                if value and all(isinstance(item, ast.stmt) for item in value):
+                    setattr(node, field, self._visit_statements(node, value))
+                    continue
+                items = []
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        item = self.visit(item)
+                    items.append(item)
+                value[:] = items
+            elif isinstance(value, ast.AST):
+                setattr(node, field, self.visit(value))
+        return node
+
+    def _visit_statements(self, parent: ast.AST, statements: List[ast.stmt]) -> List[ast.stmt]:
+        in_branch = isinstance(parent, ast.If)
+        result = []
+        for index, statement in enumerate(statements):
+            statement = self.visit(statement)
+            if in_branch or index < len(statements) - 1:
+                live_statements = self._live_statements(statement)
+                if live_statements is not None:
+                    result.extend(live_statements)
+                    continue
+            result.append(statement)
+        return result or [ast.copy_location(ast.Pass(), statements[0])]
+
+    @staticmethod
+    def _live_statements(statement: ast.stmt) -> Optional[List[ast.stmt]]:
+        """Statements left of an `if` or a `while` whose test is a constant, None for other statements."""
+        if isinstance(statement, ast.If) and _is_foldable(statement.test):
+            return statement.body if statement.test.value else statement.orelse
+        if isinstance(statement, ast.While) and _is_foldable(statement.test) and not statement.test.value:
+            return statement.orelse
+        return None
+
+
+def optimize_ast(tree: ast.Module) -> ast.Module:
+    """Fold the constants and remove the dead branches of a parsed code, see `ConstantFolder`."""
+    return ConstantFolder().visit(tree)
+
+
+class _NameReferenceCollector(ast.NodeVisitor):
+    """
+    Scope analysis of a whole program for the pre-flight checks: the names it binds anywhere, and the first reads,
+    calls and assignments of every name on the unconditional top-level path. Code that may not run is left to the
+    runtime checks: bodies of functions and lambdas, branches of conditionals, loops, `with` and `match` statements,
+    comprehensions and short-circuit operands, and the bodies of `try` statements, which may rely on the error being
+    caught.
+    """
+
+    def __init__(self):
+        self.bound: Set[str] = set()
+        self.loads: Dict[str, ast.Name] = {}
+        self.calls: Dict[str, ast.Name] = {}
+        self.stores: Dict[str, ast.Name] = {}
+        # Every name the code reads, assigns or deletes, guarded or not
+        self.referenced: Set[str] = set()
+        # Names whose value may be changed in place: by an item or attribute assignment, e.g. `df["a"] = 1`, or by
+        # calling one of its methods, e.g. `x["k"].append(2)` or `df.fillna(0, inplace=True)`
+        self.mutated: Set[str] = set()
+        self.star_import = False
+        self._guarded = 0
+
+    def _visit_guarded(self, nodes):
+        self._guarded += 1
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+        self._guarded -= 1
+
+    def visit_Try(self, node):
+        self._visit_guarded(node.body + node.handlers + node.orelse)
+        for child in node.finalbody:
+            self.visit(child)
+
+    visit_TryStar = visit_Try
+
+    def visit_If(self, node):
+        self.visit(node.test)
+        self._visit_guarded(node.body + node.orelse)
+
+    visit_While = visit_If
+
+    def visit_IfExp(self, node):
+        self.visit(node.test)
+        self._visit_guarded([node.body, node.orelse])
+
+    def visit_For(self, node):
+        self.visit(node.iter)
+        self._visit_guarded([node.target] + node.body + node.orelse)
+
+    visit_AsyncFor = visit_For
+
+    def visit_With(self, node):
+        # A context manager may suppress the error of its body
+        for item in node.items:
+            self.visit(item)
+        self._visit_guarded(node.body)
+
+    visit_AsyncWith = visit_With
+
+    def visit_Match(self, node):
+        self.visit(node.subject)
+        self._visit_guarded(node.cases)
+
+    def visit_BoolOp(self, node):
+        self.visit(node.values[0])
+        self._visit_guarded(node.values[1:])
+
+    def visit_Assert(self, node):
+        self.visit(node.test)
+        self._visit_guarded([node.msg])
+
+    def visit_ListComp(self, node):
+        # Only the first iterable is evaluated before the first element
+        first, *others = node.generators
+        self.visit(first.iter)
+        elements = [node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt]
+        self._visit_guarded([first.target, *first.ifs, *others, *elements])
+
+    visit_SetComp = visit_GeneratorExp = visit_DictComp = visit_ListComp
+
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name) and not self._guarded:
+            self.calls.setdefault(node.func.id, node.func)
+        elif isinstance(node.func, ast.Attribute):
+            self._mutate(node.func.value)
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        self.referenced.add(node.id)
+        if isinstance(node.ctx, ast.Load):
+            if not self._guarded:
+                self.loads.setdefault(node.id, node)
+        else:
+            self.bound.add(node.id)
+            if isinstance(node.ctx, ast.Store) and not self._guarded:
+                self.stores.setdefault(node.id, node)
+
+    def _mutate(self, node):
+        while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+            node = node.func if isinstance(node, ast.Call) else node.value
+        if isinstance(node, ast.Name):
+            self.mutated.add(node.id)
+
+    def visit_Subscript(self, node):
+        if not isinstance(node.ctx, ast.Load):
+            self._mutate(node.value)
+        self.generic_visit(node)
+
+    visit_Attribute = visit_Subscript
+
+    def _bind(self, node, name):
+        if name:
+            self.bound.add(name)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self.bound.add(node.name)
+        self._visit_guarded([*node.decorator_list, node.args, *node.body])
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visit_guarded([node.args, node.body])
+
+    def visit_ClassDef(self, node):
+        self._bind(node, node.name)
+
+    def visit_arg(self, node):
+        self._bind(node, node.arg)
+
+    def visit_ExceptHandler(self, node):
+        self._bind(node, node.name)
+
+    def visit_MatchAs(self, node):
+        self._bind(node, node.name)
+
+    visit_MatchStar = visit_MatchAs
+
+    def visit_MatchMapping(self, node):
+        self._bind(node, node.rest)
+
+    def visit_Global(self, node):
+        self.bound.update(node.names)
+
+    visit_Nonlocal = visit_Global
+
+    def visit_alias(self, node):
+        if node.name == "*":
+            self.star_import = True
+        else:
+            self.bound.add(node.asname or node.name.split(".")[0])
+
+
+class CompiledProgram:
+    """
+    Front-end result for a piece of code: the parsed tree, its top-level statements ready to run and the modules it
+    imports. Programs do not hold any execution state, so a cached program can be run on any state.
+    """
+
+    def __init__(self, code: str, engine: str):
+        try:
+            self.tree = ast.parse(code)
+        except SyntaxError as e:
+            raise InterpreterError(
+                f"Code parsing failed on line {e.lineno} due to: {type(e).__name__}\n"
+                f"{e.text}"
+                f"{' ' * (e.offset or 0)}^\n"
+                f"Error: {str(e)}"
+            )
+        self.tree = optimize_ast(self.tree)
+        if engine == "ast":
+            self.statements = [(node, partial(evaluate_ast, node)) for node in self.tree.body]
+        else:
+            self.statements = [(node, compile_statement(node)) for node in self.tree.body]
+        # Statements are compared without their position, so that a resubmitted script matches even if lines moved
+        self.statement_hashes = [hashlib.sha256(ast.dump(node).encode("utf-8")).hexdigest() for node in self.tree.body]
+        self.native_statements = None
+        if engine == "native":
+            self.assigned_names, self.free_names = get_native_names(self.tree)
+            self._native_violations = {}
+        # (import node, imported module) for every import of the code, nested ones included, in source order
+        self.imports = []
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Import):
+                self.imports.extend((node, alias.name) for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module is not None:
+                self.imports.append((node, node.module))
+        self.imports.sort(key=lambda item: (item[0].lineno, item[0].col_offset))
+        self._unauthorized_imports = {}
+        self.names = _NameReferenceCollector()
+        self.names.visit(self.tree)
+
+    def find_unauthorized_imports(self, authorized_imports: List[str]) -> List[Tuple[ast.stmt, str]]:
+        """Return the (import node, module) of the code that are not authorized."""
+        key = frozenset(authorized_imports)
+        if key not in self._unauthorized_imports:
+            self._unauthorized_imports[key] = [
+                (node, module_name)
+                for node, module_name in self.imports
+                if not check_module_authorized(module_name, authorized_imports)
+            ]
+        return self._unauthorized_imports[key]
+
+    def find_static_errors(
+        self,
+        state: Dict[str, Any],
+        static_tools: Dict[str, Callable],
+        custom_tools: Dict[str, Callable],
+        authorized_imports: List[str],
+    ) -> List[Tuple[ast.AST, str]]:
+        """
+        Pre-flight checks of the code against a state: unauthorized imports, names read or called but defined
+        nowhere, calls of builtins that are not tools and assignments to tools. Names are only checked on the
+        unconditional top-level path (see `_NameReferenceCollector`), so code that never runs cannot fail the program.
+        Return the (node, message) of the errors, in source order, with the messages the interpreter would raise when
+        reaching them.
+        """
+        errors = []
+        for node, module_name in self.find_unauthorized_imports(authorized_imports):
+            kind = "Import of" if isinstance(node, ast.Import) else "Import from"
+            errors.append((node, f"{kind} {module_name} is not allowed. Authorized imports are: {str(authorized_imports)}"))
+        names = self.names
+        for name, node in names.stores.items():
+            if name in static_tools:
+                errors.append((node, f"Cannot assign to name '{name}': doing this would erase the existing tool!"))
+        if not names.star_import:
+            for name, node in names.loads.items():
+                if name in names.bound:
+                    continue
+                if name in state:
+                    if name in names.calls and name not in static_tools:
+                        value = state[name]
+                        if (
+                            inspect.getmodule(value) == builtins
+                            and inspect.isbuiltin(value)
+                            and value not in static_tools.values()
+                        ):
+                            errors.append(
+                                (
+                                    names.calls[name],
+                                    f"Invoking a builtin function that has not been explicitly added as a tool is "
+                                    f"not allowed ({name}).",
+                                )
+                            )
+                elif name not in static_tools and name not in custom_tools and name not in ERRORS:
+                    if name in names.calls:
+                        message = (
+                            f"It is not permitted to evaluate other functions than the provided tools or functions "
+                            f"defined/imported in previous code (tried to execute {name})."
+                        )
+                    else:
+                        message = f"The variable `{name}` is not defined."
+                    suggestion = None
+                    if SUGGEST_CLOSE_NAMES:
+                        namespaces = (state, dict.fromkeys(names.bound), static_tools, custom_tools)
+                        suggestion = suggest_name(name, namespaces)
+                    if suggestion is not None:
+                        message += f" Did you mean `{suggestion}`?"
+                    errors.append((names.calls.get(name, node), message))
+        errors.sort(key=lambda error: (error[0].lineno, error[0].col_offset))
+        return errors
+
+    def find_native_violation(
+        self,
+        state: Dict[str, Any],
+        static_tools: Dict[str, Callable],
+        custom_tools: Dict[str, Callable],
+        authorized_imports: List[str],
+    ) -> Optional[str]:
+        """Return why the code cannot run natively on this state (see `find_native_violation`), or None if it can."""
+        key = frozenset(authorized_imports)
+        if key not in self._native_violations:
+            self._native_violations[key] = find_native_violation(self.tree, authorized_imports)
+        if self._native_violations[key] is not None:
+            return self._native_violations[key]
+        if type(state) is not dict:
+            return "the state is not a dict"
+        for name in self.assigned_names:
+            if name in static_tools:
+                return f"assignment to tool {name}"
+        for name in self.free_names:
+            if name not in state and name not in static_tools and name not in custom_tools and name not in ERRORS:
+                return f"undefined name {name}"
+        if self.native_statements is None:
+            self.native_statements = [(node, compile_native_statement(node)) for node in self.tree.body]
+        return None
+
+
+class ProgramCache:
+    """
+    Thread-safe LRU cache of `CompiledProgram`, keyed by the hash of the code and the engine.
+
+    Agents often resubmit the same code after an error: cache hits skip parsing, compilation and import analysis.
+    """
+
+    def __init__(self, maxsize: int = MAX_CACHED_PROGRAMS):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._programs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, code: str, engine: str = "compiled") -> CompiledProgram:
+        key = (hashlib.sha256(code.encode("utf-8")).hexdigest(), engine)
+        with self._lock:
+            program = self._programs.get(key)
+            if program is not None:
+                self._programs.move_to_end(key)
+                self.hits += 1
+                return program
+            self.misses += 1
+        program = CompiledProgram(code, engine)
+        with self._lock:
+            self._programs[key] = program
+            self._programs.move_to_end(key)
+            while len(self._programs) > self.maxsize:
+                self._programs.popitem(last=False)
+        return program
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._programs), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._programs.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+PROGRAM_CACHE = ProgramCache()
+
+
+def fingerprint_state(state: Dict[str, Any]) -> Dict[str, Tuple]:
+    """
+    Cheap summary of the variables of a state: identity, type and size of each value. In-place changes that keep the
+    size of a value, like `df.loc[0, "a"] = 1`, are not detected.
+    """
+    fingerprint = {}
+    for name, value in state.items():
+        if name in ("_print_outputs", "_operations_count", "__builtins__"):
+            continue
+        size = getattr(value, "shape", None) if hasattr(type(value), "shape") else None
+        if size is None and isinstance(value, (list, dict, set, str, bytes)):
+            size = len(value)
+        fingerprint[name] = (id(value), type(value), size)
+    return fingerprint
+
+
+class StatementMemo:
+    """
+    Memory of the top-level statements that succeeded before the failure of the last run of a persistent executor.
+
+    When an agent resubmits a script that failed, with a fix further down, the statements it starts with already ran
+    against the current state. If the state is still the one they left, they are skipped and their print outputs and
+    values are replayed, so that the run resumes at the first changed statement, at the latest the failing one.
+    Nothing is remembered after a run that succeeded: running the same script again runs all of it.
+
+    The state is compared with `fingerprint_state`, which misses in-place changes that keep the size of a value, e.g.
+    by the failing statement before it raised. Skipping is opt-in for this reason.
+    """
+
+    def __init__(self):
+        # (statement hash, print output, value, state fingerprint after the statement), in execution order, empty
+        # if the last run succeeded
+        self.entries: List[Tuple[str, str, Any, Dict[str, Tuple]]] = []
+
+    def resume_index(self, statement_hashes: List[str], state: Dict[str, Any]) -> int:
+        """Number of leading statements that can be skipped when running these statements on this state."""
+        common = 0
+        while (
+            common < len(statement_hashes)
+            and common < len(self.entries)
+            and statement_hashes[common] == self.entries[common][0]
+        ):
+            common += 1
+        if common == 0:
+            return 0
+        fingerprint = fingerprint_state(state)
+        # The state must not have changed since the last statement that would be skipped
+        while common > 0 and self.entries[common - 1][3] != fingerprint:
+            common -= 1
+        return common
+
+    def clear(self):
+        self.entries = []
+
+
+class FinalAnswerException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def evaluate_python_code(
+    code: str,
+    static_tools: Optional[Dict[str, Callable]] = None,
+    custom_tools: Optional[Dict[str, Callable]] = None,
+    state: Optional[Dict[str, Any]] = None,
+    authorized_imports: List[str] = BASE_BUILTIN_MODULES,
+    max_print_outputs_length: int = DEFAULT_MAX_LEN_OUTPUT,
+    engine: str = "compiled",
+    profiler: Optional[ExecutionProfiler] = None,
+    statement_memo: Optional[StatementMemo] = None,
+    print_outputs: Optional[PrintContainer] = None,
+):
+    """
+    Evaluate a python expression using the content of the variables stored in a state and only evaluating a given set
+    of functions.
+
+    This function will recurse through the nodes of the tree provided.
+
+    Args:
+        code (`str`):
+            The code to evaluate.
+        static_tools (`Dict[str, Callable]`):
+            The functions that may be called during the evaluation. These can also be agents in a multiagent setting.
+            These tools cannot be overwritten in the code: any assignment to their name will raise an error.
+        custom_tools (`Dict[str, Callable]`):
+            The functions that may be called during the evaluation.
+            These tools can be overwritten in the code: any assignment to their name will overwrite them.
+        state (`Dict[str, Any]`):
+            A dictionary mapping variable names to values. The `state` should contain the initial inputs but will be
+            updated by this function to contain all variables as they are evaluated.
+            The print outputs will be stored in the state under the key "_print_outputs".
+        authorized_imports (`List[str]`):
+            The list of modules that can be imported by the code. By default, only a few safe modules are allowed.
+            If it contains "*", it will authorize any import. Use this at your own risk!
+        max_print_outputs_length (`int`):
+            Maximum length of the print outputs, longer outputs are truncated while printing.
+        engine (`str`):
+            "compiled" to compile the code into closures once before running it (see `compile_ast`), "ast" to walk
+            the tree with `evaluate_ast` for every visited node, or "native" to run the code as CPython bytecode when
+            it passes the static checks of `find_native_violation`, and as "compiled" otherwise.
+        profiler (`ExecutionProfiler`, *optional*):
+            If given, collects the time spent per node type, per line and in native callees. The code is then run with
+            the "ast" engine whatever the value of `engine`, so that every node is timed.
+        statement_memo (`StatementMemo`, *optional*):
+            If given, the leading statements that already succeeded in the last run with this memo and this state, if
+            it failed, are skipped, and the memo is updated with the statements that succeed in this run if it fails.
+        print_outputs (`PrintContainer`, *optional*):
+            Container receiving the print outputs, e.g. to `stream` them while the code runs. It is closed at the end
+            of the evaluation. By default, a new container bounded by `max_print_outputs_length` is used.
+    """
+    if engine not in ("compiled", "ast", "native"):
+        raise ValueError(f"Unknown engine: {engine}. Supported engines: ['compiled', 'ast', 'native']")
+    if profiler is not None:
+        engine = "ast"
+    program = PROGRAM_CACHE.get(code, engine)
+
+    if state is None:
+        state = {}
+    static_tools = static_tools.copy() if static_tools is not None else {}
+    custom_tools = custom_tools if custom_tools is not None else {}
+    result = None
+    if print_outputs is None:
+        print_outputs = PrintContainer(max_print_outputs_length)
+    state["_print_outputs"] = print_outputs
+    state["_operations_count"] = {"counter": 0}
+
+    if "final_answer" in static_tools:
+        previous_final_answer = static_tools["final_answer"]
+
+        def final_answer(answer):  # Using 'answer' as the argument like in the original function
+            raise FinalAnswerException(previous_final_answer(answer))
+
+        static_tools["final_answer"] = final_answer
+
+    static_errors = program.find_static_errors(state, static_tools, custom_tools, authorized_imports)
+    if static_errors:
+        # Fail before running anything rather than after the statements preceding the errors
+        print_outputs.close()
+        lines = code.splitlines()
+        raise InterpreterError(
+            "\n".join(
+                f"Code execution failed at line '{lines[node.lineno - 1].strip()}' due to: InterpreterError: {message}"
+                for node, message in static_errors
+            )
+            + "\nNo code was executed."
+        )
+
+    statements = program.statements
+    run_natively = False
+    if engine == "native":
+        native_violation = program.find_native_violation(state, static_tools, custom_tools, authorized_imports)
+        run_natively = native_violation is None
+        if run_natively:
+            statements = program.native_statements
+            state["__builtins__"] = make_native_builtins(state, static_tools, custom_tools, authorized_imports)
+        else:
+            logger.debug(f"Running code with the interpreter instead of natively: {native_violation}")
+
+    skipped = 0
+    if statement_memo is not None:
+        skipped = statement_memo.resume_index(program.statement_hashes, state)
+        succeeded = statement_memo.entries[:skipped]
+        for _, print_output, result, _ in succeeded:
+            print_outputs += print_output
+    if profiler is not None:
+        profiler_token = _ACTIVE_PROFILER.set(profiler)
+        profiler.start(code)
+    failed = True
+    try:
+        for index in range(skipped, len(statements)):
+            node, run_statement = statements[index]
+            if statement_memo is None:
+                result = run_statement(state, static_tools, custom_tools, authorized_imports)
+                continue
+            print_start = len(print_outputs)
+            result = run_statement(state, static_tools, custom_tools, authorized_imports)
+            succeeded.append(
+                (
+                    program.statement_hashes[index],
+                    print_outputs.text_since(print_start),
+                    result,
+                    fingerprint_state(state),
+                )
+            )
+        is_final_answer = False
+        failed = False
+        return result, is_final_answer
+    except FinalAnswerException as e:
+        is_final_answer = True
+        failed = False
+        return e.value, is_final_answer
+    except Exception as e:
+        raise InterpreterError(
+            f"Code execution failed at line '{ast.get_source_segment(code, node)}' due to: {type(e).__name__}: {e}"
+        )
+    finally:
+        print_outputs.close()
+        if run_natively:
+            # Functions defined by the code keep their own reference to the builtins
+            state.pop("__builtins__", None)
+        if profiler is not None:
+            profiler.stop()
+            _ACTIVE_PROFILER.reset(profiler_token)
+        if statement_memo is not None:
+            # Only a failed run is resumed, up to its failing statement
+            statement_memo.entries = succeeded if failed else []
+
+
+class ExecutionBudget:
+    """
+    Limits of a single call of an executor, checked by a `BudgetWatchdog` thread every `poll_interval` seconds rather
+    than by the interpreter at every node. A limit set to None is not enforced.
+
+    Args:
+        max_seconds (`float`, *optional*): Wall-clock time of the call.
+        max_memory_bytes (`int`, *optional*): Growth of the resident memory of the process during the call. Only
+            enforced by executors owning their process, like the workers of the process backend, since concurrent
+            calls of other threads change the same resident memory. Also requires `/proc/self/statm`.
+        max_output_chars (`int`, *optional*): Characters printed by the call, including the truncated ones.
+        poll_interval (`float`): Seconds between two checks of the watchdog.
+    """
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = None,
+        max_memory_bytes: Optional[int] = None,
+        max_output_chars: Optional[int] = None,
+        poll_interval: float = 0.05,
+    ):
+        self.max_seconds = max_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_output_chars = max_output_chars
+        self.poll_interval = poll_interval
+
+
+class ExecutionBudgetExceeded(BaseException):
+    """
+    Raised asynchronously in the thread running the code when a budget is exceeded. It derives from BaseException so
+    that neither the interpreter nor an `except Exception` of the executed code catch it.
+    """
+
+    pass
+
+
+class ExecutionBudgetError(InterpreterError):
+    """Error of an executor call stopped by its `ExecutionBudget`, with the exceeded budget as structured details."""
+
+    hints = {
+        "time": "Work on a sample or aggregate in SQL before loading, and avoid python loops over rows.",
+        "memory": "Select only the needed columns and rows, e.g. with a WHERE and LIMIT in the query, or use chunks.",
+        "output": "Print aggregates or df.head() instead of whole tables.",
+    }
+
+    def __init__(self, budget: str, limit: float, used: float):
+        self.budget = budget
+        self.limit = limit
+        self.used = used
+        super().__init__(f"Code execution stopped: {budget} budget exceeded ({used:g} > {limit:g}).")
+
+    def __reduce__(self):
+        return type(self), (self.budget, self.limit, self.used)
+
+    @property
+    def details(self) -> Dict[str, Any]:
+        return {"budget": self.budget, "limit": self.limit, "used": self.used, "hint": self.hints[self.budget]}
+
+
+class ExecutionCancelledError(InterpreterError):
+    """Error of an executor call stopped because its cancel event was set."""
+
+    def __init__(self):
+        super().__init__("Code execution was cancelled.")
+
+
+def get_resident_memory() -> Optional[int]:
+    """Resident memory of the process in bytes, None if the platform does not expose it."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class BudgetWatchdog:
+    """
+    Thread enforcing an `ExecutionBudget` on the thread that started it. When a limit is exceeded or the cancel event
+    is set, it records the breach and raises `ExecutionBudgetExceeded` in the watched thread, again at every poll until
+    it is stopped in case the code swallows it. The exception is raised at the next bytecode run by the thread: a
+    blocking native call, such as a long query, is only interrupted when it returns. Code run by the "native" engine
+    with a bare `except:` catches it too, and keeps running until the next poll raises it again: a loop catching it at
+    every iteration is never stopped, only the process backend kills such a worker.
+
+    The memory budget is only enforced with `owns_process`, the resident memory of the process being shared by the
+    calls of all the threads. The peak memory is recorded either way.
+    """
+
+    def __init__(
+        self,
+        budget: ExecutionBudget,
+        print_outputs: PrintContainer,
+        cancel_event: Optional[threading.Event] = None,
+        owns_process: bool = False,
+    ):
+        self.budget = budget
+        self.print_outputs = print_outputs
+        self.cancel_event = cancel_event
+        self.owns_process = owns_process
+        self.breach: Optional[Tuple[str, float, float]] = None
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._start_memory = get_resident_memory()
+        # Largest resident memory seen by the checks, None if the platform does not expose it
+        self.peak_memory = self._start_memory
+        self._watcher = threading.Thread(target=self._watch, name="python-executor-watchdog", daemon=True)
+
+    def start(self):
+        self._watcher.start()
+
+    def check(self) -> Optional[Tuple[str, float, float]]:
+        """First exceeded budget as (budget, limit, used), ("cancelled", 0, 0) if cancelled, or None."""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            return "cancelled", 0, 0
+        budget = self.budget
+        if budget.max_seconds is not None:
+            elapsed = time.monotonic() - self._start_time
+            if elapsed > budget.max_seconds:
+                return "time", budget.max_seconds, round(elapsed, 3)
+        if self._start_memory is not None:
+            memory = get_resident_memory()
+            if memory is not None:
+                self.peak_memory = max(self.peak_memory, memory)
+                if (
+                    self.owns_process
+                    and budget.max_memory_bytes is not None
+                    and memory - self._start_memory > budget.max_memory_bytes
+                ):
+                    return "memory", budget.max_memory_bytes, memory - self._start_memory
+        if budget.max_output_chars is not None and len(self.print_outputs) > budget.max_output_chars:
+            return "output", budget.max_output_chars, len(self.print_outputs)
+        return None
+
+    def _watch(self):
+        while not self._stopped.wait(self.budget.poll_interval):
+            if self.breach is None:
+                self.breach = self.check()
+            if self.breach is not None:
+                with self._lock:
+                    if self._stopped.is_set():
+                        return
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+                        ctypes.c_ulong(self._thread_id), ctypes.py_object(ExecutionBudgetExceeded)
+                    )
+
+    def stop(self):
+        """Stop watching, and cancel an exception raised but not delivered yet. Must be called by the watched thread."""
+        while True:
+            try:
+                with self._lock:
+                    self._stopped.set()
+                    if self.breach is not None:
+                        ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self._thread_id), None)
+                break
+            except ExecutionBudgetExceeded:
+                continue
+        self._watcher.join()
+
+
+class PythonExecutor:
+    last_profile_report: Optional[str] = None
+    # Instrumentation of the last call, see `LocalPythonExecutor.collect_metrics`
+    last_metrics: Optional[Dict[str, Any]] = None
+
+    def memory_usage(self) -> int:
+        """Estimated number of bytes held by the state of the executor."""
+        return 0
+
+    def close(self):
+        """Release the resources held by the executor."""
+        pass
+
+
+class LocalPythonExecutor(PythonExecutor):
+    def __init__(
+        self,
+        additional_authorized_imports: List[str],
+        max_print_outputs_length: Optional[int] = None,
+        engine: str = "compiled",
+        profile: bool = False,
+        memoize_statements: bool = False,
+        budget: Optional[ExecutionBudget] = None,
+        snapshot: Optional["StateSnapshot"] = None,
+        owns_process: bool = False,
+    ):
+        self.custom_tools = {}
+        self.state = {}
+        self.max_print_outputs_length = max_print_outputs_length
+        if max_print_outputs_length is None:
+            self.max_print_outputs_length = DEFAULT_MAX_LEN_OUTPUT
+        self.additional_authorized_imports = additional_authorized_imports
+        self.authorized_imports = list(set(BASE_BUILTIN_MODULES) | set(self.additional_authorized_imports))
+        # TODO: assert self.authorized imports are all installed locally
+        self.static_tools = None
+        self.engine = engine
+        self.profile = profile
+        # Resubmitted scripts skip their leading statements that already succeeded, see `StatementMemo`
+        self.statement_memo = StatementMemo() if memoize_statements else None
+        # Limits of every call, see `BudgetWatchdog`. The memory one is only enforced if no other thread runs code
+        self.budget = budget
+        self.owns_process = owns_process
+        # Variables are restored from the snapshot when the code refers to them, and saved to it in the background
+        # after every call
+        self.snapshot = snapshot
+        self._snapshot_thread: Optional[threading.Thread] = None
+
+    def __call__(
+        self,
+        code_action: str,
+        print_outputs: Optional[PrintContainer] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Tuple[Any, str, bool]:
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExecutionCancelledError()
+        self.last_metrics = None
+        start_time = time.perf_counter()
+        start_memory = get_resident_memory()
+        variable_ids = {id(value) for value in self.state.values()}
+        profiler = ExecutionProfiler() if self.profile else None
+        assigned_names = None
+        if self.snapshot is not None:
+            self.wait_for_snapshot()
+            program_names = PROGRAM_CACHE.get(code_action, self.engine).names
+            assigned_names = program_names.bound | program_names.mutated
+            self.snapshot.restore(self.state, program_names.referenced | program_names.bound, self.authorized_imports)
+        if print_outputs is None:
+            print_outputs = PrintContainer(self.max_print_outputs_length)
+        elif print_outputs.max_length is None:
+            print_outputs.max_length = self.max_print_outputs_length
+        watchdog = None
+        if self.budget is not None or cancel_event is not None:
+            watchdog = BudgetWatchdog(self.budget or ExecutionBudget(), print_outputs, cancel_event, self.owns_process)
+            watchdog.start()
+        try:
+            output, is_final_answer = evaluate_python_code(
+                code_action,
+                static_tools=self.static_tools,
+                custom_tools=self.custom_tools,
+                state=self.state,
+                authorized_imports=self.authorized_imports,
+                max_print_outputs_length=self.max_print_outputs_length,
+                engine=self.engine,
+                profiler=profiler,
+                statement_memo=self.statement_memo,
+                print_outputs=print_outputs,
+            )
+        except ExecutionBudgetExceeded:
+            pass
+        finally:
+            if watchdog is not None:
+                watchdog.stop()
+            self.last_metrics = self.collect_metrics(
+                code_action,
+                "ast" if profiler is not None else self.engine,
+                time.perf_counter() - start_time,
+                start_memory,
+                watchdog.peak_memory if watchdog is not None else start_memory,
+                print_outputs,
+                variable_ids,
+            )
+            if profiler is not None:
+                self.last_profile_report = profiler.report()
+                logger.info(f"Python executor profile:\n{self.last_profile_report}")
+            if self.snapshot is not None:
+                # Off the latency of the call: the next call of the session waits for the save before running
+                self._snapshot_thread = threading.Thread(
+                    target=self._save_snapshot, args=(assigned_names,), name="python-executor-snapshot", daemon=True
+                )
+                self._snapshot_thread.start()
+        if watchdog is not None and watchdog.breach is not None:
+            if watchdog.breach[0] == "cancelled":
+                raise ExecutionCancelledError()
+            raise ExecutionBudgetError(*watchdog.breach)
+        logs = str(self.state["_print_outputs"])
+        return output, logs, is_final_answer
+
+    def _save_snapshot(self, assigned_names: Set[str]):
+        try:
+            self.snapshot.save(self.state, assigned_names)
+        except Exception as e:
+            logger.warning(f"Could not save the session snapshot: {type(e).__name__}: {e}")
+
+    def wait_for_snapshot(self):
+        """Wait for the snapshot of the last call to be written."""
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+
+    def close(self):
+        self.wait_for_snapshot()
+
+    def collect_metrics(
+        self,
+        code: str,
+        engine: str,
+        wall_seconds: float,
+        start_memory: Optional[int],
+        peak_memory: Optional[int],
+        print_outputs: PrintContainer,
+        variable_ids: Set[int],
+    ) -> Dict[str, Any]:
+        """
+        Instrumentation of a call, for capacity planning:
+        - operations: value of the operations counter, i.e. nodes for the "ast" engine, statements and loop elements
+          for "compiled" and loop iterations for "native" (see MAX_OPERATIONS)
+        - wall_seconds: duration of the call
+        - memory_growth_bytes: growth of the resident memory of the process, at its highest sampled point (sampled by
+          the `BudgetWatchdog` if any, else at the end of the call), None if the platform does not expose it
+        - modules_imported: modules imported by the code
+        - printed_chars: characters printed, including the truncated ones
+        - dataframe_rows: rows of the DataFrames the call assigned to variables
+        """
+        end_memory = get_resident_memory()
+        memory_growth = None
+        if start_memory is not None and end_memory is not None:
+            memory_growth = max(peak_memory or 0, end_memory) - start_memory
+        try:
+            modules = sorted({module_name for _, module_name in PROGRAM_CACHE.get(code, engine).imports})
+        except InterpreterError:
+            modules = []
+        dataframe_rows = 0
+        for value in self.state.values():
+            # DataFrames, like `estimate_object_size` detects pandas objects
+            if id(value) not in variable_ids and hasattr(value, "columns") and hasattr(value, "dtypes"):
+                dataframe_rows += len(value)
+        operations_count = self.state.get("_operations_count")
+        return {
+            "engine": engine,
+            "operations": operations_count["counter"] if operations_count is not None else 0,
+            "wall_seconds": round(wall_seconds, 6),
+            "memory_growth_bytes": memory_growth,
+            "modules_imported": modules,
+            "printed_chars": len(print_outputs),
+            "dataframe_rows": dataframe_rows,
+        }
+
+    def send_variables(self, variables: dict):
+        self.state.update(variables)
+
+    def memory_usage(self) -> int:
+        """Estimated number of bytes held by the variables of the state."""
+        return sum(estimate_object_size(value) for value in self.state.values())
+
+    # PISEK COMMENTED IT OUT
+    # def send_tools(self, tools: Dict[str, Tool]):
+    #     self.static_tools = {**tools, **BASE_PYTHON_TOOLS.copy()}
+
+
+SESSION_IDLE_TTL_SECONDS = 30 * 60
+SESSION_MAX_MEMORY_BYTES = 2 * 1024**3
+
+
+def estimate_object_size(value: Any) -> int:
+    """Approximate number of bytes held by a value: deep for pandas objects and arrays, shallow for containers."""
+    if isinstance(value, ModuleType):
+        return 0  # modules are shared by the whole process
+    try:
+        if hasattr(value, "memory_usage") and hasattr(value, "dtypes"):  # pandas DataFrame or Series
+            usage = value.memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+        if hasattr(value, "nbytes"):  # numpy arrays
+            return int(value.nbytes)
+    except Exception:
+        pass
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(key) + sys.getsizeof(item) for key, item in value.items())
+    return size
+
+
+class ExecutorSession:
+    def __init__(self, executor: PythonExecutor):
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.memory = 0
+
+
+class ExecutorSessionPool:
+    """
+    Executors kept alive between calls, keyed by a session id such as the LangGraph `thread_id`, so that variables,
+    imports and functions defined by a call are available to the next calls of the same session.
+
+    Sessions idle for more than `idle_ttl` seconds are dropped, as well as the least recently used sessions when the
+    estimated memory of all the sessions exceeds `max_memory_bytes`.
+    """
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL_SECONDS, max_memory_bytes: int = SESSION_MAX_MEMORY_BYTES):
+        self.idle_ttl = idle_ttl
+        self.max_memory_bytes = max_memory_bytes
+        self._sessions: Dict[str, ExecutorSession] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self, session_id: str, executor_factory: Callable[[], PythonExecutor]):
+        """
+        Context manager giving exclusive access to the executor of a session, created with `executor_factory` if the
+        session does not exist yet.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = ExecutorSession(executor_factory())
+        with session.lock:
+            try:
+                yield session.executor
+            finally:
+                session.last_used = time.monotonic()
+                session.memory = session.executor.memory_usage()
+        self.evict()
+
+    def close(self, session_id: str) -> bool:
+        """Drop a session, returns whether it existed."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.executor.close()
+        return True
+
+    def evict(self):
+        """Drop idle sessions, then the least recently used ones until the memory budget is met."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            # Sessions in use are never dropped
+            idle = [(session_id, s) for session_id, s in self._sessions.items() if not s.lock.locked()]
+            for session_id, session in idle:
+                if now - session.last_used > self.idle_ttl:
+                    evicted.append(self._sessions.pop(session_id))
+            total_memory = sum(session.memory for session in self._sessions.values())
+            for session_id, session in sorted(idle, key=lambda item: item[1].last_used):
+                if total_memory <= self.max_memory_bytes:
+                    break
+                if self._sessions.pop(session_id, None) is not None:
+                    logger.info(f"Evicting python executor session {session_id} ({session.memory} bytes)")
+                    evicted.append(session)
+                    total_memory -= session.memory
+        for session in evicted:
+            session.executor.close()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str):
+        return session_id in self._sessions
+
+
+EXECUTOR_SESSIONS = ExecutorSessionPool()
+
+
+def local_python_executor(
+    code: str,
+    authorized_imports: List[str],
+    session_id: Optional[str] = None,
+    backend: str = "local",
+    engine: str = "compiled",
+    profile: bool = False,
+    memoize_statements: bool = False,
+    artifact_dir: Optional[str] = None,
+    budget: Optional[ExecutionBudget] = None,
+    cancel_event: Optional[threading.Event] = None,
+    snapshot_dir: Optional[str] = None,
+    with_metrics: bool = False,
+):
+    """
+    Executes Python code in a sandboxed environment with restricted imports for security.
+    
+    This function provides a simplified interface to the LocalPythonExecutor class, allowing
+    for safe execution of Python code with controlled access to imports. It evaluates the 
+    provided code string and returns the result of the execution.
+    
+    Args:
+        code (str): 
+            The Python code to execute as a string. This can be any valid Python code,
+            including multiple statements, function definitions, class definitions, etc.
+        authorized_imports (List[str]): 
+            A list of module names that are allowed to be imported by the code.
+            These are in addition to the base built-in modules defined in BASE_BUILTIN_MODULES.
+            For unrestricted imports (use with caution), include "*" in the list.
+        session_id (Optional[str]):
+            Identifier of the session to run the code in, e.g. the LangGraph thread id. Variables, imports and
+            functions of previous calls of the session are kept (see `ExecutorSessionPool`). If None, the code runs
+            in a fresh executor.
+        backend (str):
+            "local" to run the code in the current process, or "process" to run it in a worker of the process-wide
+            `WorkerPool` (see `src.tools.process_pool_executor`), which preloads the authorized imports.
+        engine (str):
+            Engine of `evaluate_python_code`: "compiled", "ast" or "native" to run the code that passes the static
+            sandbox checks as CPython bytecode.
+        profile (bool):
+            Whether to profile the execution with an `ExecutionProfiler` and log its report. The code then runs with
+            the "ast" engine.
+        memoize_statements (bool):
+            Whether the leading statements of a code that already succeeded in the previous call of the session, if
+            that call failed, are skipped when the variables did not change since (see `StatementMemo`). Only used
+            with a session_id.
+        artifact_dir (Optional[str]):
+            If given, a returned DataFrame, Series or ndarray is encoded as a bounded preview, its full value being
+            written to an artifact of this directory (see `src.tools.result_store`). The code can reload artifacts
+            with the `load_artifact(handle)` tool.
+        budget (Optional[ExecutionBudget]):
+            Time, memory and output limits of the call. When one is exceeded, the code is stopped and an
+            `ExecutionBudgetError` is raised, whose `details` describe the exceeded budget. The memory limit is only
+            enforced by the "process" backend, whose workers run a single call at a time.
+        cancel_event (Optional[threading.Event]):
+            Event stopping the code when set, with an `ExecutionCancelledError`. With the "process" backend, it is
+            only checked before the code is sent to the worker.
+        snapshot_dir (Optional[str]):
+            If given, the variables of the session are saved to a snapshot in this directory after every call, and
+            restored from it when a new executor is created for the session, e.g. after a restart (see
+            `src.tools.state_snapshot`). Only used with a session_id.
+        with_metrics (bool):
+            Whether to return the instrumentation of the call with the result, as (result, metrics), see
+            `LocalPythonExecutor.collect_metrics`. If the call fails, the metrics are set as the `metrics` attribute
+            of the raised error.
+    
+    Returns:
+        Any: The result of the last statement in the executed code. If the code raises
+             an exception, an InterpreterError will be raised with details about the error.
+    
+    Raises:
+        InterpreterError: When the code execution fails due to syntax errors, unauthorized
                           imports, or other runtime errors.
     
     Examples:
@@ -1601,9 +4262,144 @@ def local_python_executor(code: str, authorized_imports: List[str]):
         >>> local_python_executor("data = {'a': 1, 'b': 2}; data['a'] + data['b']", [])
         3
     """
-    tool = LocalPythonExecutor(additional_authorized_imports=authorized_imports)
-    output, logs, is_final_answer = tool(code_action=code)
+    artifact_store = None
+    if artifact_dir is not None:
+        from src.tools.result_store import encode_result, get_artifact_store
+
+        artifact_store = get_artifact_store(artifact_dir)
+
+    if backend == "local":
+
+        def create_executor():
+            snapshot = None
+            if snapshot_dir is not None and session_id is not None:
+                from src.tools.state_snapshot import get_state_snapshot
+
+                snapshot = get_state_snapshot(snapshot_dir, session_id)
+            executor = LocalPythonExecutor(
+                additional_authorized_imports=authorized_imports,
+                engine=engine,
+                profile=profile,
+                memoize_statements=memoize_statements and session_id is not None,
+                budget=budget,
+                snapshot=snapshot,
+            )
+            if artifact_store is not None:
+                executor.custom_tools["load_artifact"] = artifact_store.load
+            return executor
+
+    elif backend == "process":
+        from src.tools.process_pool_executor import ProcessPythonExecutor, get_worker_pool
+
+        pool = get_worker_pool(preload_modules=authorized_imports)
+        session_snapshot_dir = None
+        if snapshot_dir is not None and session_id is not None:
+            from src.tools.state_snapshot import get_snapshot_directory
+
+            session_snapshot_dir = str(get_snapshot_directory(snapshot_dir, session_id))
+
+        def create_executor():
+            return ProcessPythonExecutor(
+                pool,
+                additional_authorized_imports=authorized_imports,
+                engine=engine,
+                profile=profile,
+                memoize_statements=memoize_statements and session_id is not None,
+                artifact_dir=artifact_dir,
+                budget=budget,
+                snapshot_dir=session_snapshot_dir,
+            )
+
+    else:
+        raise ValueError(f"Unknown backend: {backend}. Supported backends: ['local', 'process']")
+
+    def run(tool: PythonExecutor):
+        try:
+            return tool(code_action=code, cancel_event=cancel_event)
+        except Exception as e:
+            if with_metrics:
+                e.metrics = tool.last_metrics
+            raise
+
+    if session_id is None:
+        tool = create_executor()
+        try:
+            output, logs, is_final_answer = run(tool)
+        finally:
+            tool.close()
+    else:
+        with EXECUTOR_SESSIONS.session(session_id, create_executor) as tool:
+            if set(tool.additional_authorized_imports) != set(authorized_imports):
+                raise InterpreterError(f"Session {session_id} was created with different authorized imports.")
+            output, logs, is_final_answer = run(tool)
+    if artifact_store is not None:
+        output = encode_result(output, artifact_store)
+    if with_metrics:
+        return output, tool.last_metrics
     return output
 
 
-__all__ = ["evaluate_python_code", "LocalPythonExecutor"]
+ASYNC_MAX_WORKERS = 8
+
+_ASYNC_POOL: Optional[ThreadPoolExecutor] = None
+_ASYNC_POOL_LOCK = threading.Lock()
+
+
+def get_async_pool(max_workers: int = ASYNC_MAX_WORKERS) -> ThreadPoolExecutor:
+    """Return the process-wide thread pool of `alocal_python_executor`, created on first use with `max_workers`."""
+    global _ASYNC_POOL
+    with _ASYNC_POOL_LOCK:
+        if _ASYNC_POOL is None:
+            _ASYNC_POOL = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="python-executor")
+        return _ASYNC_POOL
+
+
+async def alocal_python_executor(
+    code: str,
+    authorized_imports: List[str],
+    session_id: Optional[str] = None,
+    backend: str = "local",
+    engine: str = "compiled",
+    profile: bool = False,
+    memoize_statements: bool = False,
+    artifact_dir: Optional[str] = None,
+    budget: Optional[ExecutionBudget] = None,
+    snapshot_dir: Optional[str] = None,
+    with_metrics: bool = False,
+    max_concurrency: int = ASYNC_MAX_WORKERS,
+):
+    """
+    Async version of `local_python_executor`, running it in the bounded thread pool of `get_async_pool` so that the
+    event loop is never blocked. Calls beyond `max_concurrency` wait for a free thread.
+
+    Cancelling the awaiting task stops the code (see `BudgetWatchdog`), or drops the call if it has not started yet.
+    The arguments are the ones of `local_python_executor`, plus:
+
+    Args:
+        max_concurrency (int):
+            Number of threads of the pool, only used by the first call, which creates it.
+    """
+    cancel_event = threading.Event()
+    call = partial(
+        local_python_executor,
+        code,
+        authorized_imports,
+        session_id=session_id,
+        backend=backend,
+        engine=engine,
+        profile=profile,
+        memoize_statements=memoize_statements,
+        artifact_dir=artifact_dir,
+        budget=budget,
+        cancel_event=cancel_event,
+        snapshot_dir=snapshot_dir,
+        with_metrics=with_metrics,
+    )
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_async_pool(max_concurrency), call)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        raise
+
+
+__all__ = ["evaluate_python_code", "compile_ast", "ExecutionProfiler", "ExecutionBudget", "ExecutionBudgetError", "ExecutionCancelledError", "LocalPythonExecutor", "ExecutorSessionPool", "EXECUTOR_SESSIONS", "alocal_python_executor"]
@@ -0,0 +1,306 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+import logging
+import multiprocessing
+import pickle
+import signal
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from importlib import import_module
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from src.tools.local_python_executor import (
+    ExecutionBudget,
+    ExecutionBudgetError,
+    ExecutionCancelledError,
+    InterpreterError,
+    LocalPythonExecutor,
+    PythonExecutor,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds given to a worker past its time budget to stop the code itself before the worker is killed
+HARD_TIMEOUT_GRACE_SECONDS = 5
+
+# Executors living in a worker process, keyed by session id
+_WORKER_SESSIONS: Dict[str, LocalPythonExecutor] = {}
+
+
+def _preload_modules(modules: Sequence[str]) -> None:
+    """Import modules ahead of the first call. Modules that cannot be imported are skipped."""
+    for module_name in modules:
+        try:
+            import_module(module_name)
+        except Exception:
+            pass
+
+
+def _get_worker_pid() -> int:
+    return os.getpid()
+
+
+def _run_in_worker(
+    session_id: Optional[str],
+    code: str,
+    authorized_imports: List[str],
+    max_print_outputs_length: Optional[int],
+    engine: str,
+    profile: bool,
+    memoize_statements: bool,
+    artifact_dir: Optional[str],
+    budget: Optional[ExecutionBudget],
+    snapshot_dir: Optional[str],
+) -> Tuple[bytes, str, bool, int, Optional[str], Optional[Dict[str, Any]]]:
+    executor = _WORKER_SESSIONS.get(session_id) if session_id is not None else None
+    if executor is None:
+        snapshot = None
+        if snapshot_dir is not None:
+            from src.tools.state_snapshot import StateSnapshot
+
+            snapshot = StateSnapshot(snapshot_dir)
+        executor = LocalPythonExecutor(
+            authorized_imports,
+            max_print_outputs_length=max_print_outputs_length,
+            engine=engine,
+            profile=profile,
+            memoize_statements=memoize_statements,
+            budget=budget,
+            snapshot=snapshot,
+            owns_process=True,
+        )
+        if artifact_dir is not None:
+            from src.tools.result_store import get_artifact_store
+
+            executor.custom_tools["load_artifact"] = get_artifact_store(artifact_dir).load
+        if session_id is not None:
+            _WORKER_SESSIONS[session_id] = executor
+    output, logs, is_final_answer = executor(code)
+    # Objects such as connections cannot be sent back to the parent process: send their representation instead
+    try:
+        output = pickle.dumps(output)
+    except Exception:
+        output = pickle.dumps(repr(output))
+    return output, logs, is_final_answer, executor.memory_usage(), executor.last_profile_report, executor.last_metrics
+
+
+def _close_in_worker(session_id: str) -> None:
+    executor = _WORKER_SESSIONS.pop(session_id, None)
+    if executor is not None:
+        executor.close()
+
+
+class _WorkerSlot:
+    def __init__(self, pool: ProcessPoolExecutor):
+        self.pool = pool
+        # Pid of the worker, to kill it when it runs past its budget (the pool has a single worker)
+        self.pid = pool.submit(_get_worker_pid)
+        self.in_flight = 0
+        self.sessions = set()
+
+
+class WorkerPool:
+    """
+    Pool of worker processes running sandboxed code, so that a long running script neither blocks the GIL of the
+    application nor other sessions.
+
+    Workers are started from a fork server which imports `preload_modules` once, so every worker starts with these
+    modules already imported and shares their memory copy-on-write. Each worker runs one call at a time. The calls of
+    a session always go to the same worker, which keeps the session state. New sessions and calls without a session
+    go to the least busy worker.
+
+    Args:
+        max_workers (`int`, *optional*): Number of workers, defaults to the number of cores.
+        preload_modules (`Sequence[str]`): Modules imported by the workers before their first call.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, preload_modules: Sequence[str] = ()):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.preload_modules = [module_name for module_name in preload_modules if module_name != "*"]
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(["src.tools.process_pool_executor", *self.preload_modules])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._slots = [self._create_slot() for _ in range(self.max_workers)]
+        self._session_slots: Dict[str, _WorkerSlot] = {}
+
+    def _create_slot(self) -> _WorkerSlot:
+        pool = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=self._context,
+            initializer=_preload_modules,
+            initargs=(self.preload_modules,),
+        )
+        # The worker starts with the pid request of `_WorkerSlot`, rather than on the first call
+        return _WorkerSlot(pool)
+
+    def _acquire_slot(self, session_id: Optional[str]) -> _WorkerSlot:
+        with self._lock:
+            slot = self._session_slots.get(session_id) if session_id is not None else None
+            if slot is None:
+                slot = min(self._slots, key=lambda candidate: (candidate.in_flight, len(candidate.sessions)))
+                if session_id is not None:
+                    self._session_slots[session_id] = slot
+                    slot.sessions.add(session_id)
+            slot.in_flight += 1
+            return slot
+
+    def run(
+        self,
+        code: str,
+        authorized_imports: List[str],
+        session_id: Optional[str] = None,
+        max_print_outputs_length: Optional[int] = None,
+        engine: str = "compiled",
+        profile: bool = False,
+        memoize_statements: bool = False,
+        artifact_dir: Optional[str] = None,
+        budget: Optional[ExecutionBudget] = None,
+        snapshot_dir: Optional[str] = None,
+    ) -> Tuple[Any, str, bool, int, Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Run code in a worker, returns the output, the logs, whether it is a final answer, the session memory, the
+        profile report if profiled, and the metrics of the call (see `LocalPythonExecutor.collect_metrics`).
+
+        The budget is enforced in the worker. If the code is still running `HARD_TIMEOUT_GRACE_SECONDS` after its
+        time budget, e.g. blocked in a native call, the worker is killed and its sessions are lost.
+        """
+        timeout = None
+        if budget is not None and budget.max_seconds is not None:
+            timeout = budget.max_seconds + HARD_TIMEOUT_GRACE_SECONDS
+        slot = self._acquire_slot(session_id)
+        try:
+            future = slot.pool.submit(
+                _run_in_worker,
+                session_id,
+                code,
+                authorized_imports,
+                max_print_outputs_length,
+                engine,
+                profile,
+                memoize_statements,
+                artifact_dir,
+                budget,
+                snapshot_dir,
+            )
+            output, logs, is_final_answer, memory, profile_report, metrics = future.result(timeout=timeout)
+        except TimeoutError:
+            self._replace_slot(slot, kill=True)
+            raise ExecutionBudgetError("time", budget.max_seconds, timeout)
+        except BrokenProcessPool:
+            self._replace_slot(slot)
+            raise InterpreterError("The python worker process crashed, the variables of the session were lost.")
+        finally:
+            with self._lock:
+                slot.in_flight -= 1
+        return pickle.loads(output), logs, is_final_answer, memory, profile_report, metrics
+
+    def _replace_slot(self, slot: _WorkerSlot, kill: bool = False) -> None:
+        with self._lock:
+            if slot not in self._slots:
+                return
+            for session_id in slot.sessions:
+                self._session_slots.pop(session_id, None)
+            self._slots[self._slots.index(slot)] = self._create_slot()
+        if kill:
+            # ProcessPoolExecutor has no public way to stop a running task: kill its worker
+            try:
+                os.kill(slot.pid.result(timeout=0), getattr(signal, "SIGKILL", signal.SIGTERM))
+            except (TimeoutError, ProcessLookupError, BrokenProcessPool) as e:
+                logger.warning(f"Could not kill the python worker, it stops at the end of its code: {type(e).__name__}")
+        slot.pool.shutdown(wait=False, cancel_futures=True)
+
+    def close_session(self, session_id: str) -> None:
+        with self._lock:
+            slot = self._session_slots.pop(session_id, None)
+            if slot is None:
+                return
+            slot.sessions.discard(session_id)
+        slot.pool.submit(_close_in_worker, session_id)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            slots, self._slots = self._slots, []
+            self._session_slots.clear()
+        for slot in slots:
+            slot.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class ProcessPythonExecutor(PythonExecutor):
+    """
+    Executor with the interface of `LocalPythonExecutor`, running the code in a worker of a `WorkerPool`. The state
+    lives in the worker and is dropped by `close`, or also kept on disk if `snapshot_dir`, the directory of the snapshot
+    of the session, is given (see `src.tools.state_snapshot`).
+    """
+
+    def __init__(
+        self,
+        pool: WorkerPool,
+        additional_authorized_imports: List[str],
+        max_print_outputs_length: Optional[int] = None,
+        engine: str = "compiled",
+        profile: bool = False,
+        memoize_statements: bool = False,
+        artifact_dir: Optional[str] = None,
+        budget: Optional[ExecutionBudget] = None,
+        snapshot_dir: Optional[str] = None,
+    ):
+        self.pool = pool
+        self.additional_authorized_imports = additional_authorized_imports
+        self.max_print_outputs_length = max_print_outputs_length
+        self.engine = engine
+        self.profile = profile
+        self.memoize_statements = memoize_statements
+        self.artifact_dir = artifact_dir
+        self.budget = budget
+        self.snapshot_dir = snapshot_dir
+        self.session_id = uuid.uuid4().hex
+        self._memory = 0
+
+    def __call__(self, code_action: str, cancel_event: Optional[threading.Event] = None) -> Tuple[Any, str, bool]:
+        # A running call cannot be stopped without killing the worker and its other sessions: it ends within its budget
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExecutionCancelledError()
+        self.last_metrics = None
+        output, logs, is_final_answer, self._memory, self.last_profile_report, self.last_metrics = self.pool.run(
+            code_action,
+            self.additional_authorized_imports,
+            session_id=self.session_id,
+            max_print_outputs_length=self.max_print_outputs_length,
+            engine=self.engine,
+            profile=self.profile,
+            memoize_statements=self.memoize_statements,
+            artifact_dir=self.artifact_dir,
+            budget=self.budget,
+            snapshot_dir=self.snapshot_dir,
+        )
+        if self.last_profile_report is not None:
+            logger.info(f"Python executor profile:\n{self.last_profile_report}")
+        return output, logs, is_final_answer
+
+    def memory_usage(self) -> int:
+        return self._memory
+
+    def close(self):
+        self.pool.close_session(self.session_id)
+
+
+_DEFAULT_POOL: Optional[WorkerPool] = None
+_DEFAULT_POOL_LOCK = threading.Lock()
+
+
+def get_worker_pool(preload_modules: Sequence[str] = ()) -> WorkerPool:
+    """Return the process-wide worker pool, created on first use with the given modules preloaded."""
+    global _DEFAULT_POOL
+    with _DEFAULT_POOL_LOCK:
+        if _DEFAULT_POOL is None:
+            _DEFAULT_POOL = WorkerPool(preload_modules=preload_modules)
+        return _DEFAULT_POOL
+
+
+__all__ = ["WorkerPool", "ProcessPythonExecutor", "get_worker_pool"]
@@ -0,0 +1,203 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+import logging
+import re
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Rows shown in the preview of a returned DataFrame, Series or array
+PREVIEW_ROWS = 5
+# Columns described in the preview, wider tables only show their shape for the others
+PREVIEW_COLUMNS = 20
+# Total size of the artifacts of a store, the least recently written ones are deleted beyond
+ARTIFACT_STORE_MAX_BYTES = 1024**3
+# Names of the files written by `ArtifactStore.save`, the only ones it loads and evicts
+ARTIFACT_FILE_PATTERN = re.compile(r"[0-9a-f]{12}\.(npy|frame\.arrow|series\.arrow)")
+
+
+def write_arrow(value, path) -> None:
+    """Write a DataFrame or Series to an Arrow IPC file, index included.
+
+    Args:
+        value (pd.DataFrame | pd.Series): Value to write
+        path (str | Path): Destination file
+    """
+    import pyarrow as pa
+
+    frame = value.to_frame() if isinstance(value, pd.Series) else value
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_arrow(path, series: bool = False, zero_copy: bool = False):
+    """Read a DataFrame or Series written by `write_arrow`, memory-mapping the file. The columns are copied into
+    pandas, unless `zero_copy`: numeric columns without nulls then keep using the map and are read-only, like the
+    arrays of `np.load(mmap_mode="r")`. Other columns, e.g. strings, are always converted.
+
+    Args:
+        path (str | Path): Arrow IPC file
+        series (bool): Whether the file holds a Series
+        zero_copy (bool): Whether to read the columns that allow it from the map, read-only
+
+    Returns:
+        pd.DataFrame | pd.Series: The stored value
+    """
+    import pyarrow as pa
+
+    # The map stays open as long as the returned value uses its buffers. Unsplit blocks would copy every column.
+    frame = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all().to_pandas(split_blocks=zero_copy)
+    return frame.iloc[:, 0] if series else frame
+
+
+class ArtifactStore:
+    """Local store for the full values of tool results, as Arrow IPC files for DataFrames and Series and npy files
+    for arrays. Both formats are memory-mapped on reload: arrays and the numeric columns without nulls of DataFrames
+    are read-only views of the file, not copies (see `read_arrow`).
+
+    Args:
+        directory (str | Path): Directory of the artifact files
+        max_bytes (int): Total size of the artifacts, the oldest ones are deleted beyond
+    """
+
+    def __init__(self, directory, max_bytes: int = ARTIFACT_STORE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def save(self, value: Any) -> str:
+        """Write a DataFrame, Series or ndarray to an artifact file.
+
+        Args:
+            value (pd.DataFrame | pd.Series | np.ndarray): Value to store
+
+        Returns:
+            str: Handle of the artifact, to pass to `load`
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        artifact_id = uuid.uuid4().hex[:12]
+        if isinstance(value, np.ndarray):
+            np.save(self.directory / f"{artifact_id}.npy", value, allow_pickle=False)
+        else:
+            kind = "series" if isinstance(value, pd.Series) else "frame"
+            write_arrow(value, self.directory / f"{artifact_id}.{kind}.arrow")
+        self.evict()
+        return artifact_id
+
+    def load(self, handle: str) -> Any:
+        """Reload the value of an artifact, memory-mapping its file.
+
+        Args:
+            handle (str): Handle returned by `save`
+
+        Returns:
+            pd.DataFrame | pd.Series | np.ndarray: The stored value
+        """
+        matches = [path for path in self.directory.glob(f"{Path(handle).name}.*") if self._is_artifact(path)]
+        if not handle or not matches:
+            raise KeyError(f"Unknown artifact: {handle}. It may have been deleted to free space.")
+        path = matches[0]
+        if path.suffix == ".npy":
+            return np.load(path, mmap_mode="r", allow_pickle=False)
+        return read_arrow(path, series=path.name.endswith(".series.arrow"), zero_copy=True)
+
+    @staticmethod
+    def _is_artifact(path: Path) -> bool:
+        return ARTIFACT_FILE_PATTERN.fullmatch(path.name) is not None
+
+    def evict(self):
+        """Delete the oldest artifacts until the store fits in `max_bytes`. Other files of the directory are kept."""
+        with self._lock:
+            files = sorted(filter(self._is_artifact, self.directory.iterdir()), key=lambda path: path.stat().st_mtime)
+            total = sum(path.stat().st_size for path in files)
+            for path in files:
+                if total <= self.max_bytes:
+                    break
+                total -= path.stat().st_size
+                path.unlink(missing_ok=True)
+
+
+def describe_value(value: Any) -> Dict[str, Any]:
+    """Bounded preview of a DataFrame, Series or ndarray: shape, dtypes, first rows and summary statistics.
+
+    Args:
+        value (pd.DataFrame | pd.Series | np.ndarray): Value to describe
+
+    Returns:
+        Dict[str, Any]: The preview
+    """
+    if isinstance(value, np.ndarray):
+        preview = {
+            "type": "ndarray",
+            "shape": list(value.shape),
+            "dtype": str(value.dtype),
+            "head": np.array2string(value[:PREVIEW_ROWS] if value.ndim else value, threshold=50, edgeitems=3),
+        }
+        if value.size and (np.issubdtype(value.dtype, np.integer) or np.issubdtype(value.dtype, np.floating)):
+            preview["summary"] = {
+                "min": value.min().item(),
+                "max": value.max().item(),
+                "mean": float(value.mean()),
+            }
+        return preview
+
+    frame = value.to_frame() if isinstance(value, pd.Series) else value
+    columns = frame.columns[:PREVIEW_COLUMNS]
+    preview = {
+        "type": type(value).__name__,
+        "shape": list(value.shape),
+        "dtypes": {str(column): str(dtype) for column, dtype in frame.dtypes[columns].items()},
+        "head": frame.head(PREVIEW_ROWS).to_string(max_cols=PREVIEW_COLUMNS, max_colwidth=50),
+    }
+    numeric = frame[columns].select_dtypes("number")
+    if len(numeric.columns) and len(frame):
+        preview["summary"] = numeric.describe().loc[["mean", "std", "min", "max"]].round(4).to_string()
+    return preview
+
+
+def encode_result(value: Any, store: Optional[ArtifactStore] = None) -> Any:
+    """Encode a tool result for the LLM: DataFrames, Series and ndarrays become a bounded preview, with the full
+    value written to the artifact store when it does not fit in the preview. Other values are returned as they are.
+
+    Args:
+        value (Any): Result of the executed code
+        store (ArtifactStore): Store for the full values, no artifact is written if None
+
+    Returns:
+        Any: The encoded result
+    """
+    if not isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return value
+    preview = describe_value(value)
+    rows = len(value) if getattr(value, "ndim", 1) else 1
+    columns = value.shape[1] if getattr(value, "ndim", 1) > 1 else 1
+    if store is not None and (rows > PREVIEW_ROWS or columns > PREVIEW_COLUMNS):
+        try:
+            preview["artifact"] = store.save(value)
+            preview["reload"] = f"load_artifact('{preview['artifact']}')"
+        except Exception as e:
+            # e.g. object columns mixing types, which Arrow cannot store: the preview is still returned
+            logger.warning(f"Could not store the result as an artifact: {type(e).__name__}: {e}")
+    return preview
+
+
+_STORES: Dict[Path, ArtifactStore] = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_artifact_store(directory) -> ArtifactStore:
+    """Process-wide store of a directory, shared by every session writing to it."""
+    directory = Path(directory).resolve()
+    with _STORES_LOCK:
+        if directory not in _STORES:
+            _STORES[directory] = ArtifactStore(directory)
+        return _STORES[directory]
@@ -0,0 +1,231 @@
+import os, sys
+project_root = os.path.abspath(os.path.join(__file__, "../../.."))
+sys.path.insert(0, project_root)  # add repo entrypoint to python path
+import hashlib
+import json
+import logging
+import pickle
+import shutil
+import time
+from importlib import import_module
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.tools.local_python_executor import InterpreterError, check_module_authorized, fingerprint_state, get_safe_module
+from src.tools.result_store import read_arrow, write_arrow
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+# Snapshots of sessions not saved for longer are deleted by `prune_state_snapshots`
+SNAPSHOT_MAX_AGE_SECONDS = 7 * 24 * 3600
+
+
+class StateSnapshot:
+    """Snapshot on disk of the variables of an executor session. A session dropped by a restart, an eviction or a
+    migration to another process then resumes where it stopped, instead of replaying the steps of the LLM.
+
+    Every variable has its own file: DataFrames and Series as Arrow IPC files (columnar), arrays as npy files, modules
+    as the name to import again and other values pickled. Values that cannot be pickled, like connections or functions
+    defined by the code, are skipped. Saves only rewrite the variables a call assigned or called a method of, which may
+    have changed them in place, or whose fingerprint changed (see `fingerprint_state`), and restores only load the
+    variables a call refers to.
+
+    Args:
+        directory (str | Path): Directory of the snapshot of the session
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        manifest_path = self.directory / MANIFEST_NAME
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        if manifest_path.exists():
+            try:
+                self.manifest = json.loads(manifest_path.read_text())["variables"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable snapshot {self.directory}: {type(e).__name__}: {e}")
+        # Fingerprints of the variables as last saved or restored, see `fingerprint_state`
+        self._fingerprints: Dict[str, tuple] = {}
+        self.skipped: List[str] = []
+
+    def restore(self, state: Dict[str, Any], names: Iterable[str], authorized_imports: List[str]) -> List[str]:
+        """Load the snapshotted variables among `names` that are not in the state yet.
+
+        Args:
+            state (Dict[str, Any]): State of the executor
+            names (Iterable[str]): Names the code about to run refers to
+            authorized_imports (List[str]): Modules the session may import, snapshotted modules are imported again
+
+        Returns:
+            List[str]: Names of the restored variables
+        """
+        restored = {}
+        for name in names:
+            entry = self.manifest.get(name)
+            if entry is None or name in state:
+                continue
+            try:
+                restored[name] = self._load(entry, authorized_imports)
+            except Exception as e:
+                logger.warning(f"Could not restore variable {name} from {self.directory}: {type(e).__name__}: {e}")
+        state.update(restored)
+        self._fingerprints.update(fingerprint_state(restored))
+        return list(restored)
+
+    def save(self, state: Dict[str, Any], touched: Iterable[str]):
+        """Write the variables of the state that changed since the last save.
+
+        Args:
+            state (Dict[str, Any]): State of the executor after a call
+            touched (Iterable[str]): Names the call assigned, or may have changed in place with an item or
+                attribute assignment or a method call. Their values, and the variables aliasing them, are rewritten even when their fingerprint
+                did not change. Variables the call only read are rewritten if their fingerprint changed.
+        """
+        touched = set(touched)
+        fingerprints = fingerprint_state(state)
+        touched_ids = {fingerprint[0] for name, fingerprint in fingerprints.items() if name in touched}
+        changed = False
+        for name in touched:
+            if name not in fingerprints:  # deleted by the call
+                if name in self.skipped:
+                    self.skipped.remove(name)
+                if name in self.manifest:
+                    self._remove(name)
+                    changed = True
+        for name, fingerprint in fingerprints.items():
+            if name in touched or fingerprint[0] in touched_ids or self._fingerprints.get(name) != fingerprint:
+                try:
+                    entry = self._write(name, state[name])
+                except OSError as e:
+                    logger.warning(f"Could not snapshot variable {name}: {type(e).__name__}: {e}")
+                    continue
+                if entry is None:
+                    if name not in self.skipped:
+                        self.skipped.append(name)
+                    if name in self.manifest:
+                        self._remove(name)
+                else:
+                    if name in self.skipped:
+                        self.skipped.remove(name)
+                    self.manifest[name] = entry
+                self._fingerprints[name] = fingerprint
+                changed = True
+        if changed:
+            self._write_manifest()
+
+    def delete(self):
+        """Delete the snapshot."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.manifest = {}
+        self._fingerprints = {}
+
+    def _write(self, name: str, value: Any) -> Optional[Dict[str, Any]]:
+        """Write a variable to its file, returns its manifest entry or None if it cannot be snapshotted."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = None
+        if isinstance(value, ModuleType):
+            entry = {"kind": "module", "module": value.__name__}
+        elif isinstance(value, (pd.DataFrame, pd.Series)) and _has_string_columns(value):
+            entry = {"kind": "series" if isinstance(value, pd.Series) else "frame", "file": f"{name}.arrow"}
+            try:
+                write_arrow(value, self.directory / f"{entry['file']}.tmp")
+            except Exception:
+                # e.g. object columns mixing types, which Arrow cannot store
+                (self.directory / f"{entry['file']}.tmp").unlink(missing_ok=True)
+                entry = None
+        elif isinstance(value, np.ndarray) and not value.dtype.hasobject:
+            entry = {"kind": "ndarray", "file": f"{name}.npy"}
+            with open(self.directory / f"{entry['file']}.tmp", "wb") as file:
+                np.save(file, value, allow_pickle=False)
+        if entry is None:
+            try:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                return None
+            entry = {"kind": "pickle", "file": f"{name}.pkl"}
+            (self.directory / f"{entry['file']}.tmp").write_bytes(data)
+        if "file" in entry:
+            os.replace(self.directory / f"{entry['file']}.tmp", self.directory / entry["file"])
+        previous = self.manifest.get(name)
+        if previous is not None and previous.get("file") not in (None, entry.get("file")):
+            (self.directory / previous["file"]).unlink(missing_ok=True)
+        return entry
+
+    def _load(self, entry: Dict[str, Any], authorized_imports: List[str]) -> Any:
+        kind = entry["kind"]
+        if kind == "module":
+            if not check_module_authorized(entry["module"], authorized_imports):
+                raise InterpreterError(f"Import of {entry['module']} is not allowed.")
+            return get_safe_module(import_module(entry["module"]), authorized_imports)
+        path = self.directory / entry["file"]
+        if kind in ("frame", "series"):
+            return read_arrow(path, series=kind == "series")
+        if kind == "ndarray":
+            # Copy-on-write map: the array is read on access and can still be modified by the code
+            return np.load(path, mmap_mode="c", allow_pickle=False)
+        return pickle.loads(path.read_bytes())
+
+    def _remove(self, name: str):
+        entry = self.manifest.pop(name)
+        self._fingerprints.pop(name, None)
+        if "file" in entry:
+            (self.directory / entry["file"]).unlink(missing_ok=True)
+
+    def _write_manifest(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest = {"saved_at": time.time(), "variables": self.manifest, "skipped": self.skipped}
+        temporary_path = self.directory / f"{MANIFEST_NAME}.tmp"
+        temporary_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(temporary_path, self.directory / MANIFEST_NAME)
+
+
+def _has_string_columns(value) -> bool:
+    """Whether Arrow keeps the column names of a DataFrame or Series, which it converts to strings."""
+    if isinstance(value, pd.Series):
+        return isinstance(value.name, str)
+    return not isinstance(value.columns, pd.MultiIndex) and all(isinstance(column, str) for column in value.columns)
+
+
+def get_snapshot_directory(snapshot_dir, session_id: str) -> Path:
+    """Directory of the snapshot of a session in `snapshot_dir`, named after the hash of the session id.
+
+    Args:
+        snapshot_dir (str | Path): Directory of the snapshots of all the sessions
+        session_id (str): Identifier of the session, e.g. the LangGraph thread id
+
+    Returns:
+        Path: Directory of the snapshot of the session
+    """
+    return Path(snapshot_dir) / hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+
+
+def get_state_snapshot(snapshot_dir, session_id: str) -> StateSnapshot:
+    """Snapshot of a session in `snapshot_dir`, empty if the session was never saved."""
+    return StateSnapshot(get_snapshot_directory(snapshot_dir, session_id))
+
+
+def prune_state_snapshots(snapshot_dir, max_age: float = SNAPSHOT_MAX_AGE_SECONDS) -> int:
+    """Delete the snapshots not saved for more than `max_age` seconds.
+
+    Args:
+        snapshot_dir (str | Path): Directory of the snapshots of all the sessions
+        max_age (float): Age in seconds of the oldest snapshot to keep
+
+    Returns:
+        int: Number of deleted snapshots
+    """
+    snapshot_dir = Path(snapshot_dir)
+    if not snapshot_dir.is_dir():
+        return 0
+    deleted = 0
+    for directory in snapshot_dir.iterdir():
+        manifest_path = directory / MANIFEST_NAME
+        last_saved = manifest_path.stat().st_mtime if manifest_path.exists() else directory.stat().st_mtime
+        if time.time() - last_saved > max_age:
+            shutil.rmtree(directory, ignore_errors=True)
+            deleted += 1
+    return deleted
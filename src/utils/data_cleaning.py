@@ -6,9 +6,14 @@ import re
 import unicodedata
 import json
 from pathlib import Path
+from typing import Iterable, Iterator
 import src.configs.config as cfg
 
 NULL_TOKENS = {"", "na", "n/a", "null", "none", "nan", "-"}
+# Datasets with fewer rows get their missing values filled, larger ones drop the rows with missing values
+SMALL_DATA_THRESHOLD = 100
+# Distinct values counted per column by the metadata, columns with more are reported as high-cardinality
+CARDINALITY_LIMIT = 10000
 
 # Helpers
 def normalize_colname(name: str) -> str:
@@ -68,7 +73,7 @@ def normalize_column_names(columns):
 
     return result
 
-def handle_missing_values(df: pd.DataFrame, small_data_threshold: int = 100) -> pd.DataFrame:
+def handle_missing_values(df: pd.DataFrame, small_data_threshold: int = SMALL_DATA_THRESHOLD) -> pd.DataFrame:
     """Handle missing values with different strategies based on dataset size.
 
     Args:
@@ -80,11 +85,11 @@ def handle_missing_values(df: pd.DataFrame, small_data_threshold: int = 100) ->
         - For small datasets (< threshold): Missing values are filled (numeric: median, categorical: mode or empty string)
         - For large datasets (≥ threshold): Rows with missing values are dropped
     """
-    df = df.copy()
     n_rows = len(df)
 
     if n_rows < small_data_threshold:
         # Fill missing values
+        df = df.copy()
         for c in df.columns:
             if pd.api.types.is_numeric_dtype(df[c]):
                 # Use median if available, else mean
@@ -103,6 +108,41 @@ def handle_missing_values(df: pd.DataFrame, small_data_threshold: int = 100) ->
     return df
 
 # Core logic
+def standardize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """Standardize column names, replace null-like values with None and convert columns to numeric where possible.
+
+    These steps only depend on the values of each row, so they give the same result on a whole DataFrame or on its
+    chunks. The input DataFrame is not modified.
+
+    Args:
+        df: Input pandas DataFrame.
+
+    Returns:
+        New DataFrame with standardized column names and values.
+    """
+    columns = {}
+
+    # Standardize Column Names
+    for c, name in enumerate(normalize_column_names(df.columns)):
+        column = df.iloc[:, c]
+        # Numeric columns typed by the parser are already clean, booleans go through strings below
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            columns[name] = column
+            continue
+
+        # Clean Null-like Values
+        values = (
+            column
+            .astype(str)  # Convert all values to strings
+            .str.strip()  # Remove leading/trailing whitespace
+            .replace({t: None for t in NULL_TOKENS})  # Replace null-like tokens with None
+            .where(column.notna(), None)  # Keep missing values missing, whatever their string ("None", "<NA>")
+        )
+        # Convert Columns to Numeric (Safe Conversion)
+        columns[name] = pd.to_numeric(values, errors="ignore")
+
+    return pd.DataFrame(columns, index=df.index)
+
 def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     """Clean and standardize a pandas DataFrame by performing several data quality operations.
 
@@ -119,32 +159,109 @@ def clean_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         Cleaned pandas DataFrame with standardized column names and improved data quality.
     """
-    df = df.copy()
-
-    # Standardize Column Names
-    df.columns = normalize_column_names(df.columns)
-
-    # Clean Null-like Values
-    for c in df.columns:
-        df[c] = (
-            df[c]
-            .astype(str)  # Convert all values to strings
-            .str.strip()  # Remove leading/trailing whitespace
-            .replace({t: None for t in NULL_TOKENS})  # Replace null-like tokens with None
-        )
-
-    # Convert Columns to Numeric (Safe Conversion)
-    for c in df.columns:
-        df[c] = pd.to_numeric(df[c], errors="ignore")
+    # Standardize column names, null-like values and numeric columns
+    df = standardize_dataframe(df)
 
     # Remove Duplicate Rows
     df = df.drop_duplicates()
 
     # Handle missing values
-    df = handle_missing_values(df, small_data_threshold=100)
+    df = handle_missing_values(df, small_data_threshold=SMALL_DATA_THRESHOLD)
 
     return df
 
+def clean_chunks(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Clean the chunks of a file read in pieces, like `clean_dataframe` does for a whole DataFrame.
+
+    A file read as a single chunk smaller than `SMALL_DATA_THRESHOLD` is cleaned by `clean_dataframe`, which fills
+    its missing values. Otherwise the file is large, and each chunk is standardized and drops the rows with missing
+    values and its duplicate rows. Duplicates across chunks are left to the writer of the chunks.
+
+    Args:
+        chunks: Chunks of the file, with the same columns.
+
+    Yields:
+        Cleaned chunks.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return
+    second = next(chunks, None)
+    if second is None and len(first) < SMALL_DATA_THRESHOLD:
+        yield clean_dataframe(first)
+        return
+
+    yield standardize_dataframe(first).dropna().drop_duplicates()
+    if second is not None:
+        yield standardize_dataframe(second).dropna().drop_duplicates()
+    for chunk in chunks:
+        yield standardize_dataframe(chunk).dropna().drop_duplicates()
+
+class MetadataCollector:
+    """Collect the metadata of `generate_metadata` over the chunks of a DataFrame, without keeping the chunks.
+
+    A column whose dtype differs between chunks is reported as float64 if all its chunks are numeric, object otherwise.
+    A column missing from some chunks counts their rows as nulls.
+    Distinct values are kept up to `CARDINALITY_LIMIT` per column, so the memory does not grow with the row count.
+    """
+
+    def __init__(self):
+        self.n_rows = 0
+        self.dtypes = {}
+        self.null_counts = {}
+        self.examples = {}
+        self.distinct = {}  # distinct values of each column, None beyond CARDINALITY_LIMIT
+
+    def update(self, df: pd.DataFrame):
+        """Add a chunk to the metadata.
+
+        Args:
+            df: Chunk of the DataFrame.
+        """
+        rows_before = self.n_rows
+        self.n_rows += len(df)
+        for c in self.dtypes:
+            if c not in df.columns:
+                self.null_counts[c] += len(df)
+        for c in df.columns:
+            dtype = df[c].dtype
+            if c not in self.dtypes:
+                self.dtypes[c] = dtype
+                self.null_counts[c] = rows_before
+                self.examples[c] = []
+                self.distinct[c] = set()
+            elif self.dtypes[c] != dtype:
+                both_numeric = pd.api.types.is_numeric_dtype(self.dtypes[c]) and pd.api.types.is_numeric_dtype(dtype)
+                self.dtypes[c] = pd.api.types.pandas_dtype("float64" if both_numeric else object)
+            self.null_counts[c] += int(df[c].isna().sum())
+            if len(self.examples[c]) < 3:
+                self.examples[c] += df[c].dropna().head(3 - len(self.examples[c])).tolist()
+            if self.distinct[c] is not None:
+                self.distinct[c].update(df[c].dropna().unique().tolist())
+                if len(self.distinct[c]) > CARDINALITY_LIMIT:
+                    self.distinct[c] = None
+
+    def to_frame(self) -> pd.DataFrame:
+        """Metadata of the chunks added so far, in the format of `generate_metadata`."""
+        meta = []
+
+        # Iterate through each column of the chunks
+        for c, dtype in self.dtypes.items():
+            meta.append({
+                "column_name": c,  # The name of the column
+                "dtype": str(dtype),  # Convert dtype to string for consistency
+                "null_ratio": self.null_counts[c] / self.n_rows if self.n_rows else float("nan"),  # Share of nulls
+                "example_values": json.dumps(self.examples[c]),  # Sample values from the column
+            })
+
+        meta = pd.DataFrame(meta, columns=["column_name", "dtype", "null_ratio", "example_values"])
+        # Number of distinct values, None if above CARDINALITY_LIMIT (object column, to keep the counts integers)
+        meta["distinct_values"] = pd.Series(
+            [len(values) if values is not None else None for values in self.distinct.values()], dtype=object
+        )
+        return meta
+
 def generate_metadata(df: pd.DataFrame):
     """Generate lightweight metadata about a DataFrame for agent awareness.
 
@@ -153,6 +270,7 @@ def generate_metadata(df: pd.DataFrame):
     - Data types
     - Percentage of null values in each column
     - Sample values from each column
+    - Number of distinct values in each column, up to CARDINALITY_LIMIT
 
     Args:
         df: Input pandas DataFrame to analyze.
@@ -161,18 +279,6 @@ def generate_metadata(df: pd.DataFrame):
         DataFrame containing metadata about each column in the input DataFrame.
         Each row represents one column from the original DataFrame with its metadata.
     """
-    meta = []
-
-    # Iterate through each column in the input DataFrame
-    for c in df.columns:
-        # Create a dictionary containing metadata for the current column
-        meta.append({
-            "column_name": c,  # The name of the column
-            "dtype": str(df[c].dtype),  # Convert dtype to string for consistency
-            "null_ratio": float(df[c].isna().mean()),  # Calculate percentage of null values
-            "example_values": json.dumps(       # Sample values from the column
-                df[c].dropna().head(3).tolist()
-            )
-        })
-
-    return pd.DataFrame(meta)
\ No newline at end of file
+    collector = MetadataCollector()
+    collector.update(df)
+    return collector.to_frame()
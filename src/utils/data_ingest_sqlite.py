@@ -2,7 +2,13 @@ import os, sys
 project_root = os.path.abspath(os.path.join(__file__, "../../.."))
 sys.path.insert(0, project_root)
 from pathlib import Path
+from itertools import chain
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 import pandas as pd
+import codecs
+import csv
+import hashlib
+import re
 import sqlite3
 import json
 import src.utils.data_cleaning as dc
@@ -11,7 +17,422 @@ import src.configs.config as cfg
 # Constants
 DEFAULT_DB_PATH = Path("data/temp/ingested.db")
 DEFAULT_TABLE_NAME = "data_table"
-SUPPORTED_EXTENSIONS = {".csv", ".txt", ".json", ".xls", ".xlsx"}
+SUPPORTED_EXTENSIONS = {".csv", ".txt", ".json", ".jsonl", ".ndjson", ".xls", ".xlsx"}
+JSON_EXTENSIONS = {".json", ".jsonl", ".ndjson"}
+JSON_BLOCK_CHARS = 1024 * 1024  # characters read at a time by `iter_json_values`
+BULK_LOAD_CACHE_KIB = 64 * 1024  # page cache of the connection loading a file, also its memory bound
+MAX_AUTO_INDEXES = 8  # indexes created on an ingested table, see `select_index_columns`
+KEY_COLUMN_PATTERN = re.compile(r"(^|_)(id|uuid|key|code)$")  # normalized names of likely key columns
+PERIOD_COLUMN_PATTERN = re.compile(r"(^|_)(year|quarter|month|week|day|date|period)$")  # integer filter columns
+MAX_INDEX_DISTINCT_RATIO = 0.5  # columns with more distinct values per row are measures, not filters
+MANIFEST_TABLE = "__ingest_manifest"  # one row per file ingested into a table, see `record_ingestion`
+IF_EXISTS_MODES = ("replace", "append", "upsert")
+CSV_SAMPLE_BYTES = 64 * 1024  # start of a CSV / TXT file read to sniff its format, see `sniff_csv`
+CSV_DELIMITERS = ",\t;|"
+CSV_ENCODINGS = ("utf-8", "cp1252", "latin-1")  # tried in order, latin-1 decodes any byte
+# Parser of CSV / TXT files. "pyarrow" parses faster, but turns ISO dates into date objects that take longer to clean
+# than it saves (see src/test/benchmark_ingestion.py). Chunked reads always use the C parser, which streams.
+CSV_ENGINE = "c"
+
+def quote_identifier(name: str) -> str:
+    """Quote a table or column name for SQLite."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sqlite_affinity(values: pd.Series) -> str:
+    """SQLite type affinity of a column: INTEGER for integers and booleans, REAL for floats, TEXT otherwise.
+    Object columns get the affinity of their non-null values, e.g. INTEGER for integers with None.
+    """
+    dtype = values.dtype
+    if dtype == object:
+        dtype = pd.api.types.infer_dtype(values, skipna=True)
+        return {"integer": "INTEGER", "boolean": "INTEGER", "floating": "REAL", "mixed-integer-float": "REAL"}.get(
+            dtype, "TEXT"
+        )
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+def create_table_sql(df: pd.DataFrame, table_name: str) -> str:
+    """CREATE TABLE statement with the columns of a DataFrame and their affinities, see `sqlite_affinity`."""
+    columns = ", ".join(f"{quote_identifier(c)} {sqlite_affinity(df[c])}" for c in df.columns)
+    return f"CREATE TABLE {quote_identifier(table_name)} ({columns})"
+
+def select_index_columns(meta_df: pd.DataFrame, n_rows: int) -> list:
+    """Columns worth an index, from the metadata of `data_cleaning.generate_metadata`:
+    - likely keys, named like "id", "customer_id", "key" or "code"
+    - low-cardinality columns (filters and group-bys like company or year): more than one distinct value, but at most
+      `CARDINALITY_LIMIT` and `MAX_INDEX_DISTINCT_RATIO` per row. Float columns are measures and are not indexed.
+
+    Keys come first, then text, date and period columns like "fiscal_year", then the other integer columns, which
+    are more likely measures like quantities. Within each group, the columns with the most distinct values, which are
+    the most selective, come first.
+
+    Args:
+        meta_df (pd.DataFrame): Metadata of the table
+        n_rows (int): Number of rows of the table
+
+    Returns:
+        list: Names of the columns to index, at most `MAX_AUTO_INDEXES`
+    """
+    keys, low_cardinality = [], []
+    for row in meta_df.itertuples(index=False):
+        distinct = row.distinct_values
+        if KEY_COLUMN_PATTERN.search(row.column_name):
+            keys.append(row.column_name)
+        elif (
+            distinct is not None
+            and 1 < distinct <= min(dc.CARDINALITY_LIMIT, n_rows * MAX_INDEX_DISTINCT_RATIO)
+            and not row.dtype.startswith("float")
+        ):
+            is_measure = row.dtype.startswith(("int", "uint")) and not PERIOD_COLUMN_PATTERN.search(row.column_name)
+            low_cardinality.append((is_measure, -distinct, row.column_name))
+    low_cardinality.sort()
+    return (keys + [c for *_, c in low_cardinality])[:MAX_AUTO_INDEXES]
+
+def create_indexes(conn: sqlite3.Connection, table_name: str, meta_df: pd.DataFrame, n_rows: int) -> list:
+    """Index the key and low-cardinality columns of a table (see `select_index_columns`), then ANALYZE it so the
+    query planner knows the selectivity of the indexes. The indexes are not unique: a column without duplicates in
+    one file may have some in the next, see `detect_key_column` for the key of the table instead.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        table_name (str): Name of the table
+        meta_df (pd.DataFrame): Metadata of the table
+        n_rows (int): Number of rows of the table
+
+    Returns:
+        list: Names of the indexed columns
+    """
+    columns = select_index_columns(meta_df, n_rows)
+    for c in columns:
+        index = f"{quote_identifier(f'idx_{table_name}_{c}')} ON {quote_identifier(table_name)} ({quote_identifier(c)})"
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {index}")
+    conn.execute(f"ANALYZE {quote_identifier(table_name)}")
+    return columns
+
+def detect_key_column(conn: sqlite3.Connection, table_name: str, columns: Iterable[str]) -> Optional[str]:
+    """First column named like a key (see `KEY_COLUMN_PATTERN`) with neither NULL nor duplicate values in a table,
+    None if there is none. It is recorded in the manifest as the key of the table, see `find_key_column`.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        table_name (str): Name of the table
+        columns (Iterable[str]): Candidate columns, e.g. the indexed ones so the counts read their index
+
+    Returns:
+        Optional[str]: Name of the key column
+    """
+    for c in columns:
+        if not KEY_COLUMN_PATTERN.search(c):
+            continue
+        n_rows, n_values, n_distinct = conn.execute(
+            f"SELECT COUNT(*), COUNT({quote_identifier(c)}), COUNT(DISTINCT {quote_identifier(c)}) "
+            f"FROM {quote_identifier(table_name)}"
+        ).fetchone()
+        if n_rows == n_values == n_distinct:
+            return c
+    return None
+
+def find_key_column(conn: sqlite3.Connection, table_name: str) -> Optional[str]:
+    """Key column of a table recorded in the manifest when it was last replaced, None if there is none."""
+    if "key_column" not in get_table_columns(conn, MANIFEST_TABLE):
+        return None
+    row = conn.execute(
+        f"SELECT key_column FROM {quote_identifier(MANIFEST_TABLE)} WHERE table_name = ? ORDER BY rowid DESC LIMIT 1",
+        (table_name,),
+    ).fetchone()
+    return row[0] if row else None
+
+def get_table_columns(conn: sqlite3.Connection, table_name: str) -> list:
+    """Column names of a table, empty if it does not exist."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table_name)})").fetchall()]
+
+def file_content_hash(file_path: Path) -> str:
+    """SHA-256 of the content of a file, read in blocks."""
+    with open(file_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def find_ingestion(db_path: Path, table_name: str, content_hash: str) -> Optional[dict]:
+    """Manifest entry of a file with this content hash already ingested into the table, None if there is none
+    or the table was dropped since.
+
+    Args:
+        db_path (Path): Path to SQLite database
+        table_name (str): Name of the table
+        content_hash (str): Hash of the file, see `file_content_hash`
+
+    Returns:
+        Optional[dict]: The manifest entry
+    """
+    if not db_path.exists():
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        if not get_table_columns(conn, MANIFEST_TABLE) or not get_table_columns(conn, table_name):
+            return None
+        cursor = conn.execute(
+            f"SELECT * FROM {quote_identifier(MANIFEST_TABLE)} WHERE table_name = ? AND content_hash = ?",
+            (table_name, content_hash),
+        )
+        row = cursor.fetchone()
+        return dict(zip([column[0] for column in cursor.description], row)) if row else None
+    finally:
+        conn.close()
+
+def record_ingestion(
+    conn: sqlite3.Connection,
+    table_name: str,
+    source: str,
+    content_hash: str,
+    row_count: int,
+    schema: dict,
+    mode: str,
+    key_column: Optional[str] = None,
+    ):
+    """Add a file to the manifest of the ingested files. Replacing a table forgets the files ingested before.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database, in the transaction of the ingestion
+        table_name (str): Name of the table the file was ingested into
+        source (str): Name of the file
+        content_hash (str): Hash of the file, see `file_content_hash`
+        row_count (int): Number of rows of the file written to the table
+        schema (dict): Affinity of each column of the table
+        mode (str): How the rows were written, one of `IF_EXISTS_MODES`
+        key_column (str): Key column of the table, see `detect_key_column`
+    """
+    manifest = quote_identifier(MANIFEST_TABLE)
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {manifest} ("
+        "table_name TEXT, source TEXT, content_hash TEXT, row_count INTEGER, schema TEXT, mode TEXT, "
+        "ingested_at TEXT DEFAULT CURRENT_TIMESTAMP, key_column TEXT)"
+    )
+    if "key_column" not in get_table_columns(conn, MANIFEST_TABLE):
+        conn.execute(f"ALTER TABLE {manifest} ADD COLUMN key_column TEXT")  # manifest written by a previous version
+    if mode == "replace":
+        conn.execute(f"DELETE FROM {manifest} WHERE table_name = ?", (table_name,))
+    conn.execute(
+        f"INSERT INTO {manifest} (table_name, source, content_hash, row_count, schema, mode, key_column) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (table_name, source, content_hash, row_count, json.dumps(schema), mode, key_column),
+    )
+
+def resolve_if_exists(conn: sqlite3.Connection, table_name: str, columns: list, if_exists: str) -> str:
+    """Mode actually used to write rows with these columns to a table: a table is replaced when it does not exist
+    yet or has other columns, and an upsert appends when the table has no key column.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        table_name (str): Name of the table
+        columns (list): Columns of the rows to write
+        if_exists (str): Requested mode, one of `IF_EXISTS_MODES`
+
+    Returns:
+        str: The mode to use
+    """
+    if if_exists not in IF_EXISTS_MODES:
+        raise ValueError(f"Unsupported if_exists: {if_exists}. Supported modes: {list(IF_EXISTS_MODES)}")
+    if if_exists == "replace":
+        return if_exists
+    existing = get_table_columns(conn, table_name)
+    if existing != list(columns):
+        if existing:
+            print(f"[WARN] Schema of {table_name} changed, replacing the table instead of {if_exists}")
+        return "replace"
+    if if_exists == "upsert" and find_key_column(conn, table_name) is None:
+        print(f"[WARN] No key column found in {table_name}, appending the rows instead of upserting")
+        return "append"
+    return if_exists
+
+def connect_bulk_load(db_path: Path) -> sqlite3.Connection:
+    """Open a connection tuned for loading a file: WAL journal, no sync to disk until the load is committed and a
+    large page cache. Transactions are explicit (BEGIN / COMMIT), see `write_chunks`.
+
+    Args:
+        db_path (Path): Path to SQLite database
+
+    Returns:
+        sqlite3.Connection: The connection, to close with `finish_bulk_load`
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(f"PRAGMA cache_size=-{BULK_LOAD_CACHE_KIB}")
+    return conn
+
+def finish_bulk_load(conn: sqlite3.Connection):
+    """Sync the loaded data to disk, move it from the WAL into the database file and close the connection."""
+    try:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+def write_chunks(
+    conn: sqlite3.Connection,
+    chunks: Iterable[pd.DataFrame],
+    table_name: str,
+    if_exists: str = "replace",
+    ) -> int:
+    """Write the rows of the chunks to a table. With "replace", the table is created from the columns of the first
+    chunk, with their affinities (see `sqlite_affinity`). With "append" and "upsert" the table must exist with the
+    same columns (see `resolve_if_exists`), and the rows are inserted after the existing ones: `merge_on_key` then
+    resolves the rows sharing a key.
+    Columns first seen in a later chunk, like keys of JSON records, are added to the table, NULL in the previous rows.
+    Must run inside a transaction, so readers keep the previous table until the new one is committed.
+
+    Args:
+        conn (sqlite3.Connection): Connection opened by `connect_bulk_load`
+        chunks (Iterable[pd.DataFrame]): Chunks to write
+        table_name (str): Name of the table to write
+        if_exists (str): One of `IF_EXISTS_MODES`. Defaults to "replace"
+
+    Returns:
+        int: Number of written chunks
+    """
+    table = quote_identifier(table_name)
+    if if_exists == "replace":
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+    n_chunks = 0
+    columns, inserts = set(), {}
+    for chunk in chunks:
+        if n_chunks == 0:
+            if if_exists == "replace":
+                conn.execute(create_table_sql(chunk, table_name))
+            columns = set(get_table_columns(conn, table_name))
+        for c in chunk.columns:
+            if c not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {quote_identifier(c)} {sqlite_affinity(chunk[c])}")
+                columns.add(c)
+
+        names = tuple(chunk.columns)
+        if names not in inserts:
+            inserts[names] = (
+                f"INSERT INTO {table} ({', '.join(quote_identifier(c) for c in names)}) "
+                f"VALUES ({', '.join('?' * len(names))})"
+            )
+        # Series iteration gives python scalars, which sqlite3 binds (NaN is stored as NULL)
+        conn.executemany(inserts[names], chunk.itertuples(index=False, name=None))
+        n_chunks += 1
+    return n_chunks
+
+def drop_duplicate_rows(conn: sqlite3.Connection, table_name: str, columns: Iterable[str], after_rowid: int = 0):
+    """Delete the rows of a table equal to a previous row, like `DataFrame.drop_duplicates` does.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        table_name (str): Name of the table
+        columns (Iterable[str]): Columns of the table
+        after_rowid (int): Only compare the rows after this rowid, e.g. the rows appended by an ingestion
+    """
+    conn.execute(
+        f"DELETE FROM {quote_identifier(table_name)} WHERE rowid > ? AND rowid NOT IN ("
+        f"SELECT MIN(rowid) FROM {quote_identifier(table_name)} WHERE rowid > ? "
+        f"GROUP BY {', '.join(quote_identifier(c) for c in columns)})",
+        (after_rowid, after_rowid),
+    )
+
+def merge_on_key(conn: sqlite3.Connection, table_name: str, key: str, after_rowid: int, if_exists: str):
+    """Keep one row per key among the rows written after `after_rowid` and the rows before them. "append" keeps the
+    existing row and the first new one, like an insert skipping the keys already there. "upsert" keeps the last new
+    row and deletes the existing one. Rows without a key are all kept.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        table_name (str): Name of the table
+        key (str): Key column of the table, see `find_key_column`
+        after_rowid (int): Last rowid before the new rows were written
+        if_exists (str): "append" or "upsert"
+    """
+    table, key = quote_identifier(table_name), quote_identifier(key)
+    new_rows = f"SELECT {'MIN' if if_exists == 'append' else 'MAX'}(rowid) FROM {table} WHERE rowid > ? GROUP BY {key}"
+    conn.execute(
+        f"DELETE FROM {table} WHERE rowid > ? AND {key} IS NOT NULL AND rowid NOT IN ({new_rows})",
+        (after_rowid, after_rowid),
+    )
+    if if_exists == "append":
+        conn.execute(
+            f"DELETE FROM {table} WHERE rowid > ? AND {key} IN (SELECT {key} FROM {table} WHERE rowid <= ?)",
+            (after_rowid, after_rowid),
+        )
+    else:
+        conn.execute(
+            f"DELETE FROM {table} WHERE rowid <= ? AND {key} IN (SELECT {key} FROM {table} WHERE rowid > ?)",
+            (after_rowid, after_rowid),
+        )
+
+def persist_chunks_to_sqlite(
+    chunks: Iterable[pd.DataFrame],
+    db_path: Path,
+    table_name: str,
+    if_exists: str = "replace",
+    source: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    ) -> Tuple[int, pd.DataFrame]:
+    """Save cleaned chunks and their metadata to SQLite, in a single transaction. Only one chunk is in memory at a
+    time, duplicate rows across chunks are deleted once all of them are written. Key and low-cardinality columns
+    are then indexed, see `create_indexes`.
+
+    Appends and upserts keep the existing rows, indexes and metadata table of the table, and only write the new rows.
+    On the key of the table, an append skips the rows whose key exists and an upsert replaces them, see
+    `merge_on_key`. They fall back to a replace when the columns differ, see `resolve_if_exists`.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Cleaned chunks, see `data_cleaning.clean_chunks`
+        db_path (Path): Path to SQLite database
+        table_name (str): Name of the table to write
+        if_exists (str): One of `IF_EXISTS_MODES`. Defaults to "replace"
+        source (str): Name of the ingested file, recorded in the manifest with its content_hash
+        content_hash (str): Hash of the ingested file, see `file_content_hash`. No manifest entry is written if None
+
+    Returns:
+        Tuple[int, pd.DataFrame]: Number of written rows and their metadata
+    """
+    collector = dc.MetadataCollector()
+
+    def collect(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        for chunk in chunks:
+            collector.update(chunk)
+            yield chunk
+
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError(f"No rows to ingest into {table_name}")
+
+    table = quote_identifier(table_name)
+    conn = connect_bulk_load(db_path)
+    try:
+        conn.execute("BEGIN")
+        try:
+            mode = resolve_if_exists(conn, table_name, list(first.columns), if_exists)
+            last_rowid = 0 if mode == "replace" else conn.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+            key = None if mode == "replace" else find_key_column(conn, table_name)
+            n_chunks = write_chunks(conn, collect(chain([first], chunks)), table_name, mode)
+            if n_chunks > 1:
+                drop_duplicate_rows(conn, table_name, list(collector.dtypes), after_rowid=last_rowid)
+            if key is not None:
+                merge_on_key(conn, table_name, key, last_rowid, mode)
+            if n_chunks > 1 or key is not None:
+                collector.n_rows = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE rowid > ?", (last_rowid,)).fetchone()[0]
+            meta_df = collector.to_frame()
+            if mode == "replace":
+                write_chunks(conn, [meta_df], f"{table_name}__meta")
+                key = detect_key_column(conn, table_name, create_indexes(conn, table_name, meta_df, collector.n_rows))
+            else:
+                conn.execute(f"ANALYZE {table}")
+            if content_hash is not None:
+                schema = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+                record_ingestion(conn, table_name, source, content_hash, collector.n_rows, schema, mode, key)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        finish_bulk_load(conn)
+    return collector.n_rows, meta_df
 
 def persist_to_sqlite(
     df: pd.DataFrame,
@@ -19,7 +440,7 @@ def persist_to_sqlite(
     db_path: Path,
     table_name: str
     ):
-    """Save pandas dataframe and metadata to SQLite.
+    """Save pandas dataframe and metadata to SQLite, indexing its key and low-cardinality columns.
 
     Args:
         df (pd.DataFrame): DataFrame to save
@@ -30,30 +451,221 @@ def persist_to_sqlite(
     Returns:
         None
     """
-    conn = sqlite3.connect(db_path)
-    df.to_sql(table_name, conn, if_exists="replace", index=False)
-    meta_df.to_sql(f"{table_name}__meta", conn, if_exists="replace", index=False)
-    conn.commit()
-    conn.close()
+    conn = connect_bulk_load(db_path)
+    try:
+        conn.execute("BEGIN")
+        try:
+            write_chunks(conn, [df], table_name)
+            write_chunks(conn, [meta_df], f"{table_name}__meta")
+            create_indexes(conn, table_name, meta_df, len(df))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        finish_bulk_load(conn)
+
+def sniff_encoding(sample: bytes) -> str:
+    """
+    Encoding of a sample of a text file: from its byte order mark, else the first of `CSV_ENCODINGS` decoding it.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    for encoding in CSV_ENCODINGS:
+        try:
+            # Incremental decoder: a character cut at the end of the sample is not an error
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return CSV_ENCODINGS[-1]
+
+def sniff_csv(path: Path) -> Dict[str, Any]:
+    """
+    Sniff the encoding, delimiter, quote character and header of a CSV or TXT file from its first
+    `CSV_SAMPLE_BYTES`, so the file can be parsed by the C or Arrow engine instead of the slow python one.
+    The first row is the header, unless all its fields are numbers and `csv.Sniffer` finds no header: a header may
+    hold numbers, like the years of "company,2021,2022".
+
+    Args:
+        path (Path): Path to the file
+
+    Returns:
+        Dict[str, Any]: Arguments of `pd.read_csv` for the file
+    """
+    with open(path, "rb") as f:
+        sample = f.read(CSV_SAMPLE_BYTES)
+    encoding = sniff_encoding(sample)
+    text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+    # Complete lines only, the sample may end in the middle of a row
+    lines = text.splitlines()
+    if len(lines) > 1 and len(sample) == CSV_SAMPLE_BYTES:
+        lines = lines[:-1]
+    text = "\n".join(lines)
+
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(text, delimiters=CSV_DELIMITERS)
+        sep, quotechar, skipinitialspace = dialect.delimiter, dialect.quotechar, dialect.skipinitialspace
+    except csv.Error:
+        sep, quotechar, skipinitialspace = ",", '"', False
+    options = {"sep": sep, "quotechar": quotechar, "encoding": encoding}
+    if skipinitialspace:
+        options["skipinitialspace"] = True
+
+    first_row = next(csv.reader(lines[:1], delimiter=sep, quotechar=quotechar), [])
+    try:
+        has_header = sniffer.has_header(text)
+    except csv.Error:
+        has_header = True
+    if not has_header and first_row and all(_is_number(field) for field in first_row):
+        options["header"] = None
+        options["names"] = [f"column_{i + 1}" for i in range(len(first_row))]
+    return options
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def read_csv_options(path: Path, chunked: bool = False) -> Dict[str, Any]:
+    """
+    Arguments of `pd.read_csv` for a CSV or TXT file: its sniffed format (see `sniff_csv`) and the parser engine.
+    """
+    options = sniff_csv(path)
+    # The Arrow engine neither streams chunks nor skips spaces after delimiters
+    engine = "c" if chunked or options.get("skipinitialspace") else CSV_ENGINE
+    return {**options, "engine": engine}
 
 def read_csv_or_txt(path: Path) -> pd.DataFrame:
     """
     Read CSV or TXT file.
-    TXT is assumed to be delimiter-based (comma, tab, or pipe auto-detected).
+    TXT is assumed to be delimiter-based (comma, tab, semicolon or pipe auto-detected).
+    """
+    return pd.read_csv(path, **read_csv_options(path))
+
+def iter_json_values(path: Path) -> Iterator[Any]:
+    """
+    Parse a JSON file incrementally, yielding its values one at a time:
+    - the elements of a top-level array
+    - the values of newline-delimited JSON (NDJSON / JSON lines) or of any whitespace-separated JSON values
+    - a single top-level object
+    Only one block of the file and the value being parsed are in memory. A top-level array within the first block
+    followed by more values is a line of NDJSON, like "[1, 2]\n[3, 4]", and yields whole arrays.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buffer, pos = "", 0
+        in_array = None
+
+        def read_more(size: int = JSON_BLOCK_CHARS) -> bool:
+            """Append the next block of the file to the unparsed part of the buffer, False at the end of the file."""
+            nonlocal buffer, pos
+            block = f.read(size)
+            if block:
+                buffer, pos = buffer[pos:] + block, 0
+            return bool(block)
+
+        def skip(separators: str) -> bool:
+            """Move past the separators, False at the end of the file."""
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in separators:
+                    pos += 1
+                if pos < len(buffer) or not read_more():
+                    return pos < len(buffer)
+
+        while True:
+            # Skip the whitespace, and the commas between the elements of an array
+            if not skip(" \t\r\n," if in_array else " \t\r\n"):
+                if in_array:
+                    raise ValueError(f"Unterminated JSON array in {path}")
+                return
+            if in_array is None:
+                in_array = buffer[pos] == "["
+                if in_array:
+                    try:
+                        value, end = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        pos += 1  # the array goes past the first block: parse its elements one at a time
+                        continue
+                    pos = end
+                    if skip(" \t\r\n"):
+                        in_array = False
+                        yield value
+                    else:
+                        yield from value
+                        return
+                continue
+            if in_array and buffer[pos] == "]":
+                pos += 1
+                if skip(" \t\r\n"):
+                    raise ValueError(f"Unexpected content after the top-level JSON array in {path}")
+                return
+
+            # Parse a value, reading larger blocks until it is complete. A value ending with the buffer, or a number
+            # followed by a number character ("2." of "2.5"), may be cut: it is parsed again with the next block.
+            size = JSON_BLOCK_CHARS
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    cut = end == len(buffer) or (isinstance(value, (int, float)) and buffer[end] in ".eE+-0123456789")
+                    if not cut or not read_more(size):
+                        break
+                except json.JSONDecodeError:
+                    if not read_more(size):
+                        raise
+                size *= 2
+            pos = end
+            yield value
+
+def json_records_to_frame(records: list) -> pd.DataFrame:
     """
-    return pd.read_csv(path, sep=None, engine="python")
+    DataFrame of JSON records, nested objects flattened into columns ("address.city").
+    Records that are not objects become a "value" column.
+    """
+    return pd.json_normalize([record if isinstance(record, dict) else {"value": record} for record in records])
+
+def iter_json_chunks(path: Path, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Read a JSON file in chunks of `chunksize` records, see `iter_json_values`.
+    A file holding a single object of lists (columns) is read as a single chunk.
+    """
+    values = iter_json_values(path)
+    first = next(values, None)
+    if first is None:
+        return
+    second = next(values, None)
+    if second is None and isinstance(first, dict) and first and all(isinstance(v, list) for v in first.values()):
+        with open(path, "r", encoding="utf-8-sig") as f:
+            in_array = f.read(JSON_BLOCK_CHARS).lstrip().startswith("[")
+        if not in_array:
+            yield pd.DataFrame(first)
+            return
+
+    records = []
+    for value in chain([first], [] if second is None else [second], values):
+        records.append(value)
+        if len(records) >= chunksize:
+            yield json_records_to_frame(records)
+            records = []
+    if records:
+        yield json_records_to_frame(records)
 
 def read_json(path: Path) -> pd.DataFrame:
     """
-    Read JSON file.
+    Read JSON file, nested objects are flattened into columns.
     Supports:
     - list of dicts
     - dict of lists
+    - newline-delimited JSON (one dict per line)
     """
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    return pd.DataFrame(data)
+    chunks = list(iter_json_chunks(path, chunksize=100_000))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
 
 def read_excel(path: Path) -> pd.DataFrame:
     """
@@ -72,7 +684,7 @@ def load_dataframe(file_path: Path) -> pd.DataFrame:
         return read_csv_or_txt(file_path)
     elif ext == ".txt":
         return read_csv_or_txt(file_path)
-    elif ext == ".json":
+    elif ext in JSON_EXTENSIONS:
         return read_json(file_path)
     elif ext in {".xls", ".xlsx"}:
         return read_excel(file_path)
@@ -82,23 +694,58 @@ def load_dataframe(file_path: Path) -> pd.DataFrame:
             f"Supported types: {sorted(SUPPORTED_EXTENSIONS)}"
         )
 
+def iter_dataframe_chunks(file_path: Path, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Read a file in chunks of `chunksize` rows, dispatching on the file extension.
+    CSV, TXT and JSON files are streamed. Excel files are read whole and yielded as a single chunk.
+    """
+    ext = file_path.suffix.lower()
+
+    if ext in {".csv", ".txt"}:
+        with pd.read_csv(file_path, chunksize=chunksize, **read_csv_options(file_path, chunked=True)) as reader:
+            yield from reader
+    elif ext in JSON_EXTENSIONS:
+        yield from iter_json_chunks(file_path, chunksize)
+    else:
+        yield load_dataframe(file_path)
+
+def read_table_metadata(db_path: Path, table_name: str) -> pd.DataFrame:
+    """Metadata table written by the ingestion of a table."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query(f"SELECT * FROM {quote_identifier(f'{table_name}__meta')}", conn)
+    finally:
+        conn.close()
+
 def ingest_file_sqlite(
     file_path: str,
     db_path: str = str(DEFAULT_DB_PATH),
     table_name: str = DEFAULT_TABLE_NAME,
+    chunksize: Optional[int] = None,
+    if_exists: str = "replace",
     ):
     """
-    Ingest CSV, TXT, JSON, or Excel file into SQLite with cleaning + metadata.
+    Ingest CSV, TXT, JSON (or NDJSON), or Excel file into SQLite with cleaning + metadata.
+
+    Every ingested file is recorded in the manifest table of the DB (`MANIFEST_TABLE`) with its content hash, row
+    count and schema. A file already ingested into the table is skipped.
 
     Args:
         file_path (str): Path to input file
         db_path (str): SQLite DB path
         table_name (str): SQLite table name
+        chunksize (int): Rows read, cleaned and written at a time. The file is streamed with a bounded memory instead
+            of being loaded whole. Defaults to None (load the whole file)
+        if_exists (str): What to do if the table exists: "replace" it, "append" the rows or "upsert" them on the
+            key column of the table. Appends and upserts need the same columns, the table is replaced otherwise.
+            Defaults to "replace"
 
     Returns:
-        clean_df, meta_df
+        clean_df, meta_df. clean_df is None with a chunksize, as the file is never loaded whole, or if the file was
+        skipped
     """
     file_path = Path(file_path)
+    db_path = Path(db_path)
 
     if not file_path.exists():
         raise FileNotFoundError(f"File not found: {file_path}")
@@ -109,37 +756,53 @@ def ingest_file_sqlite(
             f"Supported types: {sorted(SUPPORTED_EXTENSIONS)}"
         )
 
-    # Load
-    df = load_dataframe(file_path)
+    # Skip a file already ingested into the table
+    content_hash = file_content_hash(file_path)
+    ingestion = find_ingestion(db_path, table_name, content_hash)
+    if ingestion is not None:
+        print(f"[OK] Skipped {file_path.name}, unchanged since {ingestion['ingested_at']}")
+        print(f"Table: {table_name}")
+        return None, read_table_metadata(db_path, table_name)
 
-    # Clean + metadata
-    clean_df = dc.clean_dataframe(df)
-    meta_df = dc.generate_metadata(clean_df)
+    # Stream: read, clean and persist a chunk at a time
+    if chunksize:
+        clean_df = None
+        chunks = dc.clean_chunks(iter_dataframe_chunks(file_path, chunksize))
+    # Load + clean
+    else:
+        clean_df = dc.clean_dataframe(load_dataframe(file_path))
+        chunks = [clean_df]
 
-    # Persist
-    persist_to_sqlite(
-        clean_df,
-        meta_df,
-        Path(db_path),
-        table_name
+    # Persist + metadata
+    n_rows, meta_df = persist_chunks_to_sqlite(
+        chunks,
+        db_path,
+        table_name,
+        if_exists=if_exists,
+        source=file_path.name,
+        content_hash=content_hash
     )
 
     print(f"[OK] Ingested {file_path.name}")
     print(f"Table: {table_name}")
-    print(f"Rows: {len(clean_df)}")
-    print("Columns:", list(clean_df.columns))
+    print(f"Rows: {n_rows}")
+    print("Columns:", list(meta_df["column_name"]))
 
     return clean_df, meta_df
 
 if __name__ == "__main__":
 
     import argparse
-    parser = argparse.ArgumentParser(description="Ingest a csv | txt | json | xls | xlsx into the sqlite db")
-    parser.add_argument("--file_path", type=str, default="data/in/financials.csv", help="Path to a csv | txt | json | xls | xlsx  file to ingest")
+    parser = argparse.ArgumentParser(description="Ingest a csv | txt | json | jsonl | xls | xlsx into the sqlite db")
+    parser.add_argument("--file_path", type=str, default="data/in/financials.csv", help="Path to a csv | txt | json | jsonl | xls | xlsx  file to ingest")
+    parser.add_argument("--chunksize", type=int, default=cfg.INGEST_CHUNK_ROWS, help="Rows ingested at a time, 0 to load the whole file")
+    parser.add_argument("--if_exists", type=str, default=cfg.INGEST_IF_EXISTS, choices=IF_EXISTS_MODES, help="What to do if the table exists")
     args = parser.parse_args()
 
     ingest_file_sqlite(
-        file_path=args.file_path,  # csv | txt | json | xls | xlsx
+        file_path=args.file_path,  # csv | txt | json | jsonl | ndjson | xls | xlsx
         db_path="data/temp/ingested.db",
-        table_name="financials"
+        table_name="financials",
+        chunksize=args.chunksize,
+        if_exists=args.if_exists
     )
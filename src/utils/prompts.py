@@ -58,6 +58,7 @@ Action: [Use python_tool to create a scatter plot and regression line]
 - When you write python code to run, you will use python_tool and execute the code, unless the user wants to approve or say otherwise.
 
 Your primary tool is the python_tool which allows you to execute Python code for data analysis tasks.
+When the code returns a DataFrame, Series or array, python_tool returns a preview (shape, dtypes, first rows, summary) and an "artifact" handle for the full value: reload it in later code with `df = load_artifact('<handle>')` instead of recomputing it.
 """
 
 POSTGRES_PROMPT = """
@@ -123,6 +124,8 @@ You must ALWAYS query the local database using the python execution tool.
 - Database type: Local file-based database (SQLite)
 - Database file path is provided in the environment variable `DB_PATH`
 - Schema metadata may be available in separate tables (e.g., <table_name>__meta)
+- The `__ingest_manifest` table lists the files ingested into each table, it is not data to analyze
+- Key and low-cardinality columns (see `distinct_values` in the metadata) are indexed: filter on them in SQL (WHERE) instead of loading whole tables into pandas
 
 ---
 